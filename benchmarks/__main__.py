@@ -0,0 +1,135 @@
+import argparse
+import json
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from filmio.audio_fixer import MatchBackends, DEFAULT_IO_JOBS, ANALYSIS_RATE
+from .synthetic_shoot import ShootSettings, DTYPES, generate_shoot, load_shoot
+from .stages import STAGES, run_stage
+
+OPTION_TO_BACKEND = {
+    'fft': MatchBackends.FFT,
+    'praat': MatchBackends.PRAAT,
+    'fingerprint': MatchBackends.FINGERPRINT,
+}
+
+# Columns of the printed report, as (heading, result key, format)
+COLUMNS = [
+    ('stage', 'stage', '{}'),
+    ('seconds', 'seconds', '{:.2f}'),
+    ('items/s', 'items_per_second', '{:.2f}'),
+    ('x realtime', 'realtime', '{:.1f}'),
+    ('MB/s', 'mb_per_second', '{:.1f}'),
+    ('peak RSS MB', 'peak_rss_mb', '{:.0f}'),
+    ('correct', 'correct', '{:.0%}'),
+    ('mean err ms', 'mean_error_ms', '{:.3f}'),
+    ('max err ms', 'max_error_ms', '{:.3f}'),
+]
+
+def format_report(results):
+    rows = [[heading for heading, _, _ in COLUMNS]]
+    for result in results:
+        rows.append([fmt.format(result[key]) if result.get(key) is not None else '-' for _, key, fmt in COLUMNS])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+    return '\n'.join('  '.join(cell.rjust(width) for cell, width in zip(row, widths)) for row in rows)
+
+# Use the shoot already in shoot_dir if it was generated with the same settings, otherwise generate it
+def prepare_shoot(shoot_dir, settings):
+    shoot = load_shoot(shoot_dir)
+    if shoot is not None and shoot['settings'] == settings._asdict():
+        print(f"Using the shoot in {shoot_dir}")
+        return shoot
+    print(f"Generating {settings.recorders} recorders and {settings.clips} clips in {shoot_dir}...")
+    return generate_shoot(shoot_dir, settings)
+
+def main():
+    parser = argparse.ArgumentParser(description='Time filmio on a synthetic shoot, with known offsets to check matches against')
+
+    parser.add_argument('--shoot_dir',
+        help='Directory to generate the shoot in, which is reused by later runs with the same shoot settings. '
+             'Default is a temporary directory, removed afterwards.')
+    parser.add_argument('--stages', nargs='*', choices=list(STAGES), default=list(STAGES),
+        help='Stages to time. Default is all of them.')
+    parser.add_argument('--json',
+        help='Also write the results to this file as JSON.')
+    parser.add_argument('-v', '--verbose', action='store_true',
+        help='Show what each stage prints.')
+
+    defaults = ShootSettings()
+    parser.add_argument('--recorders', type=int, default=defaults.recorders,
+        help=f'Number of external audio files. Default is {defaults.recorders}.')
+    parser.add_argument('--recorder_length', type=float, default=defaults.recorder_length,
+        help=f'Seconds in each external audio file. Default is {defaults.recorder_length}.')
+    parser.add_argument('--rate', type=int, default=defaults.rate,
+        help=f'Sampling frequency of the external audio files. Default is {defaults.rate}.')
+    parser.add_argument('--dtype', choices=list(DTYPES), default=defaults.dtype,
+        help=f'Sample format of the external audio files. Default is {defaults.dtype}.')
+    parser.add_argument('--clips', type=int, default=defaults.clips,
+        help=f'Number of video clips. Default is {defaults.clips}.')
+    parser.add_argument('--clip_length', type=float, default=defaults.clip_length,
+        help=f'Seconds in each video clip. Default is {defaults.clip_length}.')
+    parser.add_argument('--video_rate', type=int, default=defaults.video_rate,
+        help=f'Sampling frequency of the video clips\' audio. Default is {defaults.video_rate}.')
+    parser.add_argument('--snr', type=float, default=defaults.snr,
+        help=f'Signal to noise ratio in dB of the video clips\' audio. Default is {defaults.snr}.')
+    parser.add_argument('--max_gain', type=float, default=defaults.max_gain,
+        help=f'Largest gain in dB, either way, applied to the video clips\' audio. Default is {defaults.max_gain}.')
+    parser.add_argument('--video_ext', choices=['mov', 'mp4'], default=defaults.video_ext,
+        help=f'Container for the video clips. mov keeps PCM audio, mp4 encodes it to AAC. Default is {defaults.video_ext}.')
+    parser.add_argument('--seed', type=int, default=defaults.seed,
+        help=f'Seed for generating the shoot. Default is {defaults.seed}.')
+
+    parser.add_argument('-b', '--backend', choices=list(OPTION_TO_BACKEND), default='fft',
+        help='Method used to cross correlate audio when matching. Default is fft.')
+    parser.add_argument('-k', '--top_k', type=int, default=0,
+        help='Shortlist this many audio files per video before matching. Default is 0.')
+    parser.add_argument('-w', '--windows', type=int, default=0,
+        help='Match by voting between this many windows. Default is 0.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='Number of processes to match videos with. Default is 1.')
+    parser.add_argument('--io_jobs', type=int, default=DEFAULT_IO_JOBS,
+        help=f'Number of ffmpeg processes to run at once. Default is {DEFAULT_IO_JOBS}.')
+    parser.add_argument('-s', '--stream', action='store_true',
+        help='Patch in streaming mode.')
+    parser.add_argument('--analysis_rate', type=int, default=ANALYSIS_RATE,
+        help=f'Sampling frequency used for matching. Default is {ANALYSIS_RATE}.')
+
+    args = parser.parse_args()
+
+    settings = ShootSettings(args.recorders, args.recorder_length, args.rate, args.dtype, args.clips, args.clip_length,
+                             args.video_rate, args.snr, args.max_gain, args.video_ext, args.seed)
+    options = {
+        'verbose': args.verbose,
+        'backend': OPTION_TO_BACKEND[args.backend],
+        'top_k': args.top_k,
+        'windows': args.windows,
+        'jobs': args.jobs,
+        'io_jobs': args.io_jobs,
+        'stream': args.stream,
+        'analysis_rate': args.analysis_rate,
+    }
+
+    shoot_dir = args.shoot_dir or tempfile.mkdtemp(prefix='filmio_shoot_')
+    work_dir = tempfile.mkdtemp(prefix='filmio_bench_')
+    try:
+        shoot = prepare_shoot(shoot_dir, settings)
+        results = []
+        for name in args.stages:
+            print(f"Timing {name}...")
+            # Each stage runs in a fresh process, so its peak memory isn't hidden by an earlier stage's
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                results.append(executor.submit(run_stage, name, shoot, work_dir, options).result())
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if not args.shoot_dir:
+            shutil.rmtree(shoot_dir, ignore_errors=True)
+
+    print()
+    print(format_report(results))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'shoot': shoot['settings'], 'options': {**options, 'backend': args.backend}, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
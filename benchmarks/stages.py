@@ -0,0 +1,162 @@
+import sys
+from os import path, makedirs
+from io import StringIO
+from contextlib import redirect_stdout
+from time import perf_counter
+try:
+    import resource
+except ImportError: # Not available on Windows, where peak memory isn't reported
+    resource = None
+import numpy as np
+from filmio.audio_fixer import AudioFixer, Modes
+from filmio.audio_util import get_max_gain, extract_audio, trim_data, read_wav_file
+from filmio.wav_io import padded_slice
+
+# Linux keeps the peak resident set size of a process across exec, so a fresh process starts out
+# with the peak of the one that started it, unless it is reset
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+# Largest resident set size of this process since reset_peak_rss, in MB, or None if it can't be measured
+# Memory used by ffmpeg and match worker processes isn't included
+def peak_rss():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and kilobytes elsewhere
+    return usage / 2 ** 20 if sys.platform == 'darwin' else usage / 2 ** 10
+
+def timing(name, seconds, items, audio_seconds, audio_bytes=None):
+    return {
+        'stage': name,
+        'seconds': seconds,
+        'items': items,
+        'items_per_second': items / seconds if seconds else None,
+        'realtime': audio_seconds / seconds if seconds else None,
+        'mb_per_second': audio_bytes / 2 ** 20 / seconds if audio_bytes and seconds else None,
+    }
+
+# Set up an AudioFixer on the shoot with the matcher options being benchmarked
+# Matches stored by earlier runs are ignored, so every pair is matched again
+def shoot_fixer(shoot_dir, out_dir, mode, options):
+    audio_fixer = AudioFixer(options['verbose'])
+    audio_fixer.setMode(mode)
+    audio_fixer.setMatchBackend(options['backend'])
+    audio_fixer.setTopK(options['top_k'])
+    audio_fixer.setJobs(options['jobs'])
+    audio_fixer.setIOJobs(options['io_jobs'])
+    audio_fixer.setStream(options['stream'])
+    audio_fixer.setWindows(options['windows'])
+    audio_fixer.setAnalysisRate(options['analysis_rate'])
+    audio_fixer.setRematch(True)
+    audio_fixer.setSourceDir(shoot_dir)
+    audio_fixer.setOutputDir(out_dir)
+    return audio_fixer
+
+def bench_gain(shoot, work_dir, options):
+    recorders = shoot['recorders']
+    start = perf_counter()
+    for recorder in recorders:
+        get_max_gain(recorder['file'], verbose=False)
+    return timing('gain', perf_counter() - start, len(recorders), sum(recorder['length'] for recorder in recorders),
+                  sum(path.getsize(recorder['file']) for recorder in recorders))
+
+def bench_extract(shoot, work_dir, options):
+    clips = shoot['clips']
+    out_dir = path.join(work_dir, 'extract')
+    makedirs(out_dir, exist_ok=True)
+    start = perf_counter()
+    for i, clip in enumerate(clips):
+        extract_audio(clip['video'], path.join(out_dir, 'clip{:03d}.wav'.format(i)))
+    return timing('extract', perf_counter() - start, len(clips), len(clips) * shoot['settings']['clip_length'])
+
+# Times matching every clip against every recorder, then checks the best match for each clip against where it was cut from
+# Offset errors are only taken over clips matched with the right recorder
+def bench_match(shoot, work_dir, options):
+    audio_fixer = shoot_fixer(shoot['shoot_dir'], path.join(work_dir, 'match'), Modes.MATCH, options)
+    audio_fixer.overrideGain(1)
+    audio_fixer.extractAudioFromVideo()
+    start = perf_counter()
+    best_matches = list(audio_fixer.bestMatches())
+    seconds = perf_counter() - start
+    audio_fixer.cleanup()
+
+    truth = {path.realpath(clip['video']): clip for clip in shoot['clips']}
+    errors = []
+    for video_tup, (best_audio_file, best_match, _, _) in zip(audio_fixer.videoFiles(), best_matches):
+        clip = truth[path.realpath(video_tup['video'])]
+        if best_audio_file and path.realpath(best_audio_file) == path.realpath(clip['recorder']):
+            errors.append(abs(best_match.start_time - clip['offset']))
+
+    result = timing('match', seconds, len(best_matches), len(best_matches) * shoot['settings']['clip_length'])
+    result['correct'] = len(errors) / len(shoot['clips']) if shoot['clips'] else None
+    result['mean_error_ms'] = float(np.mean(errors)) * 1000 if errors else None
+    result['max_error_ms'] = float(np.max(errors)) * 1000 if errors else None
+    return result
+
+# Trims each clip's range out of its recorder file, as patching does, so only the trimmed range of each recorder is read
+def bench_trim(shoot, work_dir, options):
+    clip_length = shoot['settings']['clip_length']
+    trimmed_bytes = 0
+    start = perf_counter()
+    for clip in shoot['clips']:
+        wav_data = trim_data(clip['recorder'], clip['offset'], clip['offset'] + clip_length)
+        trimmed_bytes += wav_data.data.nbytes
+    clips = len(shoot['clips'])
+    return timing('trim', perf_counter() - start, clips, clips * clip_length, trimmed_bytes)
+
+# Reads each clip's recorder file whole and then trims the samples in memory, as trimming used to,
+# for comparison with bench_trim
+def bench_trim_whole(shoot, work_dir, options):
+    clip_length = shoot['settings']['clip_length']
+    trimmed_bytes = 0
+    start = perf_counter()
+    for clip in shoot['clips']:
+        wav_data = read_wav_file(clip['recorder'])
+        start_sample = int(round(clip['offset'] * wav_data.rate))
+        end_sample = int(round((clip['offset'] + clip_length) * wav_data.rate))
+        trimmed_bytes += padded_slice(wav_data.data, start_sample, end_sample - start_sample).nbytes
+    clips = len(shoot['clips'])
+    return timing('trim_whole', perf_counter() - start, clips, clips * clip_length, trimmed_bytes)
+
+def bench_patch(shoot, work_dir, options):
+    audio_fixer = shoot_fixer(shoot['shoot_dir'], path.join(work_dir, 'patch'), Modes.PATCH, options)
+    start = perf_counter()
+    audio_fixer.patch()
+    seconds = perf_counter() - start
+    audio_fixer.cleanup()
+
+    clips = len(shoot['clips'])
+    result = timing('patch', seconds, clips, clips * shoot['settings']['clip_length'])
+    result['failures'] = len(audio_fixer.failures)
+    return result
+
+STAGES = {
+    'gain': bench_gain,
+    'extract': bench_extract,
+    'match': bench_match,
+    'trim': bench_trim,
+    'trim_whole': bench_trim_whole,
+    'patch': bench_patch,
+}
+
+# Run one stage, hiding what it prints unless verbose
+# Meant to be run in a fresh process, so that the peak memory reported is the stage's own
+def run_stage(name, shoot, work_dir, options):
+    output = sys.stdout if options['verbose'] else StringIO()
+    reset_peak_rss()
+    with redirect_stdout(output):
+        result = STAGES[name](shoot, work_dir, options)
+    result['peak_rss_mb'] = peak_rss()
+    return result
@@ -0,0 +1,118 @@
+import json
+import os
+from os import path, makedirs
+from fractions import Fraction
+from collections import namedtuple
+import numpy as np
+from scipy.signal import resample_poly
+from filmio.audio_util import run_ffmpeg
+from filmio.wav_io import WavWriter
+
+SHOOT_FILE = 'shoot.json'
+
+# Sample formats recorders can be written in, as (sampwidth, is_float, full scale)
+DTYPES = {
+    'int16': (2, False, 2 ** 15 - 1),
+    'int24': (3, False, 2 ** 23 - 1),
+    'float32': (4, True, 1.0),
+}
+
+# Rate, in Hz, at which the loudness of synthetic audio changes, roughly that of syllables in speech
+ENVELOPE_RATE = 20
+
+# Settings for a synthetic shoot
+#  recorders - number of external audio files, each recording different sound
+#  recorder_length - length of each recording, in seconds
+#  rate, dtype - sampling frequency and sample format of the recordings (see DTYPES)
+#  clips - number of video clips, each cut from a random recorder at a random offset
+#  clip_length - length of each clip, in seconds
+#  video_rate - sampling frequency of the clips' audio, which is resampled from the recorder's if it differs
+#  snr - ratio in dB of the recorded sound to the noise added to each clip, as if from the camera's own microphone
+#  max_gain - clips are scaled by a random gain of up to this many dB either way
+#  video_ext - container the clips are muxed into; .mov clips keep PCM audio, .mp4 clips are encoded to AAC
+ShootSettings = namedtuple('ShootSettings', ['recorders', 'recorder_length', 'rate', 'dtype', 'clips', 'clip_length',
+                                             'video_rate', 'snr', 'max_gain', 'video_ext', 'seed'],
+                           defaults=[4, 600, 48000, 'int24', 12, 30, 48000, 20, 12, 'mov', 0])
+
+# Noise shaped by a random loudness envelope, so that it correlates strongly with itself at one offset only
+def synthetic_audio(rng, num_samples, rate):
+    env_len = num_samples * ENVELOPE_RATE // rate + 2
+    envelope = np.interp(np.arange(num_samples) * ENVELOPE_RATE / rate, np.arange(env_len), rng.random(env_len) ** 2)
+    samples = rng.standard_normal(num_samples) * envelope
+    return samples / np.max(np.abs(samples)) * 0.5
+
+def write_wav(wav_file, samples, rate, dtype):
+    sampwidth, is_float, scale = DTYPES[dtype]
+    with WavWriter(wav_file, rate, 1, sampwidth, is_float) as writer:
+        writer.write(samples.reshape(-1, 1) * scale)
+
+# Mux audio into a video file with a small black picture, so extracting and attaching behave as for real footage
+def mux_clip(wav_file, video_file, length, video_ext):
+    cmd = [
+        'ffmpeg',
+        '-f', 'lavfi', '-i', 'color=c=black:s=160x120:r=10:d={}'.format(length),
+        '-i', wav_file,
+        '-map', '0:v', '-map', '1:a',
+        '-vcodec', 'mpeg4',
+        '-acodec', 'aac' if video_ext == 'mp4' else 'pcm_s16le',
+        '-shortest',
+        '-y',
+        video_file
+    ]
+    run_ffmpeg(cmd)
+
+# Write the recorders and clips of a synthetic shoot to shoot_dir, along with SHOOT_FILE describing them
+# Returns the description, which holds the ground truth of where each clip was cut from:
+#  recorders - list of {file, rate, dtype, length}
+#  clips - list of {video, recorder, offset, gain}, with offset in seconds from the start of the recorder
+def generate_shoot(shoot_dir, settings=ShootSettings()):
+    makedirs(shoot_dir, exist_ok=True)
+    rng = np.random.default_rng(settings.seed)
+
+    recordings = []
+    recorders = []
+    for i in range(settings.recorders):
+        samples = synthetic_audio(rng, int(settings.recorder_length * settings.rate), settings.rate)
+        recorder_file = path.join(shoot_dir, 'recorder{:02d}.wav'.format(i))
+        write_wav(recorder_file, samples, settings.rate, settings.dtype)
+        recordings.append(samples)
+        recorders.append({'file': recorder_file, 'rate': settings.rate, 'dtype': settings.dtype,
+                          'length': len(samples) / settings.rate})
+
+    fraction = Fraction(settings.video_rate, settings.rate)
+    clip_samples = int(settings.clip_length * settings.rate)
+    clips = []
+    for i in range(settings.clips):
+        recorder = int(rng.integers(settings.recorders))
+        start = int(rng.integers(max(len(recordings[recorder]) - clip_samples, 1)))
+        samples = recordings[recorder][start:start + clip_samples]
+        if fraction != 1:
+            samples = resample_poly(samples, fraction.numerator, fraction.denominator)
+
+        noise = rng.standard_normal(len(samples)) * np.sqrt(np.mean(samples ** 2)) * 10 ** (-settings.snr / 20)
+        gain = float(rng.uniform(-settings.max_gain, settings.max_gain))
+        samples = np.clip((samples + noise) * 10 ** (gain / 20), -1, 1)
+
+        clip_wav = path.join(shoot_dir, 'clip{:03d}_source.wav'.format(i))
+        video_file = path.join(shoot_dir, 'clip{:03d}.{}'.format(i, settings.video_ext))
+        write_wav(clip_wav, samples, settings.video_rate, 'int16')
+        try:
+            mux_clip(clip_wav, video_file, settings.clip_length, settings.video_ext)
+        finally:
+            # Only the muxed clip is kept, since the wav would be taken for another recorder
+            os.remove(clip_wav)
+        clips.append({'video': video_file, 'recorder': recorders[recorder]['file'], 'offset': start / settings.rate,
+                      'gain': gain})
+
+    shoot = {'shoot_dir': shoot_dir, 'settings': settings._asdict(), 'recorders': recorders, 'clips': clips}
+    with open(path.join(shoot_dir, SHOOT_FILE), 'w') as f:
+        json.dump(shoot, f, indent=2)
+    return shoot
+
+# Read the description of a shoot generated earlier, or None if shoot_dir doesn't hold one
+def load_shoot(shoot_dir):
+    shoot_file = path.join(shoot_dir, SHOOT_FILE)
+    if not path.exists(shoot_file):
+        return None
+    with open(shoot_file) as f:
+        return json.load(f)
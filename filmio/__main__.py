@@ -1,6 +1,8 @@
 import argparse
 import sys
-from .audio_fixer import AudioFixer, Modes, DEFAULT_SOURCE_DIR, DEFAULT_OUTPUT_DIR
+from .audio_fixer import (AudioFixer, Modes, MatchBackends, GainModes, DEFAULT_SOURCE_DIR, DEFAULT_OUTPUT_DIR,
+                          DEFAULT_CACHE_SIZE, DEFAULT_IO_JOBS, DEFAULT_VOTE_WINDOW, DEFAULT_TARGET_LOUDNESS, ANALYSIS_RATE,
+                          MATCHED_CHANNEL, DEFAULT_MIN_SCORE)
 from .gui import create_gui
 
 OPTION_TO_MODE = {
@@ -10,13 +12,54 @@ OPTION_TO_MODE = {
     'patch': Modes.PATCH,
 }
 
+OPTION_TO_BACKEND = {
+    'fft': MatchBackends.FFT,
+    'praat': MatchBackends.PRAAT,
+    'fingerprint': MatchBackends.FINGERPRINT,
+}
+
+OPTION_TO_GAIN_MODE = {
+    'peak': GainModes.PEAK,
+    'lufs': GainModes.LUFS,
+}
+
+# Channels to patch, numbered from 0, from the channels given on the command line, numbered from 1
+def parse_patch_channels(patch_channels, parser):
+    if patch_channels is None:
+        return None
+    if patch_channels == [MATCHED_CHANNEL]:
+        return MATCHED_CHANNEL
+    if not all(channel.isdigit() and int(channel) > 0 for channel in patch_channels):
+        parser.error(f"--patch_channels takes channel numbers, starting from 1, or {MATCHED_CHANNEL}")
+    return [int(channel) - 1 for channel in patch_channels]
+
 def process_cmd_line(args, parser):
     # Create worker class
     audioFixer = AudioFixer(args.verbose)
     audioFixer.setMode(OPTION_TO_MODE.get(args.mode, Modes.OTHER))
+    audioFixer.setMatchBackend(OPTION_TO_BACKEND[args.backend])
+    audioFixer.setCacheSize(args.cache_size)
+    audioFixer.setDiskCache(args.disk_cache)
+    audioFixer.setTopK(args.top_k)
+    audioFixer.setJobs(args.jobs)
+    audioFixer.setIOJobs(args.io_jobs)
+    audioFixer.setStream(args.stream)
+    audioFixer.setInMemory(not args.temp_files)
+    audioFixer.setRematch(args.rematch)
+    audioFixer.setTimeWindow(args.time_window)
+    audioFixer.setWindows(args.windows, args.window_length)
+    audioFixer.setDrift(not args.no_drift)
+    audioFixer.setAllChannels(not args.first_channel)
+    audioFixer.setPatchChannels(parse_patch_channels(args.patch_channels, parser))
+    audioFixer.setAssign(args.assign, args.min_score)
+    audioFixer.setAnalysisRate(args.analysis_rate)
+    audioFixer.setProfile(args.profile, args.profile_match)
+    audioFixer.setGainMode(OPTION_TO_GAIN_MODE[args.gain_mode], args.target_loudness)
 
     # Set overrides
     audioFixer.setSourceDir(args.src_dir)
+    audioFixer.setRecursive(args.recursive)
+    audioFixer.setFileFilters(args.include, args.exclude)
     audioFixer.setOutputDir(args.out_dir)
     if args.gain is not None:
         audioFixer.overrideGain(args.gain)
@@ -40,7 +83,11 @@ def process_cmd_line(args, parser):
         audioFixer.matchVideoToAudio()
     elif args.mode == 'patch':
         audioFixer.patch()
+    audioFixer.reportFailures()
     audioFixer.cleanup()
+    if args.profile:
+        print("\n" + audioFixer.profileSummary())
+        audioFixer.writeProfile()
 
 def main():
     parser = argparse.ArgumentParser(description='A super rad utility to help you with audio for your films')
@@ -50,6 +97,12 @@ def main():
         help='Print extra information while executing.')
     parser.add_argument('-d', '--src_dir', default=DEFAULT_SOURCE_DIR,
         help='Directory to search for source files. Default is the current directory.')
+    parser.add_argument('-r', '--recursive', action='store_true',
+        help='Also search every folder inside the source directory, except the output directory and hidden folders.')
+    parser.add_argument('--include', nargs='+', metavar='GLOB',
+        help='Only use source files whose path relative to the source directory, or name, matches one of these patterns.')
+    parser.add_argument('--exclude', nargs='+', metavar='GLOB',
+        help='Skip source files and folders whose path relative to the source directory, or name, matches one of these patterns.')
     parser.add_argument('-o', '--out_dir', default=DEFAULT_OUTPUT_DIR,
         help='Directory to place output files. Default is subdir of the current directory "./Fixed"')
 
@@ -58,6 +111,71 @@ def main():
     parser.add_argument('-g', '--gain', type=float,
         help='Provide a gain to use on the audio files rather than calculating one. '
               'If 1 is given, will not attempt to modify audio file volume.')
+    parser.add_argument('--gain_mode', choices=['peak', 'lufs'], default='peak',
+        help='How gain is calculated. peak makes the loudest peak of any audio file reach full scale; '
+             'lufs makes the loudest audio file reach the target loudness, without letting any file peak. Default is peak.')
+    parser.add_argument('--target_loudness', type=float, default=DEFAULT_TARGET_LOUDNESS,
+        help=f'Integrated loudness in LUFS for the lufs gain mode. Default is {DEFAULT_TARGET_LOUDNESS}.')
+    parser.add_argument('-b', '--backend', choices=list(OPTION_TO_BACKEND), default='fft',
+        help='Method used to cross correlate audio when matching. '
+             'Default is an in-process FFT; praat is the original reference implementation; '
+             'fingerprint indexes spectral peak pairs of each audio file once and looks each video up in them, '
+             'which suits many short clips from long recordings.')
+    parser.add_argument('--cache_size', type=int, default=DEFAULT_CACHE_SIZE,
+        help=f'Memory budget in MB for caching external audio spectra while matching. Default is {DEFAULT_CACHE_SIZE}.')
+    parser.add_argument('--disk_cache', action='store_true',
+        help='Also save external audio spectra and landmark indexes in the output directory, so later runs can reuse them.')
+    parser.add_argument('-k', '--top_k', type=int, default=0,
+        help='Shortlist this many audio files per video by comparing energy envelopes, '
+             'and only match those at full rate. Default is 0, which matches every audio file at full rate.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='Number of processes to match videos with. The spectrum cache budget is split between them. Default is 1.')
+    parser.add_argument('--io_jobs', type=int, default=DEFAULT_IO_JOBS,
+        help=f'Number of ffmpeg processes to run at once when extracting and attaching audio. Default is {DEFAULT_IO_JOBS}.')
+    parser.add_argument('-s', '--stream', action='store_true',
+        help='When patching, pass each video through extract, match and attach as soon as possible, '
+             'so patched videos appear early and fewer temporary files exist at once.')
+    parser.add_argument('--temp_files', action='store_true',
+        help='When patching, pass audio between ffmpeg and the matcher through temporary WAV files in the output directory, '
+             'rather than piping it through memory.')
+    parser.add_argument('--rematch', action='store_true',
+        help='Ignore match results stored in the output directory by earlier runs, and match every pair again.')
+    parser.add_argument('-t', '--time_window', type=float,
+        help='Only match a video against audio files that were recording within this many seconds of it, '
+             'going by timecode, Broadcast Wave time references or creation times. '
+             'Files without timestamps, and videos that no audio file was recording around, '
+             'such as when a clock is set to another time zone, are matched against everything.')
+    parser.add_argument('-w', '--windows', type=int, default=0,
+        help='Match each video by voting between this many short windows spread across it, correlated against the whole '
+             'of each audio file a block at a time. Handles clips and recordings of any length. '
+             'Default is 0, which only correlates the first two minutes of each video.')
+    parser.add_argument('--window_length', type=float, default=DEFAULT_VOTE_WINDOW,
+        help=f'Seconds of video audio in each voting window. Default is {DEFAULT_VOTE_WINDOW}.')
+    parser.add_argument('--no_drift', action='store_true',
+        help='Don\'t estimate clock drift between each video and its matched audio. '
+             'By default, drift is measured from the start and end of each clip and the audio is resampled to correct it.')
+    parser.add_argument('--first_channel', action='store_true',
+        help='Only match videos against the first channel of each audio file. '
+             'By default, every channel of multitrack recordings is matched in one pass and the best matching one is used.')
+    parser.add_argument('--patch_channels', nargs='+', metavar='CHANNEL',
+        help='Only keep these channels of the matched audio, numbered from 1, when trimming and patching, '
+             f'or {MATCHED_CHANNEL} to keep only the channel each video matched best. Default keeps every channel.')
+    parser.add_argument('-a', '--assign', action='store_true',
+        help='Once every video is matched, choose their audio files together so that videos from one camera never overlap '
+             'and sit at the same offset from their own timecode or creation time in each audio file, '
+             'rejecting videos that can\'t fit rather than patching them, unless they match where the other videos from their '
+             'camera put them. Videos in the same folder are taken to be from the same camera. Turns off streaming.')
+    parser.add_argument('--min_score', type=float, default=DEFAULT_MIN_SCORE,
+        help=f'With --assign, reject matches scoring less than this. Default is {DEFAULT_MIN_SCORE}.')
+    parser.add_argument('--analysis_rate', type=int, default=ANALYSIS_RATE,
+        help='Sampling frequency that video audio and external audio are resampled to for matching. '
+             f'Offsets are still found to a fraction of a sample. Default is {ANALYSIS_RATE}.')
+    parser.add_argument('--profile',
+        help='Write a report of the time, calls and bytes read and written by each stage of the run, and cache hit rates, '
+             'to this file. It is written as CSV if the file ends in .csv, otherwise as JSON.')
+    parser.add_argument('--profile_match',
+        help='Dump cProfile stats of the match stage to this file, for reading with pstats or snakeviz. '
+             'With more than one job, each worker process\'s stats are merged into it once matching is done.')
     parser.add_argument('-f', '--files', nargs='*',
         help='Perform operations only on the provided files, rather than searching the source directory.')
 
@@ -0,0 +1,161 @@
+from bisect import bisect_right
+from collections import namedtuple
+from statistics import median
+
+# Seconds that two videos from the same camera may overlap by in an audio file before they conflict,
+# to allow for matching error at their ends
+OVERLAP_TOLERANCE = 0.5
+
+# Seconds that the offset between where a video matched in an audio file and when it started by its camera's clock
+# may differ from that of the camera's other videos in the same audio file
+OFFSET_TOLERANCE = 2.0
+
+# Fewest videos from one camera in one audio file before their offsets are compared, so that most of them can outvote the rest
+MIN_CONSENSUS = 3
+
+# Fraction of the least score that a rejected video placed by its neighbours needs (see place_rejected),
+# since only the few seconds around where they put it are searched, leaving unrelated audio little chance to score well
+PLACEMENT_SCORE_RATIO = 0.5
+
+# Least score a match needs to be assigned
+# The fft and fingerprint backends score a match by normalized correlation, where unrelated audio scores well below this
+DEFAULT_MIN_SCORE = 0.1
+
+# A video to assign an audio file to
+#  camera - anything that tells cameras apart, such as the folder their videos are in, since videos from one camera can't overlap
+#  clock - (clock, seconds) of when the video started recording, by one of its camera's clocks (see candidates.CLOCKS), or None
+#  candidates - list of (audio_file, MatchTuple) for every audio file the video was matched with
+Clip = namedtuple('Clip', ['camera', 'clock', 'candidates'])
+
+# Indices of the videos to keep out of those with intervals (start, end, weight, index), so that no two kept overlap by more
+# than OVERLAP_TOLERANCE and their total weight is the largest possible (weighted interval scheduling)
+def schedule(intervals):
+    intervals = sorted(intervals, key=lambda interval: interval[1])
+    ends = [end for _, end, _, _ in intervals]
+    best = [0.0] * (len(intervals) + 1) # Best total weight of the first j intervals
+    previous = [] # Number of intervals ending early enough to be kept along with each one
+    for j, (start, _, weight, _) in enumerate(intervals):
+        previous.append(bisect_right(ends, start + OVERLAP_TOLERANCE, 0, j))
+        best[j + 1] = max(best[j], weight + best[previous[j]])
+
+    kept = set()
+    j = len(intervals)
+    while j > 0:
+        if best[j] == best[j - 1]:
+            j -= 1
+        else:
+            kept.add(intervals[j - 1][3])
+            j = previous[j - 1]
+    return kept
+
+# Indices of the videos, out of (offset, index) pairs, whose offset is more than OFFSET_TOLERANCE from the median of them all
+def outliers(offsets):
+    if len(offsets) < MIN_CONSENSUS:
+        return set()
+    consensus = median(offset for offset, _ in offsets)
+    return {i for offset, i in offsets if abs(offset - consensus) > OFFSET_TOLERANCE}
+
+# Choose at most one of each clip's candidates so that they make up one consistent timeline:
+#  - no two videos from the same camera overlap in the same audio file, keeping the best scoring set of videos
+#  - videos from the same camera with the same clock all sit at the same offset from that clock in each audio file
+# A video losing either check falls back to its next best candidate, and is rejected once none are left,
+# as is a video with no candidate scoring at least min_score
+# Every check only compares videos matched with the same audio file, so the work grows with the number of matches,
+# and rounds continue until no video has to fall back
+# Return (audio_file, MatchTuple, reason) for each clip, with audio_file and MatchTuple None and a reason if it was rejected
+def assign_matches(clips, min_score=DEFAULT_MIN_SCORE):
+    options = [sorted((candidate for candidate in clip.candidates if candidate[1].score >= min_score),
+                      key=lambda candidate: candidate[1].score, reverse=True) for clip in clips]
+    choice = [0] * len(clips)
+    reasons = [f"no match scored at least {min_score}" for _ in clips]
+
+    while True:
+        groups = {}
+        for i, clip in enumerate(clips):
+            if choice[i] < len(options[i]):
+                groups.setdefault((clip.camera, options[i][choice[i]][0]), []).append(i)
+
+        losers = {}
+        for (_, audio_file), members in groups.items():
+            offsets = {}
+            for i in members:
+                if clips[i].clock is not None:
+                    clock, seconds = clips[i].clock
+                    offsets.setdefault(clock, []).append((options[i][choice[i]][1].start_time - seconds, i))
+            for clock_offsets in offsets.values():
+                for i in outliers(clock_offsets):
+                    losers[i] = f"its {clips[i].clock[0]} disagrees with other videos from its camera in {audio_file}"
+
+            intervals = [(options[i][choice[i]][1].start_time, options[i][choice[i]][1].end_time, options[i][choice[i]][1].score, i)
+                         for i in members if i not in losers]
+            kept = schedule(intervals)
+            for _, _, _, i in intervals:
+                if i not in kept:
+                    losers[i] = f"it overlaps better matches of other videos from its camera in {audio_file}"
+
+        if not losers:
+            break
+        for i, reason in losers.items():
+            choice[i] += 1
+            reasons[i] = reason
+
+    return [(*options[i][choice[i]], None) if choice[i] < len(options[i]) else (None, None, reasons[i]) for i in range(len(clips))]
+
+# Whether the interval (start, end) overlaps any of intervals by more than OVERLAP_TOLERANCE
+def overlaps(start, end, intervals):
+    return any(start < other_end - OVERLAP_TOLERANCE and other_start < end - OVERLAP_TOLERANCE for other_start, other_end in intervals)
+
+# Where each rejected clip with a clock would start in the audio files that the assigned videos from its camera,
+# with the same clock, sit in, going by the median offset of those videos from their clock, as {index: [(audio_file, start_time)]}
+# Audio files where those videos disagree by more than OFFSET_TOLERANCE are left out, since they don't pin down the timeline there
+def predicted_starts(clips, assigned):
+    offsets = {}
+    for clip, (audio_file, match_tuple, reason) in zip(clips, assigned):
+        if reason is None and clip.clock is not None:
+            clock, seconds = clip.clock
+            offsets.setdefault((clip.camera, clock), {}).setdefault(audio_file, []).append(match_tuple.start_time - seconds)
+
+    consensus = {}
+    for key, file_offsets in offsets.items():
+        for audio_file, clock_offsets in file_offsets.items():
+            offset = median(clock_offsets)
+            if all(abs(clock_offset - offset) <= OFFSET_TOLERANCE for clock_offset in clock_offsets):
+                consensus.setdefault(key, []).append((audio_file, offset))
+
+    predictions = {}
+    for i, (clip, (_, _, reason)) in enumerate(zip(clips, assigned)):
+        if reason is not None and clip.clock is not None:
+            clock, seconds = clip.clock
+            starts = [(audio_file, seconds + offset) for audio_file, offset in consensus.get((clip.camera, clock), [])]
+            if starts:
+                predictions[i] = starts
+    return predictions
+
+# Place rejected clips, from assign_matches, where the assigned videos from their camera put them (see predicted_starts)
+# rematch(index, audio_file, start_time) matches the clip with the audio file near start_time, returning a MatchTuple or None
+# A placement is kept if it lies within OFFSET_TOLERANCE of where it was predicted, scores at least PLACEMENT_SCORE_RATIO of
+# min_score and doesn't overlap the other videos from its camera in that audio file, and the best scoring one is kept for each clip
+# Return (assigned, placed), with each placed clip given its new (audio_file, MatchTuple, None) and placed the set of their indices
+def place_rejected(clips, assigned, rematch, min_score=DEFAULT_MIN_SCORE):
+    intervals = {}
+    for clip, (audio_file, match_tuple, reason) in zip(clips, assigned):
+        if reason is None:
+            intervals.setdefault((clip.camera, audio_file), []).append((match_tuple.start_time, match_tuple.end_time))
+
+    assigned = list(assigned)
+    placed = set()
+    for i, starts in predicted_starts(clips, assigned).items():
+        best = None
+        for audio_file, start_time in starts:
+            match_tuple = rematch(i, audio_file, start_time)
+            if (match_tuple is None or match_tuple.score < min_score * PLACEMENT_SCORE_RATIO
+                    or abs(match_tuple.start_time - start_time) > OFFSET_TOLERANCE
+                    or overlaps(match_tuple.start_time, match_tuple.end_time, intervals.get((clips[i].camera, audio_file), []))):
+                continue
+            if best is None or match_tuple.score > best[1].score:
+                best = (audio_file, match_tuple)
+        if best is not None:
+            assigned[i] = (*best, None)
+            placed.add(i)
+            intervals.setdefault((clips[i].camera, best[0]), []).append((best[1].start_time, best[1].end_time))
+    return assigned, placed
@@ -1,7 +1,25 @@
 import os
-from os import listdir, path, makedirs
+from os import path, makedirs
 from enum import Enum
-from .audio_util import get_wav_metadata, get_max_gain, louder, extract_audio, match, trim, attach, MatchTuple
+from collections import namedtuple
+from io import StringIO
+from contextlib import redirect_stdout, contextmanager
+from threading import Event, Lock, Thread
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from .audio_util import (get_max_gain, analyze_audio, louder, extract_audio, extract_audio_data, match,
+                         match_prepared, match_prepared_batch, match_refined, match_windowed, match_fingerprinted, correct_drift,
+                         trim, trim_data, attach, attach_data, read_mono, resample_mono, cancel_ffmpeg, allow_ffmpeg, MatchTuple,
+                         FfmpegError)
+from .correlate import coarse_match, ANALYSIS_RATE, DEFAULT_VOTE_WINDOW
+from .spectrum_cache import SpectrumCache, DEFAULT_CACHE_SIZE
+from .wav_io import WavFormatError
+from .pipeline import run_pipeline
+from .match_store import MatchStore, MATCH_STORE_FILE, MATCHER_VERSION
+from .candidates import CandidateIndex, probe_video_timestamps, CLOCKS
+from .assignment import Clip, assign_matches, place_rejected, DEFAULT_MIN_SCORE, OFFSET_TOLERANCE
+from .file_index import FileIndex, FILE_INDEX_FILE
+from .profiler import PROFILER, profiled, clear_dumps, merge_dumps
 
 DEFAULT_SOURCE_DIR = '.'
 DEFAULT_OUTPUT_DIR = './Fixed'
@@ -9,6 +27,22 @@ DEFAULT_OUTPUT_DIR = './Fixed'
 AUDIO_FILE_EXTS = ['.wav']
 VID_FILE_EXTS = ['.mp4', '.mov']
 
+SPECTRUM_CACHE_DIR = '.spectrum_cache'
+
+DEFAULT_IO_JOBS = 4
+
+# Number of clips that may wait between each stage when streaming
+PIPELINE_DEPTH = 2
+
+# Most videos matched together in one batch, which all have their audio loaded at once
+BATCH_VIDEOS = 16
+
+# Integrated loudness, in LUFS, that the loudest audio file is brought to when gain is chosen by loudness (EBU R 128)
+DEFAULT_TARGET_LOUDNESS = -23
+
+# Passed to AudioFixer.setPatchChannels to keep only the channel of the audio file that each video matched best
+MATCHED_CHANNEL = 'matched'
+
 class Modes(Enum):
     OTHER = 0
     LOUDEN = 1
@@ -16,12 +50,51 @@ class Modes(Enum):
     MATCH = 3
     PATCH = 4
 
+class MatchBackends(Enum):
+    PRAAT = 0
+    FFT = 1
+    FINGERPRINT = 2
+
+class GainModes(Enum):
+    PEAK = 0
+    LUFS = 1
+
+# A matched section of an external audio file that is only trimmed when it is attached
+# channels are the channels of the audio file to keep, or None for all of them
+PendingTrim = namedtuple('PendingTrim', ['audio_file', 'start_time', 'end_time', 'rate_ratio', 'gain', 'channels'],
+                         defaults=[1.0, 1.0, None])
+
+# Raised from inside a run once AudioFixer.cancel is called
+class Cancelled(Exception):
+    pass
+
 def get_all_files_of_type_in_list(file_list, ext_list):
     return [f for f in file_list if any(f.lower().endswith(ext.lower()) for ext in ext_list)]
 
-def get_all_files_of_type_in_dir(cur_dir, ext_list):
-    file_list = (path.join(cur_dir, f) for f in listdir(cur_dir) if path.isfile(path.join(cur_dir, f)))
-    return get_all_files_of_type_in_list(file_list, ext_list)
+# Each match worker process gets its own copy of the AudioFixer, set up once by the pool initializer
+_worker_fixer = None
+
+# The copy is always built from the AudioFixer's pickled state (see AudioFixer.__getstate__), since a worker started by fork
+# would otherwise inherit the parent's AudioFixer as it is, with its whole cache budget, spectrum cache, lock and event
+# Once the main process sets cancelled, the worker cancels its own copy, killing the ffmpeg processes it started
+def _init_match_worker(state, cancelled):
+    global _worker_fixer # pylint: disable=global-statement
+    _worker_fixer = AudioFixer.__new__(AudioFixer)
+    _worker_fixer.__setstate__(state)
+    if _worker_fixer.profiling:
+        PROFILER.enable()
+
+    def watch_cancelled():
+        cancelled.wait()
+        _worker_fixer.cancel()
+    Thread(target=watch_cancelled, daemon=True).start()
+
+# Run findBestMatches on a group of videos in a worker process
+# Returns its results along with the stage totals recorded while matching, for the main process to add to its own
+def _match_worker(video_tups):
+    with profiled(_worker_fixer.match_profile_file, main_process=False):
+        best = _worker_fixer.findBestMatches(video_tups)
+    return best, PROFILER.drain()
 
 def get_out_file_path(input_file, out_dir, suffix='', new_type=None):
     input_file_parts = path.basename(input_file).rsplit('.', 1)
@@ -34,22 +107,212 @@ class AudioFixer:
     def __init__(self, verbose):
         self.verbose = verbose
         self.mode = None
+        self.match_backend = MatchBackends.FFT
+        self.cache_size = DEFAULT_CACHE_SIZE
+        self.disk_cache = False
+        self.top_k = 0
+        self.jobs = 1
+        self.io_jobs = DEFAULT_IO_JOBS
+        self.stream = False
+        self.in_memory = True
+        self.rematch = False
+        self.time_window = None
+        self.analysis_rate = ANALYSIS_RATE
+        self.num_windows = 0
+        self.window_length = DEFAULT_VOTE_WINDOW
+        self.drift = True
+        self.all_channels = True
+        self.patch_channels = None
+        self.assign = False
+        self.min_score = DEFAULT_MIN_SCORE
+        self.gain_mode = GainModes.PEAK
+        self.target_loudness = DEFAULT_TARGET_LOUDNESS
+        self.profiling = False
+        self.profile_file = None
+        self.match_profile_file = None
+        self.failures = [] # List of tuples (stage, file, reason)
+        self.progress = None
+        self._progress_done = {} # Stage to the number of items it has finished
+        self._progress_lock = Lock()
+        self._cancelled = Event()
+        self._workers_cancelled = None # Shared with match worker processes while they run
+        allow_ffmpeg() # ffmpeg may have been stopped by cancelling an earlier AudioFixer
         self.source_dir = None
         self.out_dir = None
+        self.recursive = False
+        self.include = None
+        self.exclude = None
         self._src_audio_files = None
         self._new_audio_files = None
         self._video_files = None
         self._video_audio_extracted = False
         self._gain = None
-        self._matches = None # List of tuples (video_file, trimmed_audio_file)
+        self._matches = None # List of tuples (video_file, trimmed_audio_file or PendingTrim)
         self._files_to_clean = []
+        self._spectrum_cache = None
+        self._match_store = None
+        self._candidate_index = None
+        self._file_index = None
 
     def setMode(self, mode):
         self.mode = mode
 
+    def setMatchBackend(self, match_backend):
+        self.match_backend = match_backend
+
+    def setCacheSize(self, cache_size):
+        '''
+        Set the memory budget, in MB, for caching external audio spectra while matching
+        '''
+        self.cache_size = cache_size
+
+    def setDiskCache(self, disk_cache):
+        '''
+        Set whether to also keep external audio spectra in the output directory between runs
+        '''
+        self.disk_cache = disk_cache
+
+    def setTopK(self, top_k):
+        '''
+        Set how many candidates to keep after comparing energy envelopes, before matching at full rate
+        0 matches every candidate at full rate
+        '''
+        self.top_k = top_k
+
+    def setJobs(self, jobs):
+        '''
+        Set the number of processes to match videos with
+        '''
+        self.jobs = max(jobs, 1)
+
+    def setIOJobs(self, io_jobs):
+        '''
+        Set the number of ffmpeg processes to run at once when extracting and attaching audio
+        '''
+        self.io_jobs = max(io_jobs, 1)
+
+    def setStream(self, stream):
+        '''
+        Set whether patching passes each video through every stage as soon as it can,
+        rather than running each stage on all videos before starting the next
+        '''
+        self.stream = stream
+
+    def setInMemory(self, in_memory):
+        '''
+        Set whether patching pipes audio between ffmpeg and the matcher, rather than through temporary WAV files
+        '''
+        self.in_memory = in_memory
+
+    def setRematch(self, rematch):
+        '''
+        Set whether to ignore match results stored by earlier runs and match every pair again
+        '''
+        self.rematch = rematch
+
+    def setTimeWindow(self, time_window):
+        '''
+        Set how many seconds apart the timestamps of a video and an audio file may be for them to still be matched
+        None matches every video against every audio file
+        '''
+        self.time_window = time_window
+
+    def setAnalysisRate(self, analysis_rate):
+        '''
+        Set the sampling frequency that video audio and source audio are both resampled to for matching
+        '''
+        self.analysis_rate = analysis_rate
+
+    def setWindows(self, num_windows, window_length=DEFAULT_VOTE_WINDOW):
+        '''
+        Set how many windows of window_length seconds, spread across each video, vote on where it matches
+        Voting correlates against the whole of each audio file a block at a time, so clips of any length can be matched
+        0 correlates the first part of each video against cached audio spectra instead
+        '''
+        self.num_windows = max(num_windows, 0)
+        self.window_length = window_length
+
+    def setDrift(self, drift):
+        '''
+        Set whether to estimate clock drift between each video and its matched audio, and resample the audio to correct it
+        '''
+        self.drift = drift
+
+    def setAllChannels(self, all_channels):
+        '''
+        Set whether videos are matched against every channel of each audio file, keeping the channel that matches best,
+        rather than only the first channel
+        Every channel is correlated in the same pass, but takes its own share of memory in the spectrum cache
+        '''
+        self.all_channels = all_channels
+
+    def setPatchChannels(self, patch_channels):
+        '''
+        Set which channels of the matched audio file are kept when trimming and attaching, numbered from 0
+        None keeps every channel, and MATCHED_CHANNEL keeps only the channel each video matched best
+        '''
+        self.patch_channels = patch_channels
+
+    def setAssign(self, assign, min_score=DEFAULT_MIN_SCORE):
+        '''
+        Set whether, once every video is matched, their matches are chosen together so they make up one consistent timeline,
+        rather than each video taking its best match (see assignment.assign_matches)
+        Videos in the same folder are taken to be from the same camera, and matches scoring under min_score are rejected,
+        unless the video is placed where the other videos from its camera put it (see assignment.place_rejected)
+        Streaming is turned off while assigning, since every video has to be matched before any can be patched
+        '''
+        self.assign = assign
+        self.min_score = min_score
+
+    def setGainMode(self, gain_mode, target_loudness=DEFAULT_TARGET_LOUDNESS):
+        '''
+        Set how the gain is calculated
+        PEAK makes the loudest peak of any audio file reach full scale
+        LUFS makes the loudest audio file reach target_loudness, unless that would make any file peak
+        '''
+        self.gain_mode = gain_mode
+        self.target_loudness = target_loudness
+
+    def setProfile(self, profile_file, match_profile_file=None, summary=False):
+        '''
+        Set where to write the run report of time, calls and bytes for each stage (see profiler.Profiler),
+        and optionally where to dump cProfile stats of the match stage
+        If summary is set, stages are timed for profileSummary even without a run report
+        '''
+        self.profile_file = profile_file
+        self.match_profile_file = match_profile_file
+        self.profiling = bool(profile_file or summary)
+        if self.profiling:
+            PROFILER.enable()
+        if match_profile_file:
+            clear_dumps(match_profile_file) # Stats are added to the file as each group is matched
+
+    def setProgress(self, progress):
+        '''
+        Set a function to call as progress(stage, item_file, done, total) each time a stage finishes an item,
+        such as extracting, matching or attaching one video
+        It may be called from any thread
+        '''
+        self.progress = progress
+
     def setSourceDir(self, source_dir):
         self.source_dir = source_dir
 
+    def setRecursive(self, recursive):
+        '''
+        Set whether source files are also gathered from every folder inside the source directory
+        '''
+        self.recursive = recursive
+
+    def setFileFilters(self, include=None, exclude=None):
+        '''
+        Set glob patterns that source files must match at least one of (include) and none of (exclude),
+        by their path relative to the source directory or by their name alone
+        Folders matching exclude aren't searched
+        '''
+        self.include = include or None
+        self.exclude = exclude or None
+
     def setOutputDir(self, out_dir):
         makedirs(out_dir, exist_ok=True) # Create out_dir if it doesn't already exist
         self.out_dir = out_dir
@@ -81,20 +344,9 @@ class AudioFixer:
             return self._src_audio_files
 
         print("Gathering audio files...")
-        self._src_audio_files = get_all_files_of_type_in_dir(self.source_dir, AUDIO_FILE_EXTS)
+        self.scanSourceDir()
         return self._src_audio_files
 
-    def newAudioFiles(self):
-        '''
-        If new audio file list is already set, return it
-        Otherwise, copy and louden the source audio files and return the new list
-        '''
-        if self._new_audio_files is not None:
-            return self._new_audio_files
-
-        self.loudenAudio()
-        return self._new_audio_files
-
     def videoFiles(self):
         '''
         If video file list is already set, return it
@@ -104,33 +356,216 @@ class AudioFixer:
             return self._video_files
 
         print("Gathering video files...")
-        self._video_files = [{'video': f} for f in get_all_files_of_type_in_dir(self.source_dir, VID_FILE_EXTS)]
+        self.scanSourceDir()
         return self._video_files
 
+    def scanSourceDir(self):
+        '''
+        Gather the audio and video files in the source directory through the file index,
+        setting whichever of the two file lists isn't already set
+        The output directory is never searched, so output files aren't taken for source files
+        '''
+        types = {'audio': AUDIO_FILE_EXTS, 'video': VID_FILE_EXTS}
+        found = self.fileIndex().scan(self.source_dir, types, self.recursive, self.include, self.exclude, skip_dirs=[self.out_dir])
+        if self._src_audio_files is None:
+            self._src_audio_files = [f.path for f in found if f.type == 'audio']
+        if self._video_files is None:
+            self._video_files = [{'video': f.path} for f in found if f.type == 'video']
+
+    def __getstate__(self):
+        # Sent to match worker processes, which only need the settings and file lists
+        # Each worker builds its own spectrum cache, with its share of the memory budget,
+        # and never touches the list of files to clean
+        # Progress and cancelling are only handled by the main process
+        state = self.__dict__.copy()
+        state['cache_size'] = max(self.cache_size // self.jobs, 1)
+        state['_spectrum_cache'] = None
+        state['_files_to_clean'] = []
+        state['progress'] = None
+        del state['_progress_lock']
+        del state['_cancelled']
+        del state['_workers_cancelled']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._progress_lock = Lock()
+        self._cancelled = Event()
+        self._workers_cancelled = None
+
+    def inMemory(self):
+        '''
+        Whether audio is piped between ffmpeg and the matcher instead of written to temporary WAV files
+        Only applies when patching, since other modes keep the WAV files as output, and Praat needs files
+        '''
+        return self.in_memory and self.mode == Modes.PATCH and self.match_backend != MatchBackends.PRAAT
+
+    def spectrumCache(self):
+        '''
+        If the spectrum cache is already created, return it
+        Otherwise, create it based on the cache settings and return
+        '''
+        if self._spectrum_cache is not None:
+            return self._spectrum_cache
+
+        cache_dir = path.join(self.out_dir, SPECTRUM_CACHE_DIR) if self.disk_cache else None
+        self._spectrum_cache = SpectrumCache(self.cache_size * 2 ** 20, cache_dir, rate=self.analysis_rate,
+                                             all_channels=self.all_channels)
+        return self._spectrum_cache
+
+    def matchStore(self):
+        '''
+        If the match store is already opened, return it
+        Otherwise, open it in the output directory and return
+        '''
+        if self._match_store is None:
+            self._match_store = MatchStore(path.join(self.out_dir, MATCH_STORE_FILE))
+        return self._match_store
+
+    def fileIndex(self):
+        '''
+        If the file index is already opened, return it
+        Otherwise, open it in the output directory and return
+        '''
+        if self._file_index is None:
+            self._file_index = FileIndex(path.join(self.out_dir, FILE_INDEX_FILE))
+        return self._file_index
+
+    def matchSettings(self):
+        '''
+        Everything besides the files themselves that a stored match result depends on
+        '''
+        return (self.match_backend.name, self.analysis_rate, self.top_k, self.num_windows, self.window_length, self.drift,
+                self.all_channels, MATCHER_VERSION)
+
+    def storedMatch(self, video_file, audio_file):
+        '''
+        Return the MatchTuple stored by an earlier run for the pair, or None if it must be matched
+        '''
+        if self.rematch:
+            return None
+        return self.matchStore().get(video_file, audio_file, self.matchSettings())
+
+    def storeMatch(self, video_file, audio_file, match_tuple):
+        self.matchStore().put(video_file, audio_file, self.matchSettings(), match_tuple)
+
+    def storedRows(self, video_tup):
+        '''
+        Return a list of (audio_file, MatchTuple or None) for each of candidateAudioFiles, from storedMatch
+        The list is kept in video_tup['stored'] until storedMatches uses it, so each pair is only looked up once
+        '''
+        if 'stored' not in video_tup:
+            video_tup['stored'] = [(audio_file, self.storedMatch(video_tup['video'], audio_file))
+                                   for audio_file in self.candidateAudioFiles(video_tup)]
+        return video_tup['stored']
+
+    def forgetStoredRows(self):
+        '''
+        Drop the rows kept by storedRows, which an earlier run, or its match worker processes, may have left out of date
+        '''
+        for video_tup in self.videoFiles():
+            video_tup.pop('stored', None)
+
+    def needsMatching(self, video_tup):
+        '''
+        Whether any candidate audio file still has to be matched against the video file
+        '''
+        return any(stored_match is None for _, stored_match in self.storedRows(video_tup))
+
+    def candidateIndex(self):
+        '''
+        If the candidate index is already built, return it
+        Otherwise, build it from the timestamps of srcAudioFiles and return
+        '''
+        if self._candidate_index is None:
+            if self.verbose:
+                print("Indexing audio file timestamps")
+            self._candidate_index = CandidateIndex(self.srcAudioFiles(), self.time_window)
+        return self._candidate_index
+
+    def candidateAudioFiles(self, video_tup):
+        '''
+        Return the srcAudioFiles that should be matched against the video file
+        If a time window is set, only audio files recording at around the same time as the video are returned,
+        unless the video or audio files have no timestamps to compare
+        '''
+        if self.time_window is None:
+            return self.srcAudioFiles()
+
+        candidates = self.candidateIndex().candidates(self.videoTimestamps(video_tup))
+        if candidates is None:
+            return self.srcAudioFiles()
+
+        candidates = set(candidates)
+        return [audio_file for audio_file in self.srcAudioFiles() if audio_file in candidates]
+
+    def videoTimestamps(self, video_tup):
+        '''
+        Return the Timestamps of the video file, probed the first time they are needed
+        '''
+        if 'timestamps' not in video_tup:
+            video_tup['timestamps'] = probe_video_timestamps(video_tup['video'])
+        return video_tup['timestamps']
+
+    def audioStats(self, audio_file):
+        '''
+        Return the AudioStats of the audio file, stored by an earlier run if it hasn't changed since,
+        otherwise analyzed now and stored
+        '''
+        stats = self.matchStore().get_stats(audio_file)
+        if stats is None:
+            with PROFILER.time('gain', bytes_read=path.getsize(audio_file)):
+                stats = analyze_audio(audio_file)
+            self.matchStore().put_stats(audio_file, stats)
+        return stats
+
     def gain(self):
         '''
         If gain is already set, return it
-        Otherwise, calculate gain from srcAudioFiles and return
+        Otherwise, calculate gain from srcAudioFiles using the gain mode and return
+        Files are analyzed in parallel with up to io_jobs threads
         '''
         if self._gain is not None:
             return self._gain
 
         print("Analyzing audio files for best possible gain increase...")
+        audio_files = self.srcAudioFiles()
+        all_stats = self.runConcurrently('gain', self.audioStats, audio_files, lambda audio_file: audio_file)
         best_gain = None
-        for audio_file in self.srcAudioFiles():
-            max_gain = get_max_gain(audio_file, self.verbose)
+        loudest = None
+        for audio_file, stats in zip(audio_files, all_stats):
+            if stats is None:
+                continue
+            max_gain = get_max_gain(audio_file, self.verbose, stats)
             if max_gain:
                 best_gain = max_gain if best_gain is None else min(max_gain, best_gain)
+            if stats.loudness is not None:
+                loudest = stats.loudness if loudest is None else max(stats.loudness, loudest)
+
+        if self.gain_mode == GainModes.LUFS and best_gain is not None:
+            if loudest is None:
+                print("Couldn't measure loudness, using peak gain")
+            else:
+                best_gain = min(10 ** ((self.target_loudness - loudest) / 20), best_gain)
 
         print("Optimal gain factor: {}".format(best_gain))
         self._gain = best_gain
         return self._gain
 
+    def trimGain(self):
+        '''
+        Gain applied to matched audio as it is trimmed, rather than to copies of the audio files before matching,
+        since matching doesn't depend on gain
+        Returns 1 if the gain couldn't be calculated
+        '''
+        return self.gain() or 1
+
     def loudenAudio(self):
         '''
-        Sets newAudioFiles
+        Sets the list of louder audio files
         Creates a copy of each file in srcAudioFiles and applies gain
-        If gain == 1 then skips copying and just assigns newAudioFiles to srcAudioFiles
+        If gain == 1 then skips copying and just uses srcAudioFiles
+        Only used for the louden mode, since matching and patching apply gain as the matched audio is trimmed
         '''
         if self.gain() == 1:
             print("Gain is 1... no loudening needed")
@@ -141,91 +576,104 @@ class AudioFixer:
 
         self._new_audio_files = []
         for audio_file in self.srcAudioFiles():
+            self.checkCancelled()
             if self.verbose:
                 print("\t{}".format(audio_file))
             new_audio_filepath = get_out_file_path(audio_file, self.out_dir, suffix='_louder')
 
-            if louder(audio_file, new_audio_filepath, self.gain()):
+            with PROFILER.time('louden', bytes_read=path.getsize(audio_file)) as counts:
+                loudened = louder(audio_file, new_audio_filepath, self.gain())
+                if loudened:
+                    counts['bytes_written'] = path.getsize(new_audio_filepath)
+            if loudened:
                 self._new_audio_files.append(new_audio_filepath)
-                if self.mode != Modes.LOUDEN:
-                    self._files_to_clean.append(new_audio_filepath)
 
         if self.verbose:
             print("Louder audio files:\n\t" + "\n\t".join(self._new_audio_files) + "\n")
 
-    def extractAudioFromVideo(self):
+    def extractAudioFromVideo(self, video_tups=None):
         '''
-        Sets the audio property on each of the videoFiles
+        Sets the audio property on each of the videoFiles, or only on video_tups if given
         Extracts the audio track for each video file
         '''
-        if self.verbose:
-            print("Gathering sample frequencies for source audio files")
-        audio_samp_freqs = {get_wav_metadata(audio_file).rate for audio_file in self._src_audio_files} or {44100}
+        video_tups = self.videoFiles() if video_tups is None else video_tups
 
         print("Extracting audio for each video file...")
-        for video_tup in self.videoFiles():
-            video_file = video_tup['video']
-            video_audio_file = get_out_file_path(video_file, self.out_dir, new_type='wav')
-            if self.verbose:
-                print("\t{} -> {}".format(video_file, video_audio_file))
-
-            video_tup['audio'] = {}
-            for samp_freq in audio_samp_freqs:
-                if extract_audio(video_file, video_audio_file, str(samp_freq)):
-                    video_tup['audio'][samp_freq] = video_audio_file
-                    if self.mode != Modes.EXTRACT:
-                        self._files_to_clean.append(video_audio_file)
-                else:
-                    print("Couldn't extract audio from " + video_file)
+        for video_audio_file in self.runConcurrently('extract', self.extractVideoAudio, video_tups,
+                                                     lambda video_tup: video_tup['video']):
+            if video_audio_file and self.mode != Modes.EXTRACT:
+                self._files_to_clean.append(video_audio_file)
 
         print("Audio from video files extracted!")
         self._video_audio_extracted = True
 
+    def extractVideoAudio(self, video_tup):
+        '''
+        Sets the audio property on the video_tup, to the extracted audio file or a wavio.Wav object if extracted into memory
+        The audio is extracted once, at its own sampling frequency, and resampled for matching (see videoSamples)
+        Returns the extracted audio file, or None if the audio was extracted into memory
+        '''
+        video_file = video_tup['video']
+        with PROFILER.time('extract') as counts:
+            if self.inMemory():
+                video_tup['audio'] = extract_audio_data(video_file)
+                counts['bytes_written'] = video_tup['audio'].data.nbytes
+                return None
+
+            video_audio_file = get_out_file_path(video_file, self.out_dir, new_type='wav')
+            if self.verbose:
+                print("\t{} -> {}".format(video_file, video_audio_file))
+            with self.removedOnFailure(video_audio_file):
+                extract_audio(video_file, video_audio_file)
+            counts['bytes_written'] = path.getsize(video_audio_file)
+        video_tup['audio'] = video_audio_file
+        return video_audio_file
+
     def matchVideoToAudio(self):
         '''
         Sets the matches array
         Find the best audio match for each video file, along with start/stop times and score
         '''
-        self.newAudioFiles() # Pre-gain audio
-        if not self._video_audio_extracted:
-            self.extractAudioFromVideo()
+        self.trimGain() # Calculated once here rather than by each match worker
+        self.forgetStoredRows()
+        # Audio piped into memory is extracted as each group of videos is matched (see bestMatches)
+        # Videos already matched with every audio file by an earlier run don't need their audio
+        if not self._video_audio_extracted and not self.inMemory():
+            self.extractAudioFromVideo([video_tup for video_tup in self.videoFiles() if self.needsMatching(video_tup)])
+
+        if self.time_window is not None:
+            self.candidateIndex() # Built once here rather than by each match worker
 
         # Do matching, trimming and attaching for each video file
         print("Finding best match for video files...")
         self._matches = []
-        for video_tup in self.videoFiles():
+        best_matches = self.bestMatches()
+        if self.assign:
+            best_matches = self.assignMatches(list(best_matches))
+        for video_tup, (best_audio_file, best_match, log, _) in zip(self.videoFiles(), best_matches):
             video_file = video_tup['video']
+            self.reportProgress('match', video_file, len(self.videoFiles()))
             if self.verbose:
                 print(f'\n{video_file}')
-
-            # Find best audio file to match video file
-            best_audio_file = ""
-            best_match = MatchTuple(0, 0, 0)
-            for audio_file in self.newAudioFiles():
-                rate = get_wav_metadata(audio_file).rate
-                if rate not in video_tup['audio']:
-                    print("\tSkipping {} - no audio extracted for rate {}".format(video_file, rate))
-                    continue
-                video_audio_file = video_tup['audio'][rate]
-                cur_match = match(audio_file, video_audio_file)
-                if self.verbose:
-                    print('\t', audio_file, cur_match)
-                if cur_match and cur_match.score > best_match.score:
-                    best_match = cur_match
-                    best_audio_file = audio_file
+            print(log, end='')
 
             if not best_audio_file:
                 print("No match found for", video_file)
                 continue
 
-            print("\t{0} matched with {1}, with {1} starting at {2} and ending at {3}"
-                .format(video_file, best_audio_file, best_match.start_time, best_match.end_time))
+            print("\t{0} matched with channel {4} of {1}, with {1} starting at {2} and ending at {3}"
+                .format(video_file, best_audio_file, best_match.start_time, best_match.end_time, best_match.channel + 1))
+
+            if self.inMemory():
+                self._matches.append((video_file, PendingTrim(best_audio_file, best_match.start_time, best_match.end_time,
+                                                              best_match.rate_ratio, self.trimGain(), self.trimChannels(best_match))))
+                continue
 
             print("Trimming matched audio file")
 
             # Trim audio file based on match output
             trimmed_audio_file = get_out_file_path(video_file, self.out_dir, suffix='_ext', new_type='wav')
-            if not trim(best_audio_file, trimmed_audio_file, best_match.start_time, best_match.end_time):
+            if not self.trimToFile(best_audio_file, trimmed_audio_file, best_match):
                 print(f"Couldn't trim {best_audio_file}")
                 continue
 
@@ -236,27 +684,585 @@ class AudioFixer:
             if self.mode != Modes.MATCH:
                 self._files_to_clean.append(trimmed_audio_file)
 
+        if self.verbose and self.jobs == 1:
+            store = self.matchStore()
+            print(f"Stored matches: {store.hits} hits, {store.misses} misses")
+            if self.match_backend != MatchBackends.PRAAT:
+                cache = self.spectrumCache()
+                print(f"Spectrum cache: {cache.hits} hits, {cache.misses} misses")
         print("\nMatched videos to source audio files")
 
+    def bestMatches(self):
+        '''
+        Generate (best_audio_file, best_match, log, results) for each of videoFiles, in order (see findBestMatches)
+        Videos are matched in groups of up to BATCH_VIDEOS (see findBestMatches),
+        and the groups are spread over a process pool if jobs > 1
+        With one job, audio piped through memory is extracted for each group before it is matched (see prefetchVideoAudio)
+        Raises Cancelled once cancelled, after any groups already being matched are done
+        '''
+        video_tups = self.videoFiles()
+        group_size = max(min(BATCH_VIDEOS, -(-len(video_tups) // self.jobs)), 1)
+        groups = [video_tups[i:i + group_size] for i in range(0, len(video_tups), group_size)]
+        if self.jobs == 1:
+            for group in groups:
+                self.checkCancelled()
+                if self.inMemory():
+                    self.prefetchVideoAudio(group)
+                try:
+                    with profiled(self.match_profile_file):
+                        group_matches = self.findBestMatches(group)
+                finally:
+                    if self.inMemory():
+                        for video_tup in group:
+                            video_tup.pop('audio', None) # Only one group's audio is kept in memory at a time
+                yield from group_matches
+            return
+
+        self._workers_cancelled = multiprocessing.Event()
+        if self.cancelled():
+            self._workers_cancelled.set()
+        executor = ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_match_worker,
+                                       initargs=(self.__getstate__(), self._workers_cancelled))
+        futures = [executor.submit(_match_worker, group) for group in groups]
+        try:
+            for future in futures:
+                group_matches, stages = future.result()
+                self.checkCancelled()
+                PROFILER.merge(stages)
+                yield from group_matches
+        finally:
+            # Groups that haven't started aren't waited for
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
+            self._workers_cancelled = None
+            if self.match_profile_file:
+                merge_dumps(self.match_profile_file)
+
+    def prefetchVideoAudio(self, video_tups):
+        '''
+        Extract the audio of each of video_tups that still needs matching into memory, with up to io_jobs ffmpeg processes at once,
+        rather than leaving findBestMatch to extract each video's audio itself, one at a time
+        Videos that fail are added to the failures list
+        '''
+        pending = [video_tup for video_tup in video_tups if 'audio' not in video_tup and self.needsMatching(video_tup)]
+        self.runConcurrently('extract', self.extractVideoAudio, pending, lambda video_tup: video_tup['video'], len(self.videoFiles()))
+
+    def assignMatches(self, best_matches):
+        '''
+        Replace the best match of each of videoFiles, in best_matches from bestMatches, with its match in a consistent
+        assignment of every video (see setAssign)
+        A video assigned another audio file than its best keeps that file's stored match, without its drift corrected
+        Rejected videos are placed where the other videos from their camera put them, if they match there (see placementMatch),
+        and are otherwise left without a match, with the reason added to their log
+        '''
+        clips = []
+        for video_tup, (best_audio_file, best_match, _, results) in zip(self.videoFiles(), best_matches):
+            timestamps = self.videoTimestamps(video_tup)
+            clock = next(((clock, getattr(timestamps, clock)) for clock in CLOCKS if getattr(timestamps, clock) is not None), None)
+            # The best match may have had its drift corrected since it was added to results
+            candidates = [(audio_file, best_match if audio_file == best_audio_file else cur_match) for audio_file, cur_match in results]
+            clips.append(Clip(path.dirname(path.realpath(video_tup['video'])), clock, candidates))
+
+        with PROFILER.time('assign', videos=len(clips)):
+            assigned = assign_matches(clips, self.min_score)
+        video_datas = {}
+        rematch = lambda i, audio_file, start_time: self.placementMatch(
+            self.videoFiles()[i], video_datas.setdefault(i, {}), audio_file, start_time, clips[i].candidates)
+        placements, placed = place_rejected(clips, assigned, rematch, self.min_score)
+
+        assigned_matches = []
+        for i, (best_audio_file, best_match, log, results) in enumerate(best_matches):
+            audio_file, match_tuple, reason = placements[i]
+            if i in placed:
+                log += (f"\tPlaced in {audio_file} where the other videos from its camera put it, "
+                        f"rather than rejecting {best_audio_file or 'every match'}, since {assigned[i][2]}\n")
+            elif reason is not None:
+                log += f"\tRejected {best_audio_file or 'every match'}, since {reason}\n"
+            elif audio_file != best_audio_file:
+                log += f"\tAssigned {audio_file} rather than {best_audio_file}, to fit the other videos\n"
+            assigned_matches.append((audio_file or "", match_tuple, log, results))
+        return assigned_matches
+
+    def placementMatch(self, video_tup, video_data, audio_file, start_time, results):
+        '''
+        Match a rejected video with the audio file only near start_time, where the other videos from its camera put it
+        (see assignment.place_rejected), so a weak match there can be told apart from unrelated audio
+        Only the FFT backend can search near an offset, so the others use the video's match in results, if it has one with the file
+        Returns MatchTuple, or None if it can't be matched
+        '''
+        if self.match_backend != MatchBackends.FFT:
+            return next((match_tuple for result_file, match_tuple in results if result_file == audio_file), None)
+        samples = self.videoSamples(video_tup, video_data)
+        coarse_reference = self.spectrumCache().get(audio_file, coarse=True)
+        if samples is None or coarse_reference is None:
+            return None
+        with PROFILER.time('match', pairs=1):
+            return match_refined(coarse_reference, samples[0], start_time, OFFSET_TOLERANCE)
+
+    def findBestMatches(self, video_tups):
+        '''
+        Same as findBestMatch for each of a group of videos, returning (best_audio_file, best_match, log, results) for each
+        log holds the output printed while matching, so it stays grouped by video
+        With the FFT backend, unless shortlisting or voting, each audio file is correlated against
+        every video in the group that needs it in one batch, rather than one video at a time
+        '''
+        if self.match_backend != MatchBackends.FFT or self.top_k > 0 or self.num_windows:
+            best = []
+            for video_tup in video_tups:
+                log = StringIO()
+                with redirect_stdout(log):
+                    best_audio_file, best_match, results = self.findBestMatch(video_tup)
+                best.append((best_audio_file, best_match, log.getvalue(), results))
+            return best
+
+        logs = [StringIO() for _ in video_tups]
+        video_datas = [{} for _ in video_tups]
+        all_results = []
+        matched = [set() for _ in video_tups]
+        pending = {} # Audio file to the indices of the videos it still has to be matched with
+        for i, video_tup in enumerate(video_tups):
+            with redirect_stdout(logs[i]):
+                results, candidates = self.storedMatches(video_tup)
+            all_results.append(results)
+            for audio_file in candidates:
+                pending.setdefault(audio_file, []).append(i)
+
+        for audio_file, indices in pending.items():
+            self.checkCancelled()
+            reference = self.spectrumCache().get(audio_file)
+            if reference is None:
+                continue
+            loaded = []
+            for i in indices:
+                with redirect_stdout(logs[i]):
+                    samples = self.videoSamples(video_tups[i], video_datas[i])
+                if samples is not None:
+                    loaded.append((i, samples[0]))
+
+            with PROFILER.time('match', pairs=len(loaded)):
+                batch_matches = match_prepared_batch(reference, [samples for _, samples in loaded])
+            for (i, _), cur_match in zip(loaded, batch_matches):
+                with redirect_stdout(logs[i]):
+                    if self.verbose:
+                        print('\t', audio_file, cur_match)
+                    self.storeMatch(video_tups[i]['video'], audio_file, cur_match)
+                all_results[i].append((audio_file, cur_match))
+                matched[i].add(audio_file)
+
+        best = []
+        for i, video_tup in enumerate(video_tups):
+            with redirect_stdout(logs[i]):
+                best_audio_file, best_match = self.chooseBestMatch(video_tup, all_results[i], matched[i], video_datas[i])
+            best.append((best_audio_file, best_match, logs[i].getvalue(), all_results[i]))
+        return best
+
+    def findBestMatch(self, video_tup):
+        '''
+        Match each of candidateAudioFiles against the video file's extracted audio
+        Pairs matched by an earlier run are taken from the match store, and new results are added to it
+        If drift correction is on, a newly matched best pair is stored with its drift corrected
+        Returns the best matching audio file (empty if none matched), its MatchTuple,
+        and results, a list of (audio_file, MatchTuple) for every audio file matched
+        '''
+        video_file = video_tup['video']
+        results, candidates = self.storedMatches(video_tup)
+
+        video_data = {} # Video audio loaded once and shared by every audio file
+        matched = set() # Audio files newly matched rather than taken from the match store
+        if self.match_backend == MatchBackends.FFT and self.top_k > 0:
+            with PROFILER.time('shortlist', pairs=len(candidates)):
+                candidates = self.shortlist(video_tup, candidates, video_data)
+        else:
+            candidates = [(audio_file, None) for audio_file in candidates]
+
+        for audio_file, approx_offset in candidates:
+            self.checkCancelled()
+            with PROFILER.time('match', pairs=1):
+                cur_match = self.matchPair(audio_file, video_tup, video_data, approx_offset)
+            if self.verbose:
+                print('\t', audio_file, cur_match)
+            if cur_match:
+                self.storeMatch(video_file, audio_file, cur_match)
+                results.append((audio_file, cur_match))
+                matched.add(audio_file)
+
+        return (*self.chooseBestMatch(video_tup, results, matched, video_data), results)
+
+    def storedMatches(self, video_tup):
+        '''
+        Look up each of candidateAudioFiles for the video in the match store
+        Returns (results, candidates), where results is a list of (audio_file, MatchTuple) for stored pairs,
+        and candidates is a list of audio files that still have to be matched
+        '''
+        video_file = video_tup['video']
+        results = []
+        candidates = []
+        rows = self.storedRows(video_tup)
+        # Matches stored from here on aren't in the rows, so they're looked up again if the video is matched again
+        del video_tup['stored']
+        for audio_file, stored_match in rows:
+            if stored_match is not None:
+                if self.verbose:
+                    print('\t', audio_file, stored_match, '(stored)')
+                results.append((audio_file, stored_match))
+            else:
+                candidates.append(audio_file)
+        # Stored matches are still used without the video's audio, but nothing new can be matched
+        if candidates and 'audio' not in video_tup and not self.inMemory():
+            print("\tSkipping {} unmatched audio files for {} - no audio extracted".format(len(candidates), video_file))
+            candidates = []
+        return results, candidates
+
+    def chooseBestMatch(self, video_tup, results, matched, video_data):
+        '''
+        Return the best of results, a list of (audio_file, MatchTuple) for the video, as (best_audio_file, best_match)
+        The drift of the best match is corrected if it is one of the newly matched audio files
+        '''
+        best_audio_file = ""
+        best_match = MatchTuple(0, 0, 0)
+        for audio_file, cur_match in results:
+            if cur_match.score > best_match.score:
+                best_match = cur_match
+                best_audio_file = audio_file
+
+        if self.drift and best_audio_file in matched:
+            best_match = self.correctDrift(video_tup, best_audio_file, best_match, video_data)
+        return best_audio_file, best_match
+
+    def correctDrift(self, video_tup, audio_file, match_tuple, video_data):
+        '''
+        Estimate the clock drift between the video and its matched audio file, and store the corrected match
+        Returns the corrected MatchTuple
+        '''
+        samples = self.videoSamples(video_tup, video_data)
+        if samples is None:
+            return match_tuple
+        with PROFILER.time('drift'):
+            corrected = correct_drift(audio_file, samples[0], self.analysis_rate, match_tuple)
+        if corrected.rate_ratio != match_tuple.rate_ratio:
+            if self.verbose:
+                print('\t', audio_file, 'drift corrected:', corrected)
+            self.storeMatch(video_tup['video'], audio_file, corrected)
+        return corrected
+
+    def shortlist(self, video_tup, candidates, video_data):
+        '''
+        Compare energy envelopes of each candidate audio file with the video's audio
+        Returns the top_k best as (audio_file, approximate offset)
+        '''
+        scored = []
+        for audio_file in candidates:
+            coarse_reference = self.spectrumCache().get(audio_file, coarse=True)
+            samples = self.videoSamples(video_tup, video_data)
+            if coarse_reference is None or samples is None:
+                continue
+            result = coarse_match(coarse_reference, samples[0], samples[2])
+            if self.verbose:
+                print('\t', audio_file, 'coarse (offset, score, channel):', result)
+            if result:
+                scored.append((result[1], audio_file, result[0]))
+
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [(audio_file, offset) for _, audio_file, offset in scored[:self.top_k]]
+
+    def videoSamples(self, video_tup, video_data):
+        '''
+        Load the video's audio, resampled to the analysis rate, into video_data if needed,
+        from its extracted audio file, from memory, or by extracting it now if piping audio through memory
+        Returns (samples, full rate spectra, envelope spectra, landmarks), or None if the audio can't be loaded
+        '''
+        if self.analysis_rate not in video_data:
+            video_audio = video_tup.get('audio')
+            samples = None
+            try:
+                if isinstance(video_audio, str):
+                    samples = read_mono(video_audio, self.analysis_rate)
+                else:
+                    if video_audio is None:
+                        with PROFILER.time('extract'):
+                            video_audio = extract_audio_data(video_tup['video'])
+                    samples = resample_mono(video_audio.data, video_audio.rate, self.analysis_rate)
+            except FfmpegError as e:
+                print("\tERR: Couldn't extract audio from {}: {}".format(video_tup['video'], e))
+            except (OSError, WavFormatError) as e:
+                print("\tERR: Couldn't read audio for {}: {}".format(video_tup['video'], e))
+            video_data[self.analysis_rate] = (samples, {}, {}, {}) if samples is not None and len(samples) else None
+        return video_data[self.analysis_rate]
+
+    def matchPair(self, audio_file, video_tup, video_data, approx_offset=None):
+        '''
+        Match a single external audio file with a video's extracted audio, using the match backend
+        video_data is a dict kept for the duration of one video, holding its loaded samples and spectra
+        If approx_offset is given, only search near it, otherwise vote between windows if set
+        The fingerprint backend looks the video up in the audio file's landmark index instead
+        '''
+        if self.match_backend == MatchBackends.PRAAT:
+            return match(audio_file, video_tup['audio'])
+
+        samples = self.videoSamples(video_tup, video_data)
+        if samples is None:
+            return None
+        if self.match_backend == MatchBackends.FINGERPRINT:
+            fingerprints = self.spectrumCache().fingerprints(audio_file)
+            return match_fingerprinted(fingerprints, audio_file, samples[0], self.analysis_rate, samples[3]) if fingerprints else None
+        if approx_offset is not None:
+            coarse_reference = self.spectrumCache().get(audio_file, coarse=True)
+            return match_refined(coarse_reference, samples[0], approx_offset) if coarse_reference else None
+        if self.num_windows:
+            return match_windowed(audio_file, samples[0], self.analysis_rate, self.num_windows, self.window_length,
+                                  self.all_channels)
+        reference = self.spectrumCache().get(audio_file)
+        return match_prepared(reference, samples[0], samples[1]) if reference else None
+
     def patch(self):
         '''
         First run the matching
         Then, for each video file, create a trimmed copy of the best matching audio and attach to a new copy of the video
         '''
+        if self.stream and not self.assign:
+            self.patchStreaming()
+            return
+
         self.matchVideoToAudio()
 
-        patched_video_files = []
-        for video_file, audio_file in self._matches:
-            if self.verbose:
-                print(f"Attaching {audio_file} to {video_file}")
-            patched_video_file = get_out_file_path(video_file, self.out_dir, suffix='_patched')
-            if attach(audio_file, video_file, patched_video_file):
-                patched_video_files.append(patched_video_file)
+        attach_audio = lambda video_audio_match: self.attachMatch(*video_audio_match)
+        patched_video_files = [patched_video_file for patched_video_file in
+                               self.runConcurrently('attach', attach_audio, self._matches, lambda match_tup: match_tup[0])
+                               if patched_video_file]
 
         print("\nCreated patched video files:\n", "\n".join(patched_video_files))
 
+    def attachMatch(self, video_file, trimmed_audio):
+        '''
+        Attach trimmed audio, either a file or a PendingTrim, to a new copy of the video file
+        Returns the patched video file
+        '''
+        if self.verbose:
+            print(f"Attaching {trimmed_audio} to {video_file}")
+        patched_video_file = get_out_file_path(video_file, self.out_dir, suffix='_patched')
+        if isinstance(trimmed_audio, PendingTrim):
+            with PROFILER.time('trim') as counts:
+                wav_data = trim_data(*trimmed_audio)
+                if wav_data is None:
+                    raise Exception(f"Couldn't trim {trimmed_audio.audio_file}")
+                counts['bytes_written'] = wav_data.data.nbytes
+            with PROFILER.time('attach'), self.removedOnFailure(patched_video_file):
+                attach_data(wav_data, video_file, patched_video_file)
+        else:
+            with PROFILER.time('attach'), self.removedOnFailure(patched_video_file):
+                attach(trimmed_audio, video_file, patched_video_file)
+        return patched_video_file
+
+    def trimChannels(self, match_tuple):
+        '''
+        Return the channels of the matched audio file to keep when trimming, or None for every channel (see setPatchChannels)
+        '''
+        if self.patch_channels == MATCHED_CHANNEL:
+            return [match_tuple.channel]
+        return self.patch_channels
+
+    def trimToFile(self, audio_file, trimmed_audio_file, match_tuple):
+        '''
+        Trim the matched section of the audio file into trimmed_audio_file, applying trimGain and keeping trimChannels
+        Returns whether it succeeded
+        '''
+        with PROFILER.time('trim') as counts:
+            trimmed = trim(audio_file, trimmed_audio_file, match_tuple.start_time, match_tuple.end_time, match_tuple.rate_ratio,
+                           self.trimGain(), self.trimChannels(match_tuple))
+            if trimmed:
+                counts['bytes_written'] = path.getsize(trimmed_audio_file)
+        return trimmed
+
+    def patchStreaming(self):
+        '''
+        Same as patch, but each video goes through extract, match/trim and attach as soon as the previous stage is done with it
+        Temporary files for a video are removed as soon as they are no longer needed,
+        so only about PIPELINE_DEPTH videos' worth exist at any time
+        '''
+        self.trimGain()
+        self.forgetStoredRows()
+        self._matches = []
+        if self.time_window is not None:
+            self.candidateIndex()
+
+        num_videos = len(self.videoFiles())
+
+        def extract_stage(video_tup):
+            self.checkCancelled()
+            if not self.needsMatching(video_tup):
+                return video_tup
+            video_audio_file = self.extractVideoAudio(video_tup)
+            if video_audio_file:
+                self._files_to_clean.append(video_audio_file)
+            self.reportProgress('extract', video_tup['video'], num_videos)
+            return video_tup
+
+        def match_stage(video_tup):
+            video_file = video_tup['video']
+            try:
+                self.checkCancelled()
+                with profiled(self.match_profile_file):
+                    best_audio_file, best_match, _ = self.findBestMatch(video_tup)
+            finally:
+                video_audio = video_tup.pop('audio', None)
+                if isinstance(video_audio, str):
+                    self.removeTempFile(video_audio)
+            self.reportProgress('match', video_file, num_videos)
+
+            if not best_audio_file:
+                print("No match found for", video_file)
+                return None
+            print("\t{0} matched with channel {4} of {1}, with {1} starting at {2} and ending at {3}"
+                .format(video_file, best_audio_file, best_match.start_time, best_match.end_time, best_match.channel + 1))
+
+            if self.inMemory():
+                trimmed_audio = PendingTrim(best_audio_file, best_match.start_time, best_match.end_time, best_match.rate_ratio,
+                                            self.trimGain(), self.trimChannels(best_match))
+            else:
+                trimmed_audio = get_out_file_path(video_file, self.out_dir, suffix='_ext', new_type='wav')
+                self._files_to_clean.append(trimmed_audio)
+                if not self.trimToFile(best_audio_file, trimmed_audio, best_match):
+                    raise Exception(f"Couldn't trim {best_audio_file}")
+            self._matches.append((video_file, trimmed_audio))
+            return video_file, trimmed_audio
+
+        def attach_stage(video_audio_match):
+            video_file, trimmed_audio = video_audio_match
+            try:
+                self.checkCancelled()
+                patched_video_file = self.attachMatch(video_file, trimmed_audio)
+            finally:
+                if isinstance(trimmed_audio, str):
+                    self.removeTempFile(trimmed_audio)
+            self.reportProgress('attach', video_file, num_videos)
+            print(f"Created {patched_video_file}")
+            return patched_video_file
+
+        def on_error(stage, item, exc):
+            if self.cancelled():
+                return # Every item left fails once cancelled, which isn't worth reporting
+            self.failures.append((stage, item['video'] if isinstance(item, dict) else item[0], str(exc)))
+
+        print("Streaming video files through extract, match and attach...")
+        stages = [
+            ('extract', extract_stage, self.io_jobs),
+            ('match', match_stage, 1),
+            ('attach', attach_stage, self.io_jobs),
+        ]
+        patched_video_files = run_pipeline(self.videoFiles(), stages, PIPELINE_DEPTH, on_error)
+        self.checkCancelled()
+
+        print("\nCreated patched video files:\n", "\n".join(patched_video_files))
+
+    def removeTempFile(self, temp_file):
+        '''
+        Remove a temporary file early, rather than waiting for cleanup
+        '''
+        if temp_file in self._files_to_clean:
+            self._files_to_clean.remove(temp_file)
+        if path.exists(temp_file):
+            os.remove(temp_file)
+
+    def runConcurrently(self, stage, func, items, item_file, total=None):
+        '''
+        Run func on each item with up to io_jobs threads
+        Returns the results in the same order as items, with None for items that failed
+        Failures are added to the failures list under the given stage, using item_file(item) to name them
+        Progress is reported as each item finishes, out of total items if given, or else out of items,
+        and Cancelled is raised once cancelled, without starting any more items
+        '''
+        def run(item):
+            self.checkCancelled()
+            return func(item)
+
+        results = []
+        with ThreadPoolExecutor(max_workers=self.io_jobs) as executor:
+            futures = [executor.submit(run, item) for item in items]
+            for item, future in zip(items, futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    if self.cancelled():
+                        for pending in futures:
+                            pending.cancel()
+                        raise Cancelled() from e
+                    self.failures.append((stage, item_file(item), str(e)))
+                    results.append(None)
+                self.reportProgress(stage, item_file(item), total or len(items))
+        return results
+
+    def reportProgress(self, stage, item_file, total):
+        '''
+        Count another item finished by the stage, and pass it on to the progress function if set
+        '''
+        with self._progress_lock:
+            done = self._progress_done.get(stage, 0) + 1
+            self._progress_done[stage] = done
+        if self.progress:
+            self.progress(stage, item_file, done, total)
+
+    def cancel(self):
+        '''
+        Stop the run in progress, from another thread, by killing any running ffmpeg processes,
+        including those of match worker processes, and raising Cancelled from the run's next step
+        Partial output files are removed, but the run still has to be cleaned up by its own thread
+        '''
+        self._cancelled.set()
+        workers_cancelled = self._workers_cancelled
+        if workers_cancelled is not None:
+            workers_cancelled.set()
+        cancel_ffmpeg()
+
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def checkCancelled(self):
+        if self.cancelled():
+            raise Cancelled()
+
+    @contextmanager
+    def removedOnFailure(self, output_file):
+        '''
+        Remove output_file if the with block fails, such as when its ffmpeg process is killed,
+        so that no partially written files are left
+        '''
+        try:
+            yield
+        except BaseException:
+            if path.exists(output_file):
+                os.remove(output_file)
+            raise
+
+    def reportFailures(self):
+        if not self.failures:
+            return
+        print("\nFailed files:")
+        for stage, failed_file, reason in self.failures:
+            print(f"\t{stage}: {failed_file} - {reason}")
+
+    def writeProfile(self):
+        '''
+        Write the run report, if a profile file is set
+        '''
+        if not self.profile_file:
+            return
+        try:
+            PROFILER.write(self.profile_file)
+            print(f"Run report written to {self.profile_file}")
+        except OSError as e:
+            print("\tERR: Couldn't write run report: {}".format(e))
+
+    def profileSummary(self):
+        '''
+        Return the time spent in each stage so far, as lines of text
+        '''
+        return PROFILER.summary()
+
     def cleanup(self):
         if self.verbose:
             print("Cleaning up temporary files")
         for file_to_clean in self._files_to_clean:
-            os.remove(file_to_clean)
+            if path.exists(file_to_clean):
+                os.remove(file_to_clean)
+        self._files_to_clean = []
@@ -1,22 +1,112 @@
+import os
+import struct
 from os import path
+from fractions import Fraction
+from math import ceil
 from collections import namedtuple
-from functools import partial
 from subprocess import Popen, PIPE
-from cachetools import cached
+from threading import Lock, Event
+from cachetools import cached, LRUCache
+from cachetools.keys import hashkey
 from wave import Error as WavError
 import numpy as np
 from scipy.io import wavfile
+from scipy.signal import resample_poly, firwin
 import wavio
-import parselmouth
+from .correlate import (to_mono, to_channels, video_window, correlate_batch, match_reference, refine_match,
+                        match_windows, estimate_drift, locate_window, ANALYSIS_WINDOW, REFINE_MARGIN)
+from .fingerprint import build_fingerprints, clip_landmarks, locate_landmarks, FINGERPRINT_HOP
+from .wav_io import (BLOCK_FRAMES, WavReader, WavWriter, WavFormatError, read_wav_info, decode_wav_bytes, stream_wav_file,
+                     cast_samples, silent_value)
+from .loudness import LoudnessMeter
+from .profiler import PROFILER
 
 FLOAT_SAMPWIDTH = -1
 
 #  the start and end time relative to the audio file start time, in seconds,
 #    that would correspond to the true start and end time of a video file
 #  a score that is higher with a better match (should be a percentage for comparison purposes)
-MatchTuple = namedtuple('MatchTuple', ['start_time', 'end_time', 'score'])
-
-WavMetaData = namedtuple('WavMetaData', ['length', 'rate'])
+#  the rate ratio, which is how many seconds pass in the audio file for each second of the video file
+#  the channel of the audio file that matched best, numbered from 0
+MatchTuple = namedtuple('MatchTuple', ['start_time', 'end_time', 'score', 'rate_ratio', 'channel'], defaults=[1.0, 0])
+
+# length in seconds, sampwidth in bytes per sample
+# time_reference and origination are the Broadcast Wave start time, if present (see wav_io.WavInfo)
+WavMetaData = namedtuple('WavMetaData', ['length', 'rate', 'channels', 'sampwidth', 'is_float', 'time_reference', 'origination'])
+
+# Level of an audio file, relative to full scale
+#  peak - largest absolute sample value, as a fraction of full scale
+#  rms - root mean square of all samples, as a fraction of full scale
+#  loudness - integrated loudness in LUFS (see loudness.LoudnessMeter), or None if the file is too short or quiet
+AudioStats = namedtuple('AudioStats', ['peak', 'rms', 'loudness'])
+
+# Number of files to remember metadata for
+METADATA_CACHE_SIZE = 4096
+
+# Largest denominator used when approximating a rate ratio as a fraction for resampling
+MAX_RESAMPLE_DENOMINATOR = 2 ** 16
+
+# Input frames per block when resampling, as a multiple of the resampling fraction's denominator
+RESAMPLE_BLOCK_MULTIPLE = 4
+
+class FfmpegError(Exception):
+    pass
+
+# Raised by run_ffmpeg once cancel_ffmpeg is called
+class FfmpegCancelled(FfmpegError):
+    pass
+
+# ffmpeg processes that are running, so they can be stopped by cancel_ffmpeg
+_ffmpeg_procs = set()
+_ffmpeg_lock = Lock()
+_ffmpeg_cancelled = Event()
+
+# Run an ffmpeg command to completion, passing it input_data on stdin if given
+# Returns what ffmpeg wrote to stdout
+# Raises FfmpegError with the end of ffmpeg's error output if it fails, or FfmpegCancelled if cancelled
+def run_ffmpeg(cmd, input_data=None):
+    with PROFILER.time('ffmpeg', bytes_written=len(input_data or b'')) as counts:
+        with _ffmpeg_lock:
+            if _ffmpeg_cancelled.is_set():
+                raise FfmpegCancelled("Cancelled")
+            proc = Popen(cmd, stdin=PIPE if input_data is not None else None, stdout=PIPE, stderr=PIPE)
+            _ffmpeg_procs.add(proc)
+        try:
+            out, err = proc.communicate(input_data)
+        finally:
+            with _ffmpeg_lock:
+                _ffmpeg_procs.discard(proc)
+        counts['bytes_read'] = len(out)
+    if _ffmpeg_cancelled.is_set():
+        raise FfmpegCancelled("Cancelled")
+    if proc.returncode != 0:
+        err_lines = err.decode(errors='replace').strip().splitlines()
+        raise FfmpegError(err_lines[-1] if err_lines else "ffmpeg exited with code {}".format(proc.returncode))
+    return out
+
+# Kill every running ffmpeg process, and stop run_ffmpeg from starting more until allow_ffmpeg is called
+def cancel_ffmpeg():
+    with _ffmpeg_lock:
+        _ffmpeg_cancelled.set()
+        for proc in _ffmpeg_procs:
+            proc.kill()
+
+def allow_ffmpeg():
+    _ffmpeg_cancelled.clear()
+
+# Get the ffmpeg raw format and little endian bytes for a sample array, as read by read_wav_file
+def to_pcm(data, sampwidth):
+    if sampwidth == FLOAT_SAMPWIDTH:
+        if data.dtype.itemsize > 4:
+            return 'f64le', np.asarray(data, '<f8').tobytes()
+        return 'f32le', np.asarray(data, '<f4').tobytes()
+    if sampwidth == 1:
+        return 'u8', np.asarray(data, np.uint8).tobytes()
+    if sampwidth == 2:
+        return 's16le', np.asarray(data, '<i2').tobytes()
+    # 24 bit samples are held in the low bytes of 32 bit ints, so move them up to full scale
+    shift = 8 if sampwidth == 3 else 0
+    return 's32le', (np.asarray(data, '<i4') << shift).astype('<i4').tobytes()
 
 def dtype_to_sampwidth(dtype):
     if str(dtype).startswith('float'):
@@ -49,101 +139,154 @@ def read_wav_file(wav_file):
         print("\tERR: Couldn't read data: {}".format(e))
         return None
 
-@cached(cache={})
+# Identify a file by its size and modification time too, so cached results are dropped when it is rewritten
+def file_key(file_path):
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return hashkey(file_path, None, None)
+    return hashkey(file_path, stat.st_mtime_ns, stat.st_size)
+
+# Only reads the file's headers, not its samples
+@cached(cache=LRUCache(maxsize=METADATA_CACHE_SIZE), key=file_key)
 def get_wav_metadata(audio_file):
-    wav_data = read_wav_file(audio_file)
-    if not wav_data:
+    try:
+        info = read_wav_info(audio_file)
+    except (OSError, WavFormatError, struct.error) as e:
+        print("\tERR: Couldn't read header: {}".format(e))
         return None
-    return WavMetaData(len(wav_data.data) / float(wav_data.rate), wav_data.rate)
+    return WavMetaData(info.num_frames / float(info.rate), info.rate, info.channels, info.sampwidth, info.is_float,
+                       info.time_reference, info.origination)
+
+# Value that samples are divided by to bring them to a full scale of 1, once centered on their silent value
+def full_scale(sampwidth, is_float):
+    return 1.0 if is_float else float(2 ** (8 * sampwidth - 1))
+
+# Measure the peak, RMS and loudness of an audio file in a single pass over its samples
+# The file is read in blocks, so memory use doesn't depend on its length
+# Return AudioStats
+def analyze_audio(audio_file):
+    with WavReader(audio_file) as reader:
+        info = reader.info
+        scale = full_scale(info.sampwidth, info.is_float)
+        center = silent_value(reader.dtype)
+        meter = LoudnessMeter(info.rate, info.channels)
+        peak = 0.0
+        sum_squares = 0.0
+        for block in reader.blocks():
+            samples = (block.astype(np.float64) - center) / scale
+            # Negative peaks count too, so the gain is limited by whichever is larger
+            peak = max(peak, float(np.max(np.abs(samples), initial=0)))
+            sum_squares += float(np.sum(samples ** 2))
+            meter.add(samples)
+    num_samples = info.num_frames * info.channels
+    rms = np.sqrt(sum_squares / num_samples) if num_samples else 0.0
+    return AudioStats(peak, float(rms), meter.integrated())
 
 # Get the maximum amount that a audio file's samples may be scaled by
 # Such that the result will not peak
-def get_max_gain(audio_file, verbose=True):
+def get_max_gain(audio_file, verbose=True, stats=None):
     if verbose:
         print(audio_file)
 
-    wav_data = read_wav_file(audio_file)
-    if not wav_data:
-        return None
-    sampwidth = wav_data.sampwidth
-
-    if verbose:
-        print(f"\t{wav_data}")
+    if stats is None:
+        try:
+            stats = analyze_audio(audio_file)
+        except (OSError, WavFormatError, struct.error) as e:
+            print("\tERR: Couldn't read data: {}".format(e))
+            return None
 
-    # Get data format to find the maximum possible gain
-    if sampwidth == FLOAT_SAMPWIDTH:
-        max_value = 1
-    elif 1 <= sampwidth <= 4:
-        bits_per_sample = 8 * sampwidth
-        max_value = 2 ** bits_per_sample
-    else:
-        print(f"\tERR: Unknown data format for {wav_data} from {audio_file}")
+    if not stats.peak:
+        print(f"\tERR: {audio_file} is silent")
         return None
 
-    # Get loudest sample in the file
-    max_sample = np.amax(wav_data.data)
-
     # Get maximum amount samples can be multiplied by
-    max_gain = max_value / max_sample
+    max_gain = 1 / stats.peak
 
     if verbose:
-        print("\tmax possible sample value: {}".format(max_value))
-        print("\tmax sample found: {}".format(max_sample))
+        print("\tpeak: {:.4f} of full scale, RMS: {:.4f} of full scale, loudness: {} LUFS".format(
+            stats.peak, stats.rms, "{:.1f}".format(stats.loudness) if stats.loudness is not None else "unknown"))
         print("\tmax possible gain increase: {}".format(max_gain))
 
     return max_gain
 
-def modify_wav_file(input_file, output_file, data_processor):
-    # Get source samples
-    wav_data = read_wav_file(input_file)
-    if not wav_data:
-        return False
-    data = wav_data.data
-
-    # Process the samples
-    data = data_processor(data, wav_data.rate)
-
-    # Make sure dtype doesn't change since this can happen with certain operations
-    dtype = str(data.dtype)
-    data = np.asarray(data, dtype)
-
-    # Write the modified sample array to the new file
-    try:
-        sampwidth = 4 if wav_data.sampwidth == FLOAT_SAMPWIDTH else wav_data.sampwidth
-        wavio.write(output_file, data, wav_data.rate, sampwidth=sampwidth)
-    except Exception as e:
-        print("\tERR: Couldn't write data: {}".format(e))
-        return False
-
-    return True
+# Scale a block of samples, keeping 8 bit samples centered on their unsigned midpoint
+# center is the silent value of the samples' stored format, if they have already been converted to float
+def scale_samples(data, scale, center=None):
+    center = silent_value(data.dtype) if center is None else center
+    if center:
+        return (data.astype(np.float32) - center) * scale + center
+    # As a float, so an integer gain can't overflow integer samples rather than being clipped when they're written
+    return data * float(scale)
 
 # Scale the audio file's samples by the given amount
 # Write out new file to desired location
+# The file is processed in blocks, so memory use doesn't depend on its length
 # Returns if successful
 def louder(audio_file, new_audio_file, scale):
-    return modify_wav_file(audio_file, new_audio_file, lambda data, rate: data * scale)
+    try:
+        stream_wav_file(audio_file, new_audio_file, lambda data: scale_samples(data, scale))
+    except (OSError, WavFormatError) as e:
+        print("\tERR: Couldn't louden {}: {}".format(audio_file, e))
+        return False
+    return True
 
 # Extract the audio of the given video file and place in output_audio_file
-# Return True for success and False for failure
-def extract_audio(video_file, output_audio_file, output_samp_freq):
+# The audio keeps its own sampling frequency unless output_samp_freq is given
+# Return True for success, raises FfmpegError on failure
+def extract_audio(video_file, output_audio_file, output_samp_freq=None):
     cmd = [
         'ffmpeg',
         '-i', video_file,
         '-map', '0:a', # Select audio stream from first input
         '-acodec', 'pcm_s16le', # Encode output audio as default wav format (signed 16 bit little endian)
-        '-ar', output_samp_freq, # Set output sampling frequency
+    ]
+    if output_samp_freq:
+        cmd += ['-ar', str(output_samp_freq)] # Set output sampling frequency
+    cmd += [
         '-y', # Don't ask for confirmation
         output_audio_file
     ]
-    proc = Popen(cmd, stdout=PIPE, stderr=PIPE)
-    _, err = proc.communicate()
-    if proc.returncode != 0:
-        print(err)
-    return proc.returncode == 0
+    run_ffmpeg(cmd)
+    return True
+
+# Extract the first audio stream of the given video file straight into memory, downmixed to one channel
+# The audio keeps its own sampling frequency, which is read from the wav header ffmpeg writes
+# Return a wavio.Wav object, raises FfmpegError on failure
+def extract_audio_data(video_file):
+    cmd = [
+        'ffmpeg',
+        '-i', video_file,
+        '-map', '0:a:0', # Select first audio stream from first input
+        '-ac', '1', # Downmix to one channel
+        '-acodec', 'pcm_s16le', # Encode as signed 16 bit little endian samples
+        '-f', 'wav', # In a wav stream, so the sampling frequency is known
+        'pipe:1'
+    ]
+    try:
+        info, data = decode_wav_bytes(run_ffmpeg(cmd))
+    except (WavFormatError, struct.error) as e:
+        raise FfmpegError(f"Couldn't read extracted audio: {e}") from e
+    return wavio.Wav(data, info.rate, info.sampwidth)
+
+# Build a MatchTuple from a correlation offset and score
+def score_match(offset, score, vid_audio_len, ext_audio_len, channel=0):
+    start_time = offset
+    end_time = start_time + vid_audio_len
+
+    # Scoring heuristic - if a large part of the video is left silent, it is likely not matched correctly
+    silence_time = max(-1 * start_time, 0) + max(end_time - ext_audio_len, 0)
+    silence_ratio = float(silence_time) / vid_audio_len
+
+    return MatchTuple(start_time, end_time, score * (1 - silence_ratio), channel=channel)
 
 # Match the separate audio with the audio from the video
+# Uses Praat, kept as the reference implementation, so only the first channel of the separate audio is matched
 # Return MatchTuple
 def match(ext_audio_file, video_audio_file):
+    # Only the Praat backend needs Praat, so it isn't imported until then
+    import parselmouth
+
     # Call Praat to do the matching
     praat_path = path.join(path.dirname(__file__), 'cross_correlate.praat')
     out_str = parselmouth.praat.run_file(praat_path, video_audio_file, ext_audio_file, capture_output=True)[1]
@@ -157,55 +300,313 @@ def match(ext_audio_file, video_audio_file):
         print('Error parsing Praat output:', e)
         return None
 
-    vid_audio_len = get_wav_metadata(video_audio_file).length
-
-    start_time = offset
-    end_time = start_time + vid_audio_len
-
-    # Scoring heuristic - if a large part of the video is left silent, it is likely not matched correctly
-    ext_audio_len = get_wav_metadata(ext_audio_file).length
-    silence_time = max(-1 * start_time, 0) + max(end_time - ext_audio_len, 0)
-    silence_ratio = float(silence_time) / vid_audio_len
-
-    return MatchTuple(start_time, end_time, score * (1 - silence_ratio))
-
-def apply_trim_to_data(start_time, end_time, data, rate):
-    data_len = len(data)
-    data_shape = list(data.shape)
-
-    # TODO: can optimize, proabably only have to reassign data once
-
-    # Convert seconds to samples
-    start_sample = int(round(start_time * rate))
-    end_sample = int(round(end_time * rate))
-
-    # Add silence or trim beginning of clip
-    if start_sample < 0:
-        data_shape[0] = start_sample * -1
-        starting_silence = np.zeros(tuple(data_shape), data.dtype)
-        data = np.concatenate((starting_silence, data), axis=0)
-    else:
-        data = data[start_sample:]
+    return score_match(offset, score, get_wav_metadata(video_audio_file).length, get_wav_metadata(ext_audio_file).length)
 
-    # Add silence or trim end of clip
-    if end_sample > data_len:
-        data_shape[0] = end_sample - data_len
-        ending_silence = np.zeros(tuple(data_shape), data.dtype)
-        data = np.concatenate((data, ending_silence), axis=0)
+# Match prepared external audio (see correlate.prepare_reference) with the samples from the video
+# spectra is an optional dict for reusing the video's transforms across references
+# Return MatchTuple
+def match_prepared(reference, video_data, spectra=None):
+    result = match_reference(reference, video_data, spectra)
+    if result is None:
+        return None
+    offset, score, channel = result
+    rate = float(reference.rate)
+    return score_match(offset, score, len(video_data) / rate, reference.samples.shape[-1] / rate, channel)
+
+# Same as match_prepared, for the samples from many videos at once (see correlate.correlate_batch)
+# Return a list of MatchTuple, in the same order as video_datas
+def match_prepared_batch(reference, video_datas):
+    lags, scores, channels = correlate_batch(reference, [video_window(video_data, reference) for video_data in video_datas])
+    rate = float(reference.rate)
+    return [score_match(float(lag) / rate, float(score), len(video_data) / rate, reference.samples.shape[-1] / rate, int(channel))
+            for lag, score, channel, video_data in zip(lags, scores, channels, video_datas)]
+
+# Match prepared external audio (see correlate.prepare_coarse_reference) with the samples from the video,
+# only searching within margin seconds of an approximate offset, such as one found by correlate.coarse_match
+# Return MatchTuple
+def match_refined(coarse_reference, video_data, approx_offset, margin=REFINE_MARGIN):
+    result = refine_match(coarse_reference, video_data, approx_offset, margin=margin)
+    if result is None:
+        return None
+    offset, score, channel = result
+    rate = float(coarse_reference.rate)
+    return score_match(offset, score, len(video_data) / rate, coarse_reference.samples.shape[-1] / rate, channel)
+
+# Return read_ext(start, count) for correlate.match_windows, reading float samples of one channel from an open WavReader,
+# or of every channel as (channels, count) arrays if channel is None, with zeros for any outside the file
+# If rate differs from the file's, samples are resampled to it as they are read, and start and count are at that rate
+# Each read starts on a sample that lines up with one in the file, with enough extra for the filter to not see its edges,
+# so reads of neighbouring ranges join up exactly
+def sample_reader(reader, rate=None, channel=0):
+    num_frames = reader.info.num_frames
+    select = to_channels if channel is None else lambda data: np.asarray(data[:, channel], dtype=np.float32)
+    shape = () if channel is not None else (reader.info.channels,)
+    if rate is None or rate == reader.info.rate:
+        def read_ext(start, count):
+            samples = np.zeros(shape + (count,), np.float32)
+            lo = max(start, 0)
+            hi = min(start + count, num_frames)
+            if hi > lo:
+                samples[..., lo - start:hi - start] = select(reader.read(lo, hi - lo))
+            return samples
+        return read_ext
+
+    fraction = Fraction(rate, reader.info.rate)
+    up, down = fraction.numerator, fraction.denominator
+    h = resample_filter(up, down)
+    context = ceil(len(h) // 2 / down) + 1
+    def read_ext(start, count):
+        aligned = (start - context) // up * up
+        native_start = aligned // up * down
+        native_count = ceil((start + count + context - aligned) * down / up) + 1
+        native = select(reader.read_padded(native_start, native_count)).astype(np.float64)
+        resampled = resample_poly(native, up, down, axis=-1, window=h)
+        return resampled[..., start - aligned:start - aligned + count].astype(np.float32)
+    return read_ext
+
+# Number of samples the audio described by a WavInfo has when resampled to rate
+def resampled_length(info, rate):
+    return info.num_frames * rate // info.rate
+
+# Read an audio file, resampled to rate, as a mono float array
+# Its channels are downmixed (see correlate.to_mono), or only the given channel, numbered from 0, is kept
+# The file is read and resampled in blocks, so only the resampled samples are held in memory
+def read_mono(audio_file, rate, channel=None):
+    channels = None if channel is None else [channel]
+    with WavReader(audio_file) as reader:
+        num_frames = resampled_length(reader.info, rate)
+        if rate == reader.info.rate:
+            data = reader.read(0, num_frames)
+            return to_mono(data if channels is None else data[:, channels])
+        samples = np.empty(num_frames, np.float32)
+        pos = 0
+        for block in resampled_blocks(reader, 0, num_frames, reader.info.rate / float(rate), channels=channels):
+            samples[pos:pos + len(block)] = to_mono(block)
+            pos += len(block)
+    return samples
+
+# Same as read_mono, but read every channel, as a (channels, frames) float array
+def read_channels(audio_file, rate):
+    with WavReader(audio_file) as reader:
+        num_frames = resampled_length(reader.info, rate)
+        if rate == reader.info.rate:
+            return to_channels(reader.read(0, num_frames))
+        samples = np.empty((reader.info.channels, num_frames), np.float32)
+        pos = 0
+        for block in resampled_blocks(reader, 0, num_frames, reader.info.rate / float(rate)):
+            samples[:, pos:pos + len(block)] = block.T
+            pos += len(block)
+    return samples
+
+# Resample mono or (frames, channels) samples held in memory from one rate to another
+# Several channels are downmixed first (see correlate.to_mono)
+def resample_mono(samples, from_rate, rate):
+    samples = to_mono(samples)
+    if from_rate == rate:
+        return samples
+    fraction = Fraction(rate, from_rate)
+    return resample_poly(samples, fraction.numerator, fraction.denominator,
+                         window=resample_filter(fraction.numerator, fraction.denominator)).astype(np.float32)
+
+# Match the separate audio file with the samples from the video by voting between num_windows windows
+# of window seconds, spread across the whole video (see correlate.match_windows)
+# The separate audio is streamed from disk and resampled to the video samples' rate, so neither's length is limited
+# Every channel of the separate audio is matched if all_channels is set, otherwise only the first
+# Return MatchTuple
+def match_windowed(ext_audio_file, video_data, rate, num_windows, window, all_channels=False):
+    try:
+        with WavReader(ext_audio_file) as reader:
+            num_frames = resampled_length(reader.info, rate)
+            read_ext = sample_reader(reader, rate, None if all_channels else 0)
+            result = match_windows(read_ext, num_frames, to_mono(video_data), rate, num_windows, window)
+    except (OSError, WavFormatError, struct.error) as e:
+        print("\tERR: Couldn't read {}: {}".format(ext_audio_file, e))
+        return None
+    if result is None:
+        return None
+    offset, score, channel = result
+    return score_match(offset, score, len(video_data) / float(rate), num_frames / float(rate), channel)
+
+# Refine a match by estimating the drift between the clocks of the separate audio file and the video
+# (see correlate.estimate_drift)
+# The separate audio is resampled to the video samples' rate as it is read, and only its matched channel is used
+# Return the MatchTuple with its start and end times and rate ratio corrected, or unchanged if drift can't be measured
+def correct_drift(ext_audio_file, video_data, rate, match_tuple):
+    try:
+        with WavReader(ext_audio_file) as reader:
+            read_ext = sample_reader(reader, rate, match_tuple.channel)
+            result = estimate_drift(read_ext, to_mono(video_data), rate, match_tuple.start_time)
+    except (OSError, WavFormatError, struct.error) as e:
+        print("\tERR: Couldn't read {}: {}".format(ext_audio_file, e))
+        return match_tuple
+    if result is None:
+        return match_tuple
+    start_time, rate_ratio = result
+    # Too little drift to resample by (see resampled_blocks), so the audio is trimmed without resampling
+    if abs(rate_ratio - 1) < 0.5 / MAX_RESAMPLE_DENOMINATOR:
+        rate_ratio = 1.0
+    return match_tuple._replace(start_time=start_time, end_time=start_time + len(video_data) / float(rate) * rate_ratio,
+                                rate_ratio=rate_ratio)
+
+# Build the landmark index of an audio file resampled to rate (see fingerprint.build_fingerprints),
+# from every channel if all_channels is set, otherwise only the first
+# The file is read a block at a time, so memory use only depends on the number of landmarks
+def fingerprint_file(audio_file, rate, all_channels=False):
+    with WavReader(audio_file) as reader:
+        num_samples = resampled_length(reader.info, rate)
+        return build_fingerprints(sample_reader(reader, rate, None if all_channels else 0), num_samples, rate)
+
+# Match the separate audio file, indexed by fingerprints, with the samples from the video
+# The video is located by looking up its landmarks in the index, then the first part of it is correlated
+# against only the few frames of the separate audio around there, read from the file, for a sample accurate offset
+# landmarks is an optional dict for reusing the video's landmarks across audio files
+# Return MatchTuple
+def match_fingerprinted(fingerprints, ext_audio_file, video_data, rate, landmarks=None):
+    vid_samples = to_mono(video_data)
+    if landmarks is None or 'landmarks' not in landmarks:
+        clip = clip_landmarks(vid_samples)
+        if landmarks is not None:
+            landmarks['landmarks'] = clip
     else:
-        data = data[:(end_sample - start_sample)]
+        clip = landmarks['landmarks']
+    located = locate_landmarks(fingerprints, clip)
+    if located is None:
+        return None
+    approx_lag, _, channel = located
 
-    return data
+    query = vid_samples[:int(ANALYSIS_WINDOW * rate)]
+    if not np.dot(query, query) > 0:
+        return None
+    try:
+        with WavReader(ext_audio_file) as reader:
+            lag, score = locate_window(sample_reader(reader, rate, channel), query, approx_lag, 2 * FINGERPRINT_HOP)
+    except (OSError, WavFormatError, struct.error) as e:
+        print("\tERR: Couldn't read {}: {}".format(ext_audio_file, e))
+        return None
+    return score_match(lag / float(rate), score, len(vid_samples) / float(rate), fingerprints.num_samples / float(rate), channel)
+
+# Low pass filter for resample_poly, designed the same way as resample_poly's own,
+# but kept so it isn't designed again for every block
+@cached(cache=LRUCache(maxsize=8), lock=Lock())
+def resample_filter(up, down):
+    max_rate = max(up, down)
+    return firwin(2 * 10 * max_rate + 1, 1.0 / max_rate, window=('kaiser', 5.0))
+
+# Generate blocks of num_frames frames in total, read from the reader starting at start_sample and resampled
+# so that every rate_ratio frames read become one frame, as float (frames, channels) arrays
+# If channels is given, only those channels are read and resampled
+# Blocks are read with enough of the neighbouring frames for the filter to not see their edges,
+# and start on multiples of the resampling fraction's denominator, so each maps to a whole number of output frames
+# A rate ratio so close to 1 that its fraction is 1/1 can't be resampled by, so its frames are passed through unchanged
+def resampled_blocks(reader, start_sample, num_frames, rate_ratio, channels=None):
+    fraction = Fraction(1 / rate_ratio).limit_denominator(MAX_RESAMPLE_DENOMINATOR)
+    up, down = fraction.numerator, fraction.denominator
+    pos = start_sample
+    if up == down:
+        while num_frames > 0:
+            block = reader.read_padded(pos, min(BLOCK_FRAMES, num_frames))
+            if channels is not None:
+                block = block[:, channels]
+            yield block.astype(np.float64)
+            num_frames -= len(block)
+            pos += len(block)
+        return
+    h = resample_filter(up, down)
+    context = down * ceil((len(h) // 2 / up + 1) / down)
+    block_len = down * max(RESAMPLE_BLOCK_MULTIPLE, ceil(BLOCK_FRAMES / down))
+    skip = context // down * up
+    while num_frames > 0:
+        block = reader.read_padded(pos - context, block_len + 2 * context)
+        if channels is not None:
+            block = block[:, channels]
+        block = block.astype(np.float64)
+        resampled = resample_poly(block, up, down, axis=0, window=h)[skip:skip + min(block_len // down * up, num_frames)]
+        yield resampled
+        num_frames -= len(resampled)
+        pos += block_len
+
+# Keep the channels, numbered from 0, that audio with num_channels channels has, or every channel if channels is None
+# Raises ValueError if it has none of them
+def present_channels(channels, num_channels):
+    if channels is None:
+        return None
+    present = [channel for channel in channels if channel < num_channels]
+    if not present:
+        raise ValueError(f"Only has {num_channels} channels")
+    return present
 
 # Output the audio file, trimmed at the start and end times
 # Exported samples outside the original range will be silent
-def trim(audio_file, output_audio_file, start_time, end_time):
+# Only the trimmed range is read, in blocks, so memory use doesn't depend on the file's length
+# If rate_ratio isn't 1, the trimmed range is resampled to correct for clock drift (see MatchTuple)
+# The samples are scaled by gain as they are written
+# If channels is given, only those channels of the audio file are kept, numbered from 0
+# Returns if successful; on failure no output file is left behind
+def trim(audio_file, output_audio_file, start_time, end_time, rate_ratio=1.0, gain=1.0, channels=None):
+    if start_time > end_time:
+        print("start_time must be <= end_time")
+        return None
+    metadata = get_wav_metadata(audio_file)
+    if metadata is None:
+        print("\tERR: Couldn't trim {}: its header can't be read".format(audio_file))
+        return False
+    try:
+        channels = present_channels(channels, metadata.channels)
+        start_sample = int(round(start_time * metadata.rate))
+        end_sample = int(round(end_time * metadata.rate))
+        if rate_ratio == 1:
+            stream_wav_file(audio_file, output_audio_file, lambda data: scale_samples(data, gain) if gain != 1 else data,
+                            start_sample, end_sample, channels)
+            return True
+        with WavReader(audio_file) as reader:
+            info = reader.info
+            center = silent_value(reader.dtype)
+            num_channels = info.channels if channels is None else len(channels)
+            with WavWriter(output_audio_file, info.rate, num_channels, info.sampwidth, info.is_float) as writer:
+                num_frames = int(round((end_sample - start_sample) / rate_ratio))
+                for block in resampled_blocks(reader, start_sample, num_frames, rate_ratio, channels):
+                    writer.write(scale_samples(block, gain, center))
+    except (OSError, WavFormatError, ValueError) as e:
+        print("\tERR: Couldn't trim {}: {}".format(audio_file, e))
+        # Don't leave a partly written file where the trimmed audio should be
+        if path.exists(output_audio_file):
+            os.remove(output_audio_file)
+        return False
+    return True
+
+# Same as trim, but return the trimmed audio as a wavio.Wav object instead of writing it
+def trim_data(audio_file, start_time, end_time, rate_ratio=1.0, gain=1.0, channels=None):
     if start_time > end_time:
         print("start_time must be <= end_time")
         return None
-    return modify_wav_file(audio_file, output_audio_file, partial(apply_trim_to_data, start_time, end_time))
+    try:
+        with WavReader(audio_file) as reader:
+            info = reader.info
+            channels = present_channels(channels, info.channels)
+            start_sample = int(round(start_time * info.rate))
+            end_sample = int(round(end_time * info.rate))
+            if rate_ratio == 1:
+                # Samples outside the file are left as silence
+                data = reader.read_padded(start_sample, end_sample - start_sample)
+                if channels is not None:
+                    data = data[:, channels]
+                if gain != 1:
+                    data = cast_samples(scale_samples(data, gain), info.sampwidth, info.is_float)
+            else:
+                num_channels = info.channels if channels is None else len(channels)
+                data = np.empty((int(round((end_sample - start_sample) / rate_ratio)), num_channels), reader.dtype)
+                center = silent_value(reader.dtype)
+                pos = 0
+                for block in resampled_blocks(reader, start_sample, len(data), rate_ratio, channels):
+                    data[pos:pos + len(block)] = cast_samples(scale_samples(block, gain, center), info.sampwidth, info.is_float)
+                    pos += len(block)
+    except (OSError, WavFormatError, ValueError) as e:
+        print("\tERR: Couldn't trim {}: {}".format(audio_file, e))
+        return None
+    return wavio.Wav(data, info.rate, FLOAT_SAMPWIDTH if info.is_float else info.sampwidth)
 
 # Attach the audio file to the video file and write to new file
+# Return True for success, raises FfmpegError on failure
 def attach(audio_file, video_file, output_video_file):
     cmd = [
         'ffmpeg',
@@ -221,8 +622,28 @@ def attach(audio_file, video_file, output_video_file):
         '-y', # Don't ask for confirmation
         output_video_file
     ]
-    proc = Popen(cmd, stdout=PIPE, stderr=PIPE)
-    _, err = proc.communicate()
-    if proc.returncode != 0:
-        print(err)
-    return proc.returncode == 0
+    run_ffmpeg(cmd)
+    return True
+
+# Same as attach, but pipe the audio from a wavio.Wav object into ffmpeg rather than reading it from a file
+def attach_data(wav_data, video_file, output_video_file):
+    pcm_format, pcm_bytes = to_pcm(wav_data.data, wav_data.sampwidth)
+    channels = wav_data.data.shape[1] if wav_data.data.ndim > 1 else 1
+    cmd = [
+        'ffmpeg',
+        '-i', video_file,
+        '-f', pcm_format, # Raw samples from stdin, so their layout must be given
+        '-ar', str(wav_data.rate),
+        '-ac', str(channels),
+        '-i', 'pipe:0',
+        '-map', '0:v', # Take video stream from first input
+        '-map_metadata', '0', # Take metadata from first input
+        '-movflags', 'use_metadata_tags', # Keep .mov metadata
+        '-map', '1:a', # Take audio stream from second input
+        '-vcodec', 'copy', # Copy the video codec from the source for the output
+        '-shortest', # The output length is the shortest of the video/audio streams
+        '-y', # Don't ask for confirmation
+        output_video_file
+    ]
+    run_ffmpeg(cmd, pcm_bytes)
+    return True
@@ -0,0 +1,121 @@
+import json
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import datetime
+from .audio_util import get_wav_metadata, run_ffmpeg, FfmpegError
+
+# When a file started recording, from two kinds of clock, and how long it is, all in seconds
+#  time_of_day - seconds since midnight, from timecode or a Broadcast Wave time reference, or None
+#  wall_clock - seconds since the epoch, from creation or origination date and time, or None
+Timestamps = namedtuple('Timestamps', ['time_of_day', 'wall_clock', 'duration'])
+
+CLOCKS = ['time_of_day', 'wall_clock']
+
+# Return seconds since midnight for a "HH:MM:SS:FF" timecode (";" is also used before frames for drop frame)
+def parse_timecode(timecode, fps=None):
+    try:
+        hours, minutes, seconds, frames = (int(part) for part in timecode.replace(';', ':').split(':'))
+    except (AttributeError, ValueError):
+        return None
+    return hours * 3600 + minutes * 60 + seconds + (frames / fps if fps else 0)
+
+def parse_frame_rate(frame_rate):
+    try:
+        num, den = (float(part) for part in frame_rate.split('/'))
+        return num / den if den else None
+    except (AttributeError, ValueError):
+        return None
+
+def probe_video_timestamps(video_file):
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'format=duration:format_tags=creation_time,timecode:stream=r_frame_rate:stream_tags=timecode',
+        '-of', 'json',
+        video_file
+    ]
+    try:
+        probe = json.loads(run_ffmpeg(cmd))
+    except (FfmpegError, OSError, ValueError) as e:
+        print("\tERR: Couldn't probe {}: {}".format(video_file, e))
+        return Timestamps(None, None, None)
+
+    fmt = probe.get('format', {})
+    tags = fmt.get('tags', {})
+    streams = probe.get('streams', [])
+    fps = next((parse_frame_rate(stream.get('r_frame_rate')) for stream in streams if stream.get('r_frame_rate')), None)
+    timecode = tags.get('timecode') or next((stream['tags']['timecode'] for stream in streams
+                                             if 'timecode' in stream.get('tags', {})), None)
+
+    wall_clock = None
+    if tags.get('creation_time'):
+        try:
+            # Creation time is UTC, and older Pythons don't accept the Z suffix
+            wall_clock = datetime.fromisoformat(tags['creation_time'].replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            pass
+
+    duration = float(fmt['duration']) if fmt.get('duration') else None
+    return Timestamps(parse_timecode(timecode, fps) if timecode else None, wall_clock, duration)
+
+def wav_timestamps(audio_file):
+    metadata = get_wav_metadata(audio_file)
+    if not metadata:
+        return Timestamps(None, None, None)
+    time_of_day = metadata.time_reference / float(metadata.rate) if metadata.time_reference else None
+    wall_clock = None
+    if metadata.origination:
+        try:
+            # Origination is in the recorder's local time
+            wall_clock = datetime.strptime(metadata.origination, '%Y-%m-%d %H:%M:%S').timestamp()
+        except ValueError:
+            pass
+    return Timestamps(time_of_day, wall_clock, metadata.length)
+
+# Sorted index of when each audio file was recording, on each clock,
+# so that a video only has to be matched against the audio files that were recording at the same time
+# Audio files without usable timestamps on a clock are candidates for every video compared on that clock
+class CandidateIndex:
+    def __init__(self, audio_files, tolerance):
+        self.tolerance = tolerance
+        self._spans = {clock: [] for clock in CLOCKS}
+        self._untimed = {clock: [] for clock in CLOCKS}
+        for audio_file in audio_files:
+            timestamps = wav_timestamps(audio_file)
+            for clock in CLOCKS:
+                start = getattr(timestamps, clock)
+                if start is not None and timestamps.duration:
+                    self._spans[clock].append((start, start + timestamps.duration, audio_file))
+                else:
+                    self._untimed[clock].append(audio_file)
+
+        self._starts = {}
+        self._max_duration = {}
+        for clock, spans in self._spans.items():
+            spans.sort()
+            self._starts[clock] = [start for start, _, _ in spans]
+            self._max_duration[clock] = max((end - start for start, end, _ in spans), default=0)
+
+    def candidates(self, timestamps):
+        '''
+        Return the audio files whose recording overlaps the video's, within the tolerance,
+        or None if the video has no timestamps that can be compared, so every audio file should be tried
+        The first clock that both the video and any audio files have, and that any audio file overlaps the video on, is used
+        None is also returned if no audio file overlaps the video on any clock, since clocks can disagree by more than
+        the tolerance, such as a Broadcast Wave origination in the recorder's time zone against a video creation time in UTC
+        '''
+        for clock in CLOCKS:
+            start = getattr(timestamps, clock)
+            if start is None or not timestamps.duration or not self._spans[clock]:
+                continue
+            end = start + timestamps.duration
+
+            # Only spans starting in this range can overlap, since none are longer than the longest
+            starts = self._starts[clock]
+            lo = bisect_left(starts, start - self.tolerance - self._max_duration[clock])
+            hi = bisect_right(starts, end + self.tolerance)
+            overlapping = [audio_file for _, span_end, audio_file in self._spans[clock][lo:hi]
+                           if span_end >= start - self.tolerance]
+            if overlapping:
+                return overlapping + self._untimed[clock]
+        return None
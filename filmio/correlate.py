@@ -0,0 +1,392 @@
+from collections import namedtuple
+import numpy as np
+from scipy import fft as sp_fft
+from scipy.signal import correlate
+
+# Only the start of the video audio is used for matching, same as cross_correlate.praat
+ANALYSIS_WINDOW = 120
+
+# Rate, in Hz, that both the video audio and external audio are resampled to for matching
+# Offsets are found in seconds, so they apply at any file's own rate
+ANALYSIS_RATE = 8000
+
+# Rate, in Hz, of the energy envelopes used to shortlist candidates before matching at full rate
+ENVELOPE_RATE = 100
+
+# Seconds either side of a coarse offset that are searched at full rate
+REFINE_MARGIN = 0.5
+
+# Bytes of correlation output computed at once when correlating many videos against one reference
+BATCH_BYTES = 2 ** 28
+
+# External samples correlated at a time when matching windows spread across the whole video
+CORRELATION_BLOCK = 2 ** 20
+
+# Seconds of video audio in each window when voting
+DEFAULT_VOTE_WINDOW = 10
+
+# Seconds that offsets found by different windows may differ by and still agree
+VOTE_TOLERANCE = 0.05
+
+# Seconds of video audio at each end of a clip that are located to estimate clock drift
+DRIFT_WINDOW = 10
+
+# Seconds either side of where each drift window is expected that are searched, besides the largest drift allowed
+DRIFT_MARGIN = 0.1
+
+# Seconds between the drift windows needed for drift to be measured
+MIN_DRIFT_SPAN = 60
+
+# Largest difference in clock rates that is believed, as a fraction
+MAX_DRIFT = 1e-4
+
+# Normalized score both drift windows need for drift to be measured
+MIN_DRIFT_SCORE = 0.3
+
+# External audio prepared for correlation against any video window of up to window_len samples
+#  samples - mono float samples, or a (channels, frames) array to correlate every channel at once
+#  energy - cumulative sum of squared samples along the last axis, starting with 0, for normalizing scores
+#  spectrum - real FFT of samples along the last axis, zero padded to n_fft
+Reference = namedtuple('Reference', ['samples', 'energy', 'spectrum', 'n_fft', 'window_len', 'rate'])
+
+# External audio prepared for coarse to fine matching
+#  samples, energy - same as for Reference, at full rate, for refining offsets
+#  envelope - Reference built from the energy envelope of samples, at ENVELOPE_RATE
+CoarseReference = namedtuple('CoarseReference', ['samples', 'energy', 'envelope', 'rate'])
+
+# Reduce a sample array to a single float channel
+# Channels are averaged, the same downmix ffmpeg makes when extracting audio into memory (-ac 1)
+def to_mono(data):
+    if data.ndim > 1:
+        return data.mean(axis=1, dtype=np.float32)
+    return np.asarray(data, dtype=np.float32)
+
+# Turn a mono or (frames, channels) sample array into a (channels, frames) float array,
+# so each channel is contiguous for transforming
+def to_channels(data):
+    if data.ndim == 1:
+        data = data.reshape(-1, 1)
+    return np.ascontiguousarray(data.T, dtype=np.float32)
+
+def reference_nbytes(reference):
+    if isinstance(reference, CoarseReference):
+        return reference.samples.nbytes + reference.energy.nbytes + reference_nbytes(reference.envelope)
+    return reference.samples.nbytes + reference.energy.nbytes + reference.spectrum.nbytes
+
+def cumulative_energy(samples):
+    energy = np.cumsum(np.square(samples, dtype=np.float64), axis=-1)
+    return np.concatenate((np.zeros(energy.shape[:-1] + (1,)), energy), axis=-1)
+
+# Mean absolute amplitude over blocks of samples, at ENVELOPE_RATE, along the last axis
+# The mean is removed so that correlation follows the shape of the envelope rather than its level
+def energy_envelope(samples, rate):
+    block = max(int(rate // ENVELOPE_RATE), 1)
+    num_blocks = samples.shape[-1] // block
+    if not num_blocks:
+        return np.zeros(samples.shape[:-1] + (0,), dtype=np.float32)
+    envelope = np.abs(samples[..., :num_blocks * block]).reshape(samples.shape[:-1] + (num_blocks, block)).mean(axis=-1)
+    return envelope - envelope.mean(axis=-1, keepdims=True)
+
+# FFT length needed to linearly correlate ext_len samples against window_len samples
+def padded_length(ext_len, window_len):
+    return sp_fft.next_fast_len(ext_len + window_len - 1, real=True)
+
+# samples are mono, or (channels, frames) to match against every channel (see to_channels)
+def prepare_reference(samples, rate, window=ANALYSIS_WINDOW):
+    samples = np.asarray(samples, dtype=np.float32)
+    window_len = int(window * rate)
+    n_fft = padded_length(samples.shape[-1], window_len)
+    energy = cumulative_energy(samples)
+    spectrum = sp_fft.rfft(samples, n_fft)
+    return Reference(samples, energy, spectrum, n_fft, window_len, rate)
+
+def prepare_coarse_reference(samples, rate, window=ANALYSIS_WINDOW):
+    samples = np.asarray(samples, dtype=np.float32)
+    envelope = prepare_reference(energy_envelope(samples, rate), ENVELOPE_RATE, window)
+    return CoarseReference(samples, cumulative_energy(samples), envelope, rate)
+
+# Get the video window samples to correlate, as a mono float array
+def video_window(vid_data, reference):
+    return to_mono(vid_data[:reference.window_len])
+
+# Fraction of a sample that a correlation peak lies from its highest sample, from a parabola through it and its neighbours
+# Works on single values or arrays of them
+def peak_shift(before, at, after):
+    before, at, after = (np.asarray(value, dtype=np.float64) for value in (before, at, after))
+    curvature = before - 2 * at + after
+    return np.where(curvature < 0, 0.5 * (before - after) / np.where(curvature < 0, curvature, -1.0), 0.0)
+
+# Cross correlate the video window against the prepared external audio
+# spectra is an optional dict of n_fft -> spectrum of vid_samples, so that a video
+#   is only transformed once for all references sharing a padded length
+# lag_bounds optionally limits the search to (min_lag, max_lag), inclusive
+# Every channel of a multichannel reference is correlated at once, and the one with the best score is kept
+# Return (lag, score, channel), where lag is the sample in the external audio where the video starts,
+#   interpolated between samples, score is the normalized correlation at that lag (1 is a perfect match),
+#   and channel is the reference channel it was found in
+def correlate_reference(reference, vid_samples, spectra=None, lag_bounds=None):
+    ext_len = reference.samples.shape[-1]
+    if not ext_len or not len(vid_samples):
+        return None
+
+    n_fft = reference.n_fft
+    vid_spectrum = spectra.get(n_fft) if spectra is not None else None
+    if vid_spectrum is None:
+        vid_spectrum = sp_fft.rfft(vid_samples, n_fft)
+        if spectra is not None:
+            spectra[n_fft] = vid_spectrum
+    corr = np.atleast_2d(sp_fft.irfft(reference.spectrum * np.conj(vid_spectrum), n_fft))
+    channels = np.arange(len(corr))
+
+    # Circular indices past the external audio length wrap around to negative lags
+    if lag_bounds is not None:
+        lags = np.arange(max(lag_bounds[0], 1 - len(vid_samples)), min(lag_bounds[1], ext_len - 1) + 1)
+        if not len(lags):
+            return None
+        channel_lags = lags[np.argmax(corr[:, lags], axis=1)]
+        peaks = channel_lags % n_fft
+    else:
+        peaks = np.argmax(corr, axis=1)
+        channel_lags = np.where(peaks < ext_len, peaks, peaks - n_fft)
+
+    # Normalize by the energy of both signals where they overlap
+    ext_start = np.maximum(channel_lags, 0)
+    ext_end = np.minimum(channel_lags + len(vid_samples), ext_len)
+    vid_energy = cumulative_energy(vid_samples)
+    ext_energy = np.atleast_2d(reference.energy)
+    denom = np.sqrt((ext_energy[channels, ext_end] - ext_energy[channels, ext_start]) *
+                    (vid_energy[ext_end - channel_lags] - vid_energy[ext_start - channel_lags]))
+    scores = np.divide(corr[channels, peaks], denom, out=np.zeros(len(channels)), where=denom > 0)
+
+    # Channels are compared by score rather than correlation, since their levels can differ a lot
+    channel = int(np.argmax(scores))
+    peak = int(peaks[channel])
+    shift = peak_shift(corr[channel, (peak - 1) % n_fft], corr[channel, peak], corr[channel, (peak + 1) % n_fft])
+    return int(channel_lags[channel]) + float(shift), float(scores[channel]), channel
+
+# Same as correlate_reference, for many video windows at once
+# The windows are zero padded into one buffer, and transformed and correlated as stacked arrays against every channel,
+# as many at a time as fit in BATCH_BYTES of correlation output
+# Return (lags, scores, channels) arrays, in the same order as vid_windows
+def correlate_batch(reference, vid_windows):
+    ext_len = reference.samples.shape[-1]
+    n_fft = reference.n_fft
+    spectrum = np.atleast_2d(reference.spectrum)
+    ext_energy = np.atleast_2d(reference.energy)
+    channels = np.arange(len(spectrum))
+    lengths = np.array([len(window) for window in vid_windows])
+    lags = np.zeros(len(vid_windows))
+    scores = np.zeros(len(vid_windows))
+    best_channels = np.zeros(len(vid_windows), dtype=int)
+    if not ext_len or not len(vid_windows) or not lengths.max():
+        return lags, scores, best_channels
+
+    batch_size = max(BATCH_BYTES // (n_fft * 8 * len(channels)), 1)
+    buffer = np.zeros((min(batch_size, len(vid_windows)), lengths.max()), dtype=np.float32)
+    for start in range(0, len(vid_windows), batch_size):
+        batch = vid_windows[start:start + batch_size]
+        batch_lengths = lengths[start:start + len(batch)]
+        windows = buffer[:len(batch)]
+        windows[:] = 0
+        for row, window in zip(windows, batch):
+            row[:len(window)] = window
+
+        # (windows, channels, n_fft)
+        corr = sp_fft.irfft(spectrum * np.conj(sp_fft.rfft(windows, n_fft, axis=1))[:, np.newaxis], n_fft, axis=2)
+        rows = np.arange(len(batch))[:, np.newaxis]
+        peaks = np.argmax(corr, axis=2)
+        batch_lags = np.where(peaks < ext_len, peaks, peaks - n_fft)
+
+        # Normalize by the energy of both signals where they overlap
+        ext_start = np.maximum(batch_lags, 0)
+        ext_end = np.clip(batch_lags + batch_lengths[:, np.newaxis], ext_start, ext_len)
+        vid_energy = cumulative_energy(windows)
+        overlap_energy = vid_energy[rows, ext_end - batch_lags] - vid_energy[rows, ext_start - batch_lags]
+        denom = np.sqrt((ext_energy[channels, ext_end] - ext_energy[channels, ext_start]) * overlap_energy)
+        peak_values = corr[rows, channels, peaks]
+        batch_scores = np.divide(peak_values, denom, out=np.zeros(peak_values.shape), where=denom > 0)
+
+        # Channels are compared by score rather than correlation, since their levels can differ a lot
+        rows = np.arange(len(batch))
+        best = np.argmax(batch_scores, axis=1)
+        best_peaks = peaks[rows, best]
+        shifts = peak_shift(corr[rows, best, (best_peaks - 1) % n_fft], corr[rows, best, best_peaks],
+                            corr[rows, best, (best_peaks + 1) % n_fft])
+        del corr
+
+        lags[start:start + len(batch)] = batch_lags[rows, best] + shifts
+        scores[start:start + len(batch)] = batch_scores[rows, best]
+        best_channels[start:start + len(batch)] = best
+    return lags, scores, best_channels
+
+# Find where the video audio starts in the external audio
+# Return (offset, score, channel), with offset in seconds
+def match_reference(reference, vid_data, spectra=None):
+    result = correlate_reference(reference, video_window(vid_data, reference), spectra)
+    if result is None:
+        return None
+    lag, score, channel = result
+    return lag / float(reference.rate), score, channel
+
+# Find the approximate offset of the video audio in the external audio, using energy envelopes
+# Return (offset, score, channel), with offset in seconds
+def coarse_match(coarse_reference, vid_data, spectra=None):
+    rate = coarse_reference.rate
+    window_len = int(coarse_reference.envelope.window_len * rate / ENVELOPE_RATE)
+    vid_envelope = energy_envelope(to_mono(vid_data[:window_len]), rate)
+    result = correlate_reference(coarse_reference.envelope, vid_envelope, spectra)
+    if result is None:
+        return None
+    lag, score, channel = result
+    return lag / float(ENVELOPE_RATE), score, channel
+
+# Search at full rate within margin seconds of a coarse offset
+# Return (offset, score, channel), with offset in seconds
+def refine_match(coarse_reference, vid_data, approx_offset, window=ANALYSIS_WINDOW, margin=REFINE_MARGIN):
+    rate = coarse_reference.rate
+    vid_samples = to_mono(vid_data[:int(window * rate)])
+    approx_lag = int(round(approx_offset * rate))
+    margin_len = int(margin * rate)
+
+    # Only the part of the external audio that the video can overlap is needed
+    seg_start = max(approx_lag - margin_len, 0)
+    seg_end = min(approx_lag + margin_len + len(vid_samples), coarse_reference.samples.shape[-1])
+    if seg_end <= seg_start:
+        return None
+    samples = coarse_reference.samples[..., seg_start:seg_end]
+    n_fft = padded_length(samples.shape[-1], len(vid_samples))
+    segment = Reference(samples, cumulative_energy(samples), sp_fft.rfft(samples, n_fft), n_fft, len(vid_samples), rate)
+
+    lag_bounds = (approx_lag - margin_len - seg_start, approx_lag + margin_len - seg_start)
+    result = correlate_reference(segment, vid_samples, lag_bounds=lag_bounds)
+    if result is None:
+        return None
+    lag, score, channel = result
+    return (lag + seg_start) / float(rate), score, channel
+
+# Correlate each query against the whole external audio, one block of external samples at a time,
+# so memory use depends on block_len and the query lengths rather than the external audio's length
+# read_ext(start, count) must return count mono samples from start, or a (channels, count) array of them,
+#   with zeros outside the external audio
+# All queries share each block's transform (overlap-save), and every channel of a block is correlated at once
+# Return (lags, correlations), both (queries, channels) arrays, at each query's peak in each channel,
+#   with lags as in correlate_reference
+def blocked_correlate(read_ext, ext_len, queries, block_len=CORRELATION_BLOCK):
+    max_query_len = max(len(query) for query in queries)
+    n_fft = sp_fft.next_fast_len(block_len + max_query_len - 1, real=True)
+    query_spectra = [np.conj(sp_fft.rfft(query, n_fft)) for query in queries]
+    best_lags = None
+    best_values = None
+
+    for block_start in range(1 - max_query_len, ext_len, block_len):
+        block = np.atleast_2d(read_ext(block_start, block_len + max_query_len - 1))
+        block_spectrum = sp_fft.rfft(block, n_fft)
+        if best_lags is None:
+            best_lags = np.zeros((len(queries), len(block)), dtype=int)
+            best_values = np.full((len(queries), len(block)), -np.inf)
+        for i, (query, query_spectrum) in enumerate(zip(queries, query_spectra)):
+            corr = sp_fft.irfft(block_spectrum * query_spectrum, n_fft)[:, :block_len]
+            # Only lags where the query overlaps the external audio are considered
+            lo = max(1 - len(query) - block_start, 0)
+            hi = min(ext_len - block_start, block_len)
+            if hi <= lo:
+                continue
+            peaks = lo + np.argmax(corr[:, lo:hi], axis=1)
+            values = corr[np.arange(len(corr)), peaks]
+            better = values > best_values[i]
+            best_lags[i, better] = block_start + peaks[better]
+            best_values[i, better] = values[better]
+    return best_lags, best_values
+
+# Locate several windows spread across the video audio in the external audio, in each of its channels
+# Return a list for each channel of (offset, score, window_start) for each window that isn't silent, where offset is
+#   the sample in the external audio where the video starts according to that window
+def window_votes(read_ext, ext_len, vid_samples, rate, num_windows, window):
+    window_len = min(int(window * rate), len(vid_samples))
+    if not window_len or not ext_len:
+        return []
+    starts = np.unique(np.linspace(0, len(vid_samples) - window_len, num_windows).astype(int))
+    windows = [(start, vid_samples[start:start + window_len]) for start in starts]
+    windows = [(start, query) for start, query in windows if np.dot(query, query) > 0]
+    if not windows:
+        return []
+
+    lags, values = blocked_correlate(read_ext, ext_len, [query for _, query in windows])
+    votes = [[] for _ in range(lags.shape[1])]
+    for (start, query), query_lags, query_values in zip(windows, lags, values):
+        ext_windows = {} # Channels that peak at the same lag share one read
+        for channel, (lag, value) in enumerate(zip(query_lags, query_values)):
+            if lag not in ext_windows:
+                ext_windows[lag] = np.atleast_2d(read_ext(lag, len(query)))
+            ext_window = ext_windows[lag][channel]
+            denom = np.sqrt(np.dot(ext_window, ext_window) * np.dot(query, query))
+            votes[channel].append((lag - start, float(value / denom) if denom > 0 else 0.0, start))
+    return votes
+
+# Find the group of votes that agree on an offset, within tolerance samples, with the highest total score
+# Return the group, sorted by window start
+def agreeing_votes(votes, tolerance):
+    votes = sorted(votes)
+    best_group = []
+    best_total = -np.inf
+    lo = 0
+    for hi in range(len(votes)):
+        while votes[hi][0] - votes[lo][0] > tolerance:
+            lo += 1
+        total = sum(score for _, score, _ in votes[lo:hi + 1])
+        if total > best_total:
+            best_total = total
+            best_group = votes[lo:hi + 1]
+    return sorted(best_group, key=lambda vote: vote[2])
+
+# Find where the video audio starts in the external audio by voting between windows spread across the whole video
+# Unlike match_reference, any length of video and external audio can be matched with bounded memory
+# The score is the mean score of the agreeing windows, scaled by the fraction of windows that agree
+# Each channel of the external audio votes separately, and the channel with the best score is kept
+# Return (offset, score, channel), with offset in seconds
+def match_windows(read_ext, ext_len, vid_samples, rate, num_windows, window):
+    best = None
+    for channel, votes in enumerate(window_votes(read_ext, ext_len, vid_samples, rate, num_windows, window)):
+        group = agreeing_votes(votes, VOTE_TOLERANCE * rate)
+        offset = float(np.median([offset for offset, _, _ in group]))
+        score = sum(score for _, score, _ in group) / len(votes)
+        if best is None or score > best[1]:
+            best = (offset / float(rate), score, channel)
+    return best
+
+# Find where query best matches the external audio, only searching margin samples either side of expected_lag
+# The peak is interpolated between samples, since drift is measured from differences of only a few samples
+# Return (lag, score), with a fractional lag and a normalized score
+def locate_window(read_ext, query, expected_lag, margin):
+    segment = read_ext(expected_lag - margin, len(query) + 2 * margin)
+    corr = correlate(segment, query, mode='valid', method='fft')
+    energy = np.concatenate(([0.0], np.cumsum(segment.astype(np.float64) ** 2)))
+    window_energy = energy[len(query):] - energy[:-len(query)]
+    denom = np.sqrt(np.maximum(window_energy, 0) * np.dot(query, query))
+    scores = np.divide(corr, denom, out=np.zeros(len(corr)), where=denom > 0)
+    peak = int(np.argmax(scores))
+
+    shift = peak_shift(*corr[peak - 1:peak + 2]) if 0 < peak < len(corr) - 1 else 0.0
+    return float(expected_lag - margin + peak + shift), float(scores[peak])
+
+# Estimate how fast the external audio's clock runs relative to the video's, by locating windows
+# from the start and end of the video near where a match at offset seconds puts them
+# Return (start offset in seconds, rate ratio), where the rate ratio is external seconds per video second,
+#   or None if the clip is too short or the windows can't be located reliably
+def estimate_drift(read_ext, vid_samples, rate, offset, window=DRIFT_WINDOW):
+    window_len = int(window * rate)
+    span = len(vid_samples) - window_len
+    if window_len <= 0 or span < MIN_DRIFT_SPAN * rate:
+        return None
+    margin = int(DRIFT_MARGIN * rate + MAX_DRIFT * span)
+    start_lag = int(round(offset * rate))
+    start, start_score = locate_window(read_ext, vid_samples[:window_len], start_lag, margin)
+    end, end_score = locate_window(read_ext, vid_samples[span:], start_lag + span, margin)
+    if min(start_score, end_score) < MIN_DRIFT_SCORE:
+        return None
+
+    rate_ratio = (end - start) / span
+    if abs(rate_ratio - 1) > MAX_DRIFT:
+        return None
+    # Each window is located by its average position, which drifts from its first sample by half the window
+    return (start - (rate_ratio - 1) * window_len / 2) / float(rate), rate_ratio
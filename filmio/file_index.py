@@ -0,0 +1,154 @@
+import os
+import sqlite3
+import time
+from os import path
+from fnmatch import fnmatch
+from collections import namedtuple
+from .audio_util import get_wav_metadata
+
+FILE_INDEX_FILE = '.filmio_index.sqlite'
+
+# Columns of the table of listed directories, which is emptied if it was written with others
+# types records which file types were kept when each directory was listed, since files of other types are left out
+DIR_COLUMNS = ['path', 'mtime_ns', 'types']
+
+# Directories modified this recently are listed again on the next scan, since a change made
+# within the same modification time tick as the scan wouldn't change their modification time
+RACY_WINDOW_NS = 2 * 10 ** 9
+
+# A file found by a scan
+#  type - which of the scan's types its extension belongs to, such as 'audio' or 'video'
+#  size, mtime_ns - from when its directory was last listed
+#  duration - length in seconds of audio files, from their header, or None
+IndexedFile = namedtuple('IndexedFile', ['path', 'type', 'size', 'mtime_ns', 'duration'])
+
+def file_type(name, types):
+    lower = name.lower()
+    return next((file_type for file_type, exts in types.items() if any(lower.endswith(ext.lower()) for ext in exts)), None)
+
+# Whether a path relative to the scan's root should be kept, given include and exclude globs
+# Paths use / between directories, and a pattern without a / is also matched against the name alone
+def glob_filter(rel_path, include=None, exclude=None):
+    def matches(patterns):
+        name = rel_path.rsplit('/', 1)[-1]
+        return any(fnmatch(rel_path, pattern) or ('/' not in pattern and fnmatch(name, pattern)) for pattern in patterns)
+    if exclude and matches(exclude):
+        return False
+    return not include or matches(include)
+
+# Remembers the contents of every directory listed by a scan in an SQLite database,
+# keyed by each directory's modification time, so later scans only list the directories that changed
+# A directory's modification time changes when files are added, removed or renamed in it, but not when a file is rewritten,
+# so sizes and times of files in unchanged directories can be out of date
+# Only subdirectories and files of the scanned types are kept
+class FileIndex:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.listed = 0
+        self.reused = 0
+        with self._connect() as conn:
+            if [row[1] for row in conn.execute('PRAGMA table_info(dirs)')] not in ([], DIR_COLUMNS):
+                conn.execute('DROP TABLE dirs')
+            conn.execute('CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime_ns INTEGER, types TEXT)')
+            conn.execute('CREATE TABLE IF NOT EXISTS entries (dir TEXT, name TEXT, type TEXT, size INTEGER, mtime_ns INTEGER, '
+                         'duration REAL, PRIMARY KEY (dir, name))')
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=60)
+
+    def scan(self, root, types, recursive=False, include=None, exclude=None, skip_dirs=()):
+        '''
+        Return an IndexedFile for each file under root whose extension is in types, a dict of type to extensions,
+        sorted by path
+        Subdirectories are searched too if recursive, except hidden ones, those in skip_dirs and those matching exclude
+        Each directory is only searched once, however many paths lead to it through symbolic links
+        Files are kept if their path relative to root passes glob_filter, and hidden files are always left out
+        '''
+        skip_dirs = {path.realpath(skip_dir) for skip_dir in skip_dirs}
+        visited = {path.realpath(root)}
+        scan_start_ns = time.time_ns()
+        found = []
+        try:
+            conn = self._connect()
+        except sqlite3.Error as e:
+            print("\tERR: Couldn't open file index: {}".format(e))
+            conn = None
+
+        pending = [(root, '')]
+        while pending:
+            cur_dir, rel_dir = pending.pop()
+            entries = self._entries(conn, cur_dir, types, scan_start_ns)
+            for name, entry_type, size, mtime_ns, duration in entries:
+                rel_path = f"{rel_dir}{name}"
+                if name.startswith('.'):
+                    continue
+                if entry_type == 'dir':
+                    sub_dir = path.join(cur_dir, name)
+                    real_dir = path.realpath(sub_dir)
+                    if recursive and real_dir not in skip_dirs | visited and glob_filter(rel_path, exclude=exclude):
+                        visited.add(real_dir)
+                        pending.append((sub_dir, rel_path + '/'))
+                elif entry_type in types and glob_filter(rel_path, include, exclude):
+                    found.append(IndexedFile(path.join(cur_dir, name), entry_type, size, mtime_ns, duration))
+
+        if conn is not None:
+            conn.close()
+        found.sort()
+        return found
+
+    def _entries(self, conn, cur_dir, types, scan_start_ns):
+        '''
+        Return (name, type, size, mtime_ns, duration) for the subdirectories and files of types in cur_dir,
+        from the index if the directory hasn't changed since it was last listed, otherwise listed now and stored
+        '''
+        key = path.realpath(cur_dir)
+        try:
+            dir_mtime_ns = os.stat(cur_dir).st_mtime_ns
+        except OSError as e:
+            print("\tERR: Couldn't read directory {}: {}".format(cur_dir, e))
+            return []
+
+        # Files of types that weren't scanned for when the directory was listed would be missing, so it is listed again
+        types_key = repr(sorted((file_type, sorted(exts)) for file_type, exts in types.items()))
+        if conn is not None:
+            try:
+                row = conn.execute('SELECT mtime_ns, types FROM dirs WHERE path = ?', (key,)).fetchone()
+                if row is not None and row == (dir_mtime_ns, types_key):
+                    self.reused += 1
+                    return conn.execute('SELECT name, type, size, mtime_ns, duration FROM entries WHERE dir = ?', (key,)).fetchall()
+            except sqlite3.Error as e:
+                print("\tERR: Couldn't read file index: {}".format(e))
+
+        entries = []
+        try:
+            with os.scandir(cur_dir) as it:
+                for entry in it:
+                    # Types come from the directory listing itself where the system provides them, so most entries aren't stat'ed
+                    if entry.is_dir():
+                        entries.append((entry.name, 'dir', None, None, None))
+                        continue
+                    entry_type = file_type(entry.name, types)
+                    if entry_type is None or entry.name.startswith('.') or not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    duration = None
+                    if entry_type == 'audio':
+                        metadata = get_wav_metadata(entry.path)
+                        duration = metadata.length if metadata else None
+                    entries.append((entry.name, entry_type, stat.st_size, stat.st_mtime_ns, duration))
+        except OSError as e:
+            print("\tERR: Couldn't list directory {}: {}".format(cur_dir, e))
+            return []
+        self.listed += 1
+
+        if conn is not None:
+            # A directory changed just before the scan might change again without its modification time changing
+            stored_mtime_ns = dir_mtime_ns if dir_mtime_ns < scan_start_ns - RACY_WINDOW_NS else None
+            try:
+                with conn:
+                    conn.execute('DELETE FROM entries WHERE dir = ?', (key,))
+                    conn.executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)', [(key, *entry) for entry in entries])
+                    conn.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)', (key, stored_mtime_ns, types_key))
+            except sqlite3.Error as e:
+                print("\tERR: Couldn't store file index: {}".format(e))
+        return entries
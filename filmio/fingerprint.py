@@ -0,0 +1,156 @@
+from collections import namedtuple
+import numpy as np
+from scipy import fft as sp_fft
+from scipy.ndimage import maximum_filter
+
+# Samples in each spectrogram frame, and between the starts of neighbouring frames
+# At the default analysis rate, frames are 64ms long and 32ms apart
+FINGERPRINT_FFT = 512
+FINGERPRINT_HOP = 256
+
+# Frames and frequency bins around a spectral peak that it must be the largest of
+PEAK_NEIGHBOURHOOD = (11, 21)
+
+# Amount, in natural log units of magnitude, that a peak must stand above the mean of its frame
+PEAK_THRESHOLD = 1.0
+
+# Each peak is paired with up to this many later peaks, from the next MAX_PAIR_FRAMES frames
+# and within MAX_PAIR_BINS frequency bins of it
+FAN_OUT = 5
+MAX_PAIR_FRAMES = 63
+MAX_PAIR_BINS = 63
+
+# Frames of spectrogram computed at once when building an index, so memory use doesn't depend on the recording's length
+CHUNK_FRAMES = 8192
+
+# Least number of landmarks that must agree on an offset for it to be believed
+MIN_VOTES = 4
+
+# Every landmark of a recording, sorted by hash so those of a clip can be looked up with a binary search
+#  hashes - frequencies of the two peaks of each landmark and the frames between them, packed into an integer
+#  times - frame of each landmark's first peak
+#  channels - channel of the recording each landmark was found in
+#  num_samples - length of the recording at rate
+Fingerprints = namedtuple('Fingerprints', ['hashes', 'times', 'channels', 'num_samples', 'rate'])
+
+def fingerprints_nbytes(fingerprints):
+    return fingerprints.hashes.nbytes + fingerprints.times.nbytes + fingerprints.channels.nbytes
+
+# Return read(start, count) over a mono sample array, with zeros for samples outside it
+def array_reader(samples):
+    def read(start, count):
+        window = np.zeros(count, np.float32)
+        lo = max(start, 0)
+        hi = min(start + count, len(samples))
+        if hi > lo:
+            window[lo - start:hi - start] = samples[lo:hi]
+        return window
+    return read
+
+# Log magnitude spectrogram of samples, as a (frames, bins) array, with a frame starting every FINGERPRINT_HOP samples
+def log_spectrogram(samples):
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FINGERPRINT_FFT)[::FINGERPRINT_HOP]
+    magnitude = np.abs(sp_fft.rfft(frames * np.hanning(FINGERPRINT_FFT).astype(np.float32), axis=1))
+    return np.log(magnitude + 1e-9)
+
+# Find the spectral peaks of samples read with read(start, count), which must return zeros outside the audio,
+# either mono or (channels, count) arrays
+# The spectrogram is computed CHUNK_FRAMES frames at a time, with enough frames either side for each peak's neighbourhood
+# Return (frames, bins) arrays of the peaks of each channel, sorted by frame
+def find_peaks(read, num_samples):
+    num_frames = max(num_samples - FINGERPRINT_FFT, 0) // FINGERPRINT_HOP + 1 if num_samples else 0
+    pad = PEAK_NEIGHBOURHOOD[0] // 2
+    peaks = None
+    for chunk_start in range(0, num_frames, CHUNK_FRAMES):
+        chunk_frames = min(CHUNK_FRAMES, num_frames - chunk_start)
+        first_frame = chunk_start - pad
+        count = (chunk_frames + 2 * pad - 1) * FINGERPRINT_HOP + FINGERPRINT_FFT
+        block = np.atleast_2d(read(first_frame * FINGERPRINT_HOP, count))
+        if peaks is None:
+            peaks = [([], []) for _ in block]
+        for channel, samples in enumerate(block):
+            spectrogram = log_spectrogram(samples)
+            threshold = spectrogram.mean(axis=1, keepdims=True) + PEAK_THRESHOLD
+            is_peak = (spectrogram == maximum_filter(spectrogram, size=PEAK_NEIGHBOURHOOD, mode='constant', cval=-np.inf))
+            is_peak &= spectrogram > threshold
+            frames, bins = np.nonzero(is_peak[pad:pad + chunk_frames])
+            peaks[channel][0].append(frames + chunk_start)
+            peaks[channel][1].append(bins)
+    return [(np.concatenate(frames), np.concatenate(bins)) for frames, bins in peaks or []]
+
+# Pair each peak with up to FAN_OUT of the peaks that follow it, as landmarks
+# Return (hashes, times) arrays, where times are the frames of each landmark's first peak
+def pair_peaks(frames, bins):
+    hashes = []
+    times = []
+    paired = np.zeros(len(frames), dtype=int)
+    ahead = 1
+    # Peaks are sorted by frame, so the pairs of each peak are found by looking further ahead in the list each pass
+    while ahead < len(frames):
+        anchors = np.arange(len(frames) - ahead)
+        dt = frames[anchors + ahead] - frames[anchors]
+        if not np.any(dt <= MAX_PAIR_FRAMES):
+            break
+        df = bins[anchors + ahead].astype(int) - bins[anchors]
+        keep = (dt > 0) & (dt <= MAX_PAIR_FRAMES) & (np.abs(df) <= MAX_PAIR_BINS) & (paired[anchors] < FAN_OUT)
+        anchors = anchors[keep]
+        paired[anchors] += 1
+        hashes.append((bins[anchors].astype(np.uint32) << 15) | (bins[anchors + ahead].astype(np.uint32) << 6) |
+                      dt[keep].astype(np.uint32))
+        times.append(frames[anchors])
+        ahead += 1
+    if not hashes:
+        return np.zeros(0, np.uint32), np.zeros(0, np.int32)
+    return np.concatenate(hashes), np.concatenate(times).astype(np.int32)
+
+# Build the landmark index of a recording of num_samples samples at rate, read with read(start, count) (see find_peaks)
+def build_fingerprints(read, num_samples, rate):
+    hashes = []
+    times = []
+    channels = []
+    for channel, (frames, bins) in enumerate(find_peaks(read, num_samples)):
+        channel_hashes, channel_times = pair_peaks(frames, bins)
+        hashes.append(channel_hashes)
+        times.append(channel_times)
+        channels.append(np.full(len(channel_hashes), channel, np.int16))
+    if not hashes:
+        return Fingerprints(np.zeros(0, np.uint32), np.zeros(0, np.int32), np.zeros(0, np.int16), num_samples, rate)
+    hashes = np.concatenate(hashes)
+    order = np.argsort(hashes, kind='stable')
+    return Fingerprints(hashes[order], np.concatenate(times)[order], np.concatenate(channels)[order], num_samples, rate)
+
+# Landmarks of a clip's mono samples, as (hashes, times) arrays
+def clip_landmarks(samples):
+    frames, bins = find_peaks(array_reader(samples), len(samples))[0]
+    return pair_peaks(frames, bins)
+
+# Find where a clip with the given landmarks starts in the recording indexed by fingerprints
+# Every landmark of the clip is looked up in the index, and each hit votes for the offset between the two,
+# so the cost depends on the number of hits rather than on the recording's length
+# Votes for neighbouring frames are counted together, since the clip's frames don't line up exactly with the recording's
+# Return (lag, votes, channel), where lag is the sample in the recording where the clip starts, to within a frame,
+#   or None if fewer than MIN_VOTES landmarks agree
+def locate_landmarks(fingerprints, landmarks):
+    hashes, times = landmarks
+    if not len(hashes) or not len(fingerprints.hashes):
+        return None
+    lo = np.searchsorted(fingerprints.hashes, hashes, 'left')
+    counts = np.searchsorted(fingerprints.hashes, hashes, 'right') - lo
+    total = int(counts.sum())
+    if not total:
+        return None
+    hits = np.repeat(lo, counts) + np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    offsets = fingerprints.times[hits].astype(np.int64) - np.repeat(times, counts)
+
+    # Each channel's offsets are kept apart by giving every channel its own range of keys
+    keys, key_votes = np.unique(fingerprints.channels[hits].astype(np.int64) * 2 ** 32 + offsets + 2 ** 31, return_counts=True)
+    votes = key_votes.copy()
+    for neighbour in (-1, 1):
+        found = np.searchsorted(keys, keys + neighbour)
+        found = np.minimum(found, len(keys) - 1)
+        votes += np.where(keys[found] == keys + neighbour, key_votes[found], 0)
+    best = int(np.argmax(votes))
+    if votes[best] < MIN_VOTES:
+        return None
+    channel, offset = divmod(int(keys[best]), 2 ** 32)
+    return (offset - 2 ** 31) * FINGERPRINT_HOP, int(votes[best]), channel
@@ -1,6 +1,11 @@
 from tkinter import Tk, Frame, BOTH, Button, Text, Entry, END, NORMAL, DISABLED, filedialog
 import os
-from .audio_fixer import AudioFixer, Modes, DEFAULT_SOURCE_DIR, DEFAULT_OUTPUT_DIR, VID_FILE_EXTS, AUDIO_FILE_EXTS
+from queue import Queue, Empty
+from threading import Thread
+from .audio_fixer import AudioFixer, Modes, Cancelled, DEFAULT_SOURCE_DIR, DEFAULT_OUTPUT_DIR, VID_FILE_EXTS, AUDIO_FILE_EXTS
+
+# Milliseconds between checks for progress from the job's thread
+POLL_INTERVAL = 100
 
 def updateText(item, new_text):
     item.configure(state=NORMAL)
@@ -16,6 +21,7 @@ class Window(Frame):
         self.pack(fill=BOTH, expand=1)
 
         self.items = []
+        self.events = Queue() # Progress from the job's thread, as (stage, item_file, done, total), ending with (None, message)
         self.setup()
 
     def setup(self):
@@ -23,6 +29,7 @@ class Window(Frame):
         self.audioFixer = AudioFixer(True)
         self.audioFixer.setSourceDir(DEFAULT_SOURCE_DIR)
         self.audioFixer.setOutputDir(DEFAULT_OUTPUT_DIR)
+        self.audioFixer.setProfile(None, summary=True)
 
         # Clear the screen
         self.destroyEverything()
@@ -49,8 +56,8 @@ class Window(Frame):
         self.createButton(x=0, y=295, text="Match Video with Source Audio", command=self.run(self.audioFixer.matchVideoToAudio, Modes.MATCH))
         self.createButton(x=0, y=320, text="Patch Source Audio onto Videos", command=self.run(self.audioFixer.patch, Modes.PATCH))
 
-    def createText(self, x, y, text):
-        item = Text(self, height=1, width=100)
+    def createText(self, x, y, text, height=1):
+        item = Text(self, height=height, width=100)
         item.place(x=x, y=y)
         item.insert(END, text)
         item.configure(state=DISABLED)
@@ -101,16 +108,60 @@ class Window(Frame):
                 print(exc)
 
             self.audioFixer.setMode(mode)
-            execute()
-            self.audioFixer.cleanup()
+            self.audioFixer.setProgress(lambda *event: self.events.put(event))
 
+            # The job runs on its own thread so the window keeps responding, and only the Tk thread touches widgets
             self.destroyEverything()
-            self.createText(x=0, y=0, text="Done!")
-            self.createText(x=0, y=20, text="Examine console output for results")
-            self.createButton(x=0, y=60, text="Restart", command=self.setup)
+            self.statusDisplay = self.createText(x=0, y=0, text="Running... examine console output for details")
+            self.progressDisplay = self.createText(x=0, y=20, text="", height=6)
+            self.stageProgress = {}
+            self.createButton(x=0, y=130, text="Cancel", command=self.cancel)
+            Thread(target=self.work, args=(execute,), daemon=True).start()
+            self.after(POLL_INTERVAL, self.poll)
 
         return execute_job
 
+    def work(self, execute):
+        message = "Done!"
+        try:
+            execute()
+        except Cancelled:
+            message = "Cancelled"
+        except Exception as exc: # pylint: disable=broad-except
+            print(exc)
+            message = f"Failed: {exc}"
+        finally:
+            self.audioFixer.reportFailures()
+            self.audioFixer.cleanup()
+            self.events.put((None, message))
+
+    def poll(self):
+        while True:
+            try:
+                stage, *progress = self.events.get_nowait()
+            except Empty:
+                break
+            if stage is None:
+                self.showDone(*progress)
+                return
+            item_file, done, total = progress
+            self.stageProgress[stage] = f"{stage}: {done}/{total} - {os.path.basename(item_file)}"
+        updateText(self.progressDisplay, "\n".join(self.stageProgress.values()))
+        self.after(POLL_INTERVAL, self.poll)
+
+    def cancel(self):
+        updateText(self.statusDisplay, "Cancelling...")
+        self.audioFixer.cancel()
+
+    def showDone(self, message):
+        self.destroyEverything()
+        self.createText(x=0, y=0, text=message)
+        self.createText(x=0, y=20, text="Examine console output for results")
+        summary = self.audioFixer.profileSummary().splitlines()
+        for i, line in enumerate(summary):
+            self.createText(x=0, y=60 + 20 * i, text=line)
+        self.createButton(x=0, y=80 + 20 * len(summary), text="Restart", command=self.setup)
+
 def create_gui():
     root = Tk()
     Window(root)
@@ -0,0 +1,76 @@
+import numpy as np
+from scipy.signal import sosfilt
+
+# Integrated loudness is measured as in ITU-R BS.1770, over 400 ms blocks that overlap by 75%
+GATE_BLOCK = 0.4
+GATE_STEP = 0.1
+
+# Blocks quieter than this, in LUFS, are ignored
+ABSOLUTE_GATE = -70
+
+# Blocks quieter than this, in LU relative to the loudness of the blocks passing the absolute gate, are also ignored
+RELATIVE_GATE = -10
+
+# K-weighting filter, as second order sections, for audio at the given rate
+# The BS.1770 coefficients are only given for 48 kHz, so they are derived for other rates from the
+# analog prototypes of its two stages, giving the published coefficients at 48 kHz
+def k_weighting(rate):
+    # High shelf modelling the acoustic effect of the head
+    gain_db, q, fc = 3.999843853973347, 0.7071752369554196, 1681.974450955533
+    k = np.tan(np.pi * fc / rate)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.4996667741545416
+    shelf = [vh + vb * k / q + k * k, 2 * (k * k - vh), vh - vb * k / q + k * k,
+             1 + k / q + k * k, 2 * (k * k - 1), 1 - k / q + k * k]
+
+    # High pass, the RLB weighting curve
+    q, fc = 0.5003270373238773, 38.13547087602444
+    k = np.tan(np.pi * fc / rate)
+    a0 = 1 + k / q + k * k
+    # Its numerator is left unnormalized, as in BS.1770
+    high_pass = [a0, -2 * a0, a0, a0, 2 * (k * k - 1), 1 - k / q + k * k]
+
+    sos = np.array([shelf, high_pass])
+    return np.hstack((sos[:, :3] / sos[:, 3:4], sos[:, 3:] / sos[:, 3:4]))
+
+def block_loudness(mean_square):
+    return -0.691 + 10 * np.log10(np.maximum(mean_square, np.finfo(np.float64).tiny))
+
+# Measures integrated loudness of audio fed to it a block at a time
+# Only the mean square of each 100 ms step is kept, so memory use is small for any length of audio
+# Every channel is weighted equally, since channel layouts aren't known
+class LoudnessMeter:
+    def __init__(self, rate, channels):
+        self.step_len = int(round(GATE_STEP * rate))
+        self._sos = k_weighting(rate)
+        self._zi = np.zeros((len(self._sos), 2, channels))
+        self._pending = np.zeros((0, channels))
+        self._step_energy = []
+
+    def add(self, samples):
+        '''
+        Add a (frames, channels) block of float samples, at a full scale of 1
+        '''
+        filtered, self._zi = sosfilt(self._sos, samples, axis=0, zi=self._zi)
+        filtered = np.concatenate((self._pending, filtered))
+        whole = len(filtered) // self.step_len * self.step_len
+        steps = filtered[:whole].reshape(-1, self.step_len, filtered.shape[1])
+        self._step_energy.extend(np.mean(steps ** 2, axis=1).sum(axis=1))
+        self._pending = filtered[whole:]
+
+    def integrated(self):
+        '''
+        Return the gated integrated loudness, in LUFS, of the audio added so far
+        Returns None if there isn't a whole block that passes the gates
+        '''
+        steps_per_block = int(round(GATE_BLOCK / GATE_STEP))
+        if len(self._step_energy) < steps_per_block:
+            return None
+        blocks = np.convolve(self._step_energy, np.ones(steps_per_block) / steps_per_block, mode='valid')
+        loudness = block_loudness(blocks)
+
+        gated = loudness > ABSOLUTE_GATE
+        if not gated.any():
+            return None
+        gated &= loudness > block_loudness(np.mean(blocks[gated])) + RELATIVE_GATE
+        return float(block_loudness(np.mean(blocks[gated])))
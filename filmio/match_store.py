@@ -0,0 +1,114 @@
+import os
+import sqlite3
+from os import path
+from threading import local
+from .audio_util import MatchTuple, AudioStats
+from .profiler import PROFILER
+
+MATCH_STORE_FILE = '.filmio_matches.sqlite'
+
+# Increase whenever a change to matching would give different results for the same files
+MATCHER_VERSION = 5
+
+# Connections a forked process inherited from its parent, kept so they are never closed by the child
+_inherited_connections = []
+
+# Identify a file by its size and modification time too, so results for a file are not reused once it changes
+def file_identity(file_path):
+    stat = os.stat(file_path)
+    return f"{path.realpath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+# Keeps the MatchTuple found for each (video file, audio file, match settings) in an SQLite database,
+# so later runs only have to match pairs that are new or have changed
+# The AudioStats of each audio file are kept too, so gain analysis doesn't have to read files again
+# Connections are opened per thread, and dropped when pickled for worker processes
+# A table written when its tuple had different fields is emptied, since its rows can't be read back
+class MatchStore:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self._local = local()
+        with self._connect() as conn:
+            _create_table(conn, 'matches', ['video', 'audio', 'settings'], MatchTuple._fields)
+            _create_table(conn, 'stats', ['audio'], AudioStats._fields)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid != os.getpid():
+            # Made before this process was forked, so it belongs to the parent and must not be used or closed here
+            _inherited_connections.append(conn)
+            conn = None
+        if conn is None:
+            # Several processes may write at once, so wait for their locks rather than failing
+            conn = sqlite3.connect(self.db_path, timeout=60)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, video_file, audio_file, settings):
+        '''
+        Return the stored MatchTuple for the pair, or None if it hasn't been matched with these settings
+        '''
+        try:
+            row = self._connect().execute(
+                'SELECT {} FROM matches WHERE video = ? AND audio = ? AND settings = ?'.format(', '.join(MatchTuple._fields)),
+                (file_identity(video_file), file_identity(audio_file), repr(settings))).fetchone()
+        except (OSError, sqlite3.Error) as e:
+            print("\tERR: Couldn't read stored match: {}".format(e))
+            row = None
+        if row is None:
+            self.misses += 1
+            PROFILER.add('match_store', misses=1)
+            return None
+        self.hits += 1
+        PROFILER.add('match_store', hits=1)
+        match_tuple = MatchTuple(*row)
+        return match_tuple._replace(channel=int(match_tuple.channel)) # Stored as REAL, like every other field
+
+    def put(self, video_file, audio_file, settings, match_tuple):
+        try:
+            with self._connect() as conn:
+                conn.execute('INSERT OR REPLACE INTO matches VALUES (?, ?, ?, {})'.format(', '.join('?' * len(MatchTuple._fields))),
+                             (file_identity(video_file), file_identity(audio_file), repr(settings), *match_tuple))
+        except (OSError, sqlite3.Error) as e:
+            print("\tERR: Couldn't store match: {}".format(e))
+
+    def get_stats(self, audio_file):
+        '''
+        Return the stored AudioStats for the audio file, or None if it hasn't been analyzed since it last changed
+        '''
+        try:
+            row = self._connect().execute(
+                'SELECT {} FROM stats WHERE audio = ?'.format(', '.join(AudioStats._fields)),
+                (file_identity(audio_file),)).fetchone()
+        except (OSError, sqlite3.Error) as e:
+            print("\tERR: Couldn't read stored audio stats: {}".format(e))
+            row = None
+        return AudioStats(*row) if row is not None else None
+
+    def put_stats(self, audio_file, stats):
+        try:
+            with self._connect() as conn:
+                conn.execute('INSERT OR REPLACE INTO stats VALUES (?, {})'.format(', '.join('?' * len(AudioStats._fields))),
+                             (file_identity(audio_file), *stats))
+        except (OSError, sqlite3.Error) as e:
+            print("\tERR: Couldn't store audio stats: {}".format(e))
+
+def _create_table(conn, table, key_columns, fields):
+    columns = key_columns + list(fields)
+    existing = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if existing and existing != columns:
+        conn.execute(f'DROP TABLE {table}')
+    conn.execute('CREATE TABLE IF NOT EXISTS {} ({}, {}, PRIMARY KEY ({}))'.format(
+        table, ', '.join(f'{column} TEXT' for column in key_columns), ', '.join(f'{field} REAL' for field in fields),
+        ', '.join(key_columns)))
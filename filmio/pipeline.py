@@ -0,0 +1,62 @@
+from queue import Queue
+from threading import Thread, Lock
+
+# Marks the end of a stage's input
+_DONE = object()
+
+# Pass each item through a chain of stages, where every stage runs on its own threads
+# and hands its output to the next stage through a queue holding at most depth items
+# stages is a list of (name, func, num_workers), where func takes an item and returns the item
+#   for the next stage, or None to drop it
+# If func raises, on_error(name, item, exception) is called and the item is dropped
+# Returns the outputs of the last stage, in the order they finished
+def run_pipeline(items, stages, depth, on_error):
+    stages = [(name, func, max(num_workers, 1)) for name, func, num_workers in stages]
+    queues = [Queue(maxsize=depth) for _ in stages]
+    results = []
+    results_lock = Lock()
+
+    def feed():
+        for item in items:
+            queues[0].put(item)
+        for _ in range(stages[0][2]):
+            queues[0].put(_DONE)
+
+    def work(index):
+        name, func, _ = stages[index]
+        while True:
+            item = queues[index].get()
+            if item is _DONE:
+                return
+            try:
+                output = func(item)
+            except Exception as e:
+                on_error(name, item, e)
+                continue
+            if output is None:
+                continue
+            if index + 1 < len(stages):
+                queues[index + 1].put(output)
+            else:
+                with results_lock:
+                    results.append(output)
+
+    # Once every worker of a stage is finished, tell every worker of the next stage
+    def close(index, workers):
+        for worker in workers:
+            worker.join()
+        if index + 1 < len(stages):
+            for _ in range(stages[index + 1][2]):
+                queues[index + 1].put(_DONE)
+
+    threads = [Thread(target=feed, daemon=True)]
+    for index, (_, _, num_workers) in enumerate(stages):
+        workers = [Thread(target=work, args=(index,), daemon=True) for _ in range(num_workers)]
+        threads += workers
+        threads.append(Thread(target=close, args=(index, workers), daemon=True))
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
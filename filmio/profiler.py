@@ -0,0 +1,170 @@
+import os
+import csv
+import glob
+import json
+import cProfile
+import pstats
+from time import perf_counter
+from threading import Lock
+from contextlib import contextmanager
+
+# Columns of the CSV run report, before any other counters
+REPORT_COLUMNS = ['stage', 'calls', 'seconds', 'seconds_per_call', 'bytes_read', 'bytes_written', 'hit_rate']
+
+# Totals for each stage of a run (gain, louden, extract, match, trim, attach, ffmpeg...),
+# such as how many times it ran, for how many seconds and how many bytes it read and wrote
+# Stages running on several threads add up their time, so a stage can take more seconds than the run
+# Stages can also be timed inside others, such as ffmpeg inside extract, so their times overlap
+# Nothing is recorded until enabled, so instrumented code costs next to nothing otherwise
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self._lock = Lock()
+        self._stages = {}
+        self._start = perf_counter()
+
+    def enable(self):
+        '''
+        Start recording a new run, dropping the totals of any earlier one
+        '''
+        with self._lock:
+            self.enabled = True
+            self._stages = {}
+            self._start = perf_counter()
+
+    def add(self, stage, **counts):
+        '''
+        Add each of counts to the stage's totals
+        '''
+        if not self.enabled:
+            return
+        with self._lock:
+            totals = self._stages.setdefault(stage, {})
+            for key, value in counts.items():
+                totals[key] = totals.get(key, 0) + value
+
+    @contextmanager
+    def time(self, stage, **counts):
+        '''
+        Add the time spent inside the with block, one call and counts to the stage's totals
+        Yields a dict that counts only known inside the block, such as bytes written, can be added to
+        '''
+        counts = dict(counts)
+        start = perf_counter()
+        try:
+            yield counts
+        finally:
+            self.add(stage, calls=1, seconds=perf_counter() - start, **counts)
+
+    def drain(self):
+        '''
+        Return the totals recorded so far and start again from zero, to send them from a worker process
+        '''
+        with self._lock:
+            stages, self._stages = self._stages, {}
+        return stages
+
+    def merge(self, stages):
+        '''
+        Add totals drained from another Profiler
+        '''
+        for stage, counts in stages.items():
+            self.add(stage, **counts)
+
+    def report(self):
+        '''
+        Return the run report, as {'wall_seconds', 'stages': {stage: totals}}
+        Totals with calls get seconds_per_call, and totals with hits and misses get a hit_rate
+        '''
+        with self._lock:
+            stages = {stage: dict(counts) for stage, counts in self._stages.items()}
+        for counts in stages.values():
+            if counts.get('calls'):
+                counts['seconds_per_call'] = counts.get('seconds', 0) / counts['calls']
+            lookups = counts.get('hits', 0) + counts.get('misses', 0)
+            if lookups:
+                counts['hit_rate'] = counts.get('hits', 0) / lookups
+        return {'wall_seconds': perf_counter() - self._start, 'stages': stages}
+
+    def write(self, report_file):
+        '''
+        Write the run report to report_file, as CSV if it ends in .csv and as JSON otherwise
+        The CSV has a row per stage, and a final "run" row for the wall time
+        '''
+        report = self.report()
+        if not report_file.lower().endswith('.csv'):
+            with open(report_file, 'w') as f:
+                json.dump(report, f, indent=2)
+            return
+
+        extra = sorted({key for counts in report['stages'].values() for key in counts} - set(REPORT_COLUMNS))
+        with open(report_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, REPORT_COLUMNS + extra)
+            writer.writeheader()
+            for stage, counts in sorted(report['stages'].items()):
+                writer.writerow({'stage': stage, **counts})
+            writer.writerow({'stage': 'run', 'seconds': report['wall_seconds']})
+
+    def summary(self):
+        '''
+        Return a line per stage with its calls, time and throughput, slowest first, for showing to the user
+        '''
+        report = self.report()
+        lines = [f"Total: {report['wall_seconds']:.1f}s"]
+        for stage, counts in sorted(report['stages'].items(), key=lambda item: -item[1].get('seconds', 0)):
+            parts = []
+            if 'calls' in counts:
+                parts.append(f"{counts['calls']} calls, {counts['seconds']:.1f}s")
+            megabytes = (counts.get('bytes_read', 0) + counts.get('bytes_written', 0)) / 2 ** 20
+            if megabytes and counts.get('seconds'):
+                parts.append(f"{megabytes / counts['seconds']:.1f} MB/s")
+            if 'hit_rate' in counts:
+                parts.append(f"{counts['hit_rate']:.0%} hits")
+            lines.append(f"{stage}: {', '.join(parts)}")
+        return '\n'.join(lines)
+
+# Shared by everything in a process, so that module level functions such as run_ffmpeg can be timed too
+PROFILER = Profiler()
+
+# Run the with block under cProfile if dump_file is given, adding its stats to any already dumped there
+# Each process dumps to its own file, with its process id appended unless it is the main process (see merge_dumps)
+@contextmanager
+def profiled(dump_file, main_process=True):
+    if not dump_file:
+        yield
+        return
+    if not main_process:
+        dump_file = f"{dump_file}.{os.getpid()}"
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        stats = pstats.Stats(profile)
+        if os.path.exists(dump_file):
+            stats.add(dump_file)
+        stats.dump_stats(dump_file)
+
+# Files that worker processes dumped cProfile stats of dump_file to (see profiled)
+def worker_dumps(dump_file):
+    return [worker_file for worker_file in glob.glob(f"{glob.escape(dump_file)}.*")
+            if worker_file[len(dump_file) + 1:].isdigit()]
+
+# Remove dump_file and any worker dumps of it left by an earlier run, so stats aren't added to theirs
+def clear_dumps(dump_file):
+    for old_file in [dump_file] + worker_dumps(dump_file):
+        if os.path.exists(old_file):
+            os.remove(old_file)
+
+# Add the stats of each worker dump of dump_file to it, and remove the worker dumps
+def merge_dumps(dump_file):
+    worker_files = worker_dumps(dump_file)
+    if not worker_files:
+        return
+    stats = pstats.Stats(*worker_files)
+    if os.path.exists(dump_file):
+        stats.add(dump_file)
+    stats.dump_stats(dump_file)
+    for worker_file in worker_files:
+        os.remove(worker_file)
@@ -0,0 +1,140 @@
+import os
+import struct
+from os import path, makedirs
+from hashlib import sha1
+from threading import Lock
+from cachetools import LRUCache
+import numpy as np
+from .audio_util import read_mono, read_channels, fingerprint_file, get_wav_metadata
+from .wav_io import WavFormatError
+from .profiler import PROFILER
+from .correlate import (ANALYSIS_WINDOW, ANALYSIS_RATE, Reference, CoarseReference, prepare_reference, prepare_coarse_reference,
+                        reference_nbytes)
+from .fingerprint import Fingerprints, fingerprints_nbytes
+
+DEFAULT_CACHE_SIZE = 2048 # MB
+
+# Holds the decoded samples and spectrum of each external audio file, resampled to the analysis rate,
+# so each file is read and transformed once per run rather than once per video
+# Full rate spectra (Reference), envelope spectra (CoarseReference) and landmark indexes (fingerprint.Fingerprints)
+# are cached separately
+# If all_channels is set, every channel of a file is kept, so each video can be matched against all of them at once,
+# otherwise only the first
+# Entries are evicted least recently used first once the memory budget is exceeded
+# If cache_dir is given, entries are also saved there and reused across runs
+class SpectrumCache:
+    def __init__(self, max_bytes=DEFAULT_CACHE_SIZE * 2 ** 20, cache_dir=None, window=ANALYSIS_WINDOW, rate=ANALYSIS_RATE,
+                 all_channels=False):
+        self.window = window
+        self.rate = rate
+        self.all_channels = all_channels
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._cache = LRUCache(maxsize=max_bytes, getsizeof=_nbytes)
+        self._lock = Lock()
+        if cache_dir:
+            makedirs(cache_dir, exist_ok=True)
+
+    # Identify a file by its contents as well as its path, so rewritten files are not reused
+    # kind is 'full', 'coarse' or 'fingerprints'
+    def key(self, audio_file, kind='full'):
+        metadata = get_wav_metadata(audio_file)
+        if not metadata:
+            return None
+        stat = os.stat(audio_file)
+        return (path.realpath(audio_file), stat.st_size, stat.st_mtime_ns, self.rate, self.window, self.all_channels, kind)
+
+    def get(self, audio_file, coarse=False):
+        '''
+        Return the Reference, or CoarseReference if coarse is set, for the audio file,
+        computing it if not cached
+        Returns None if the file can't be read
+        '''
+        def prepare():
+            samples = read_channels(audio_file, self.rate) if self.all_channels else read_mono(audio_file, self.rate, channel=0)
+            return (prepare_coarse_reference if coarse else prepare_reference)(samples, self.rate, self.window)
+        return self._get(audio_file, 'coarse' if coarse else 'full', prepare)
+
+    def fingerprints(self, audio_file):
+        '''
+        Return the landmark index (see fingerprint.Fingerprints) for the audio file, building it if not cached
+        Returns None if the file can't be read
+        '''
+        return self._get(audio_file, 'fingerprints', lambda: fingerprint_file(audio_file, self.rate, self.all_channels))
+
+    def _get(self, audio_file, kind, prepare):
+        key = self.key(audio_file, kind)
+        if key is None:
+            return None
+
+        with self._lock:
+            reference = self._cache.get(key)
+        if reference is not None:
+            self.hits += 1
+            PROFILER.add('spectrum_cache', hits=1)
+            return reference
+        self.misses += 1
+        PROFILER.add('spectrum_cache', misses=1)
+
+        reference = self._load(key)
+        if reference is None:
+            with PROFILER.time('spectrum', bytes_read=path.getsize(audio_file)):
+                try:
+                    reference = prepare()
+                except (OSError, WavFormatError, struct.error) as e:
+                    print("\tERR: Couldn't read data: {}".format(e))
+                    return None
+            self._save(key, reference)
+
+        with self._lock:
+            try:
+                self._cache[key] = reference
+            except ValueError:
+                pass # Larger than the whole budget, so just don't keep it
+        return reference
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def _disk_path(self, key):
+        return path.join(self.cache_dir, sha1(repr(key).encode()).hexdigest() + '.npz')
+
+    def _load(self, key):
+        if not self.cache_dir or not path.isfile(self._disk_path(key)):
+            return None
+        try:
+            with np.load(self._disk_path(key)) as saved:
+                if key[-1] == 'fingerprints':
+                    return Fingerprints(saved['hashes'], saved['times'], saved['channels'], int(saved['num_samples']),
+                                        int(saved['rate']))
+                if key[-1] == 'coarse':
+                    envelope = _reference_from_arrays(saved, 'envelope_')
+                    return CoarseReference(saved['samples'], saved['energy'], envelope, int(saved['rate']))
+                return _reference_from_arrays(saved)
+        except Exception as e:
+            print("\tERR: Couldn't load cached spectrum: {}".format(e))
+            return None
+
+    def _save(self, key, reference):
+        if not self.cache_dir:
+            return
+        try:
+            if isinstance(reference, CoarseReference):
+                arrays = {'samples': reference.samples, 'energy': reference.energy, 'rate': reference.rate}
+                arrays.update({'envelope_' + name: value for name, value in reference.envelope._asdict().items()})
+            else:
+                arrays = reference._asdict()
+            np.savez(self._disk_path(key), **arrays)
+        except Exception as e:
+            print("\tERR: Couldn't save cached spectrum: {}".format(e))
+
+def _nbytes(entry):
+    if isinstance(entry, Fingerprints):
+        return fingerprints_nbytes(entry)
+    return reference_nbytes(entry)
+
+def _reference_from_arrays(saved, prefix=''):
+    return Reference(saved[prefix + 'samples'], saved[prefix + 'energy'], saved[prefix + 'spectrum'],
+                     int(saved[prefix + 'n_fft']), int(saved[prefix + 'window_len']), int(saved[prefix + 'rate']))
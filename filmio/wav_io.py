@@ -0,0 +1,300 @@
+import os
+import struct
+from io import BytesIO
+from collections import namedtuple
+import numpy as np
+
+# Frames read or written at a time when streaming, so memory use doesn't depend on file length
+BLOCK_FRAMES = 2 ** 16
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Description, originator and reference fields come before the date, time and time reference in a bext chunk
+BEXT_TIMING_END = 256 + 32 + 32 + 10 + 8 + 8
+
+# Sizes above this don't fit in a RIFF header, so the file is written as RF64 instead
+MAX_RIFF_SIZE = 0xFFFFFFFF
+
+# Layout of the sample data in a wav file, plus Broadcast Wave (bext) timing if present
+#  sampwidth - bytes per sample of one channel
+#  num_frames - number of samples per channel
+#  data_offset - position of the first sample in the file
+#  time_reference - samples since midnight at the start of the recording, or None
+#  origination - "YYYY-MM-DD HH:MM:SS" date and time the recording was made, or None
+WavInfo = namedtuple('WavInfo', ['rate', 'channels', 'sampwidth', 'is_float', 'num_frames', 'data_offset',
+                                 'time_reference', 'origination'], defaults=[None, None])
+
+_INT24_INFO = namedtuple('Int24Info', ['min', 'max'])(-2 ** 23, 2 ** 23 - 1)
+
+class WavFormatError(Exception):
+    pass
+
+# Parse the RIFF/RF64 headers of a wav file without reading any samples
+# Chunks after the data chunk are found by seeking over the samples
+def read_wav_info(wav_file):
+    with open(wav_file, 'rb') as f:
+        return _read_info(f, os.fstat(f.fileno()).st_size, wav_file)
+
+# Decode a whole wav file held in memory, such as one written by ffmpeg to a pipe
+# Streams written to a pipe can't have their sizes filled in, so their data is taken to run to the end
+# Return (WavInfo, (frames, channels) array)
+def decode_wav_bytes(raw):
+    info = _read_info(BytesIO(raw), len(raw), 'wav data')
+    frame_size = info.channels * info.sampwidth
+    data = raw[info.data_offset:info.data_offset + info.num_frames * frame_size]
+    return info, decode_samples(data, info.channels, info.sampwidth, info.is_float)
+
+def _read_info(f, file_size, name):
+    riff_id, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+    if riff_id not in (b'RIFF', b'RF64') or wave_id != b'WAVE':
+        raise WavFormatError(f"{name} is not a RIFF/RF64 WAVE file")
+
+    fmt = None
+    data = None
+    bext = (None, None)
+    rf64_data_size = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        chunk_id, chunk_size = struct.unpack('<4sI', header)
+        chunk_start = f.tell()
+
+        if chunk_id == b'ds64':
+            _, rf64_data_size = struct.unpack('<QQ', f.read(16))
+        elif chunk_id == b'fmt ':
+            fmt = _parse_fmt(f.read(chunk_size))
+        elif chunk_id == b'bext':
+            bext = _parse_bext(f.read(min(chunk_size, BEXT_TIMING_END)))
+        elif chunk_id == b'data':
+            if chunk_size == MAX_RIFF_SIZE and rf64_data_size is not None:
+                chunk_size = rf64_data_size
+            # Recordings that were cut off, or written to a pipe, can claim more data than the file holds
+            chunk_size = min(chunk_size, file_size - chunk_start)
+            data = (chunk_start, chunk_size)
+
+        # Chunks are padded to an even number of bytes
+        f.seek(chunk_start + chunk_size + (chunk_size & 1))
+
+    if fmt is None or data is None:
+        raise WavFormatError(f"No fmt or data chunk in {name}")
+    rate, channels, sampwidth, is_float = fmt
+    data_offset, data_size = data
+    return WavInfo(rate, channels, sampwidth, is_float, data_size // (channels * sampwidth), data_offset, *bext)
+
+# Return (time_reference, origination) from the start of a bext chunk
+def _parse_bext(bext_chunk):
+    if len(bext_chunk) < BEXT_TIMING_END:
+        return None, None
+    date, time, time_low, time_high = struct.unpack('<10s8sII', bext_chunk[320:BEXT_TIMING_END])
+    date = date.decode('ascii', errors='replace').strip('\0 ')
+    time = time.decode('ascii', errors='replace').strip('\0 ')
+    # Some recorders separate the fields with other characters than the spec's dashes and colons
+    origination = f"{date[:4]}-{date[5:7]}-{date[8:10]} {time[:2]}:{time[3:5]}:{time[6:8]}" if date and time else None
+    return time_low + (time_high << 32), origination
+
+# Return (rate, channels, sampwidth, is_float) from the body of a fmt chunk
+def _parse_fmt(fmt_chunk):
+    format_tag, channels, rate, _, _, bits = struct.unpack('<HHIIHH', fmt_chunk[:16])
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt_chunk) >= 26:
+        # The real format tag starts the sub format GUID
+        format_tag = struct.unpack('<H', fmt_chunk[24:26])[0]
+    if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+        raise WavFormatError(f"Unsupported wav format {format_tag:#x}")
+    return rate, channels, (bits + 7) // 8, format_tag == WAVE_FORMAT_IEEE_FLOAT
+
+# numpy dtype that samples are decoded to, same as wavio
+# 24 bit samples are held in int32
+def sample_dtype(sampwidth, is_float):
+    if is_float:
+        return np.dtype('<f4') if sampwidth == 4 else np.dtype('<f8')
+    return {1: np.dtype(np.uint8), 2: np.dtype('<i2'), 3: np.dtype('<i4'), 4: np.dtype('<i4')}[sampwidth]
+
+# Sample value for silence, which is the midpoint for unsigned 8 bit samples
+def silent_value(dtype):
+    return 128 if dtype == np.uint8 else 0
+
+# Frames start to start + num_frames of a (frames, ...) sample array, with silence for any frames outside it
+# A range inside the array is returned as a view of it, otherwise the output is allocated once and only the overlap copied in
+def padded_slice(data, start, num_frames):
+    num_frames = max(num_frames, 0)
+    if start >= 0 and start + num_frames <= len(data):
+        return data[start:start + num_frames]
+    padded = np.full((num_frames,) + data.shape[1:], silent_value(data.dtype), data.dtype)
+    lo = max(start, 0)
+    hi = min(start + num_frames, len(data))
+    if hi > lo:
+        padded[lo - start:hi - start] = data[lo:hi]
+    return padded
+
+def decode_samples(raw, channels, sampwidth, is_float):
+    if sampwidth == 3 and not is_float:
+        # Place each 3 byte sample in the top of an int32, then shift down to keep the sign
+        frames = np.frombuffer(raw, np.uint8).reshape(-1, 3)
+        padded = np.zeros((len(frames), 4), np.uint8)
+        padded[:, 1:] = frames
+        data = padded.view('<i4').reshape(-1) >> 8
+    else:
+        data = np.frombuffer(raw, sample_dtype(sampwidth, is_float))
+    return data.reshape(-1, channels)
+
+# Convert samples to the dtype they are stored as, rounding and clipping them to the range of integer formats
+def cast_samples(data, sampwidth, is_float):
+    dtype = sample_dtype(sampwidth, is_float)
+    data = np.asarray(data)
+    if data.dtype != dtype:
+        if not is_float:
+            info = np.iinfo(dtype) if sampwidth != 3 else _INT24_INFO
+            data = np.clip(np.rint(data), info.min, info.max)
+        data = data.astype(dtype)
+    return data
+
+def encode_samples(data, sampwidth, is_float):
+    data = cast_samples(data, sampwidth, is_float)
+    if sampwidth == 3 and not is_float:
+        return np.ascontiguousarray(data.astype('<i4').view(np.uint8).reshape(-1, 4)[:, :3]).tobytes()
+    return np.ascontiguousarray(data).tobytes()
+
+# Reads sample blocks from a wav file, without loading the whole file
+class WavReader:
+    def __init__(self, wav_file):
+        self.info = read_wav_info(wav_file)
+        self.dtype = sample_dtype(self.info.sampwidth, self.info.is_float)
+        self._frame_size = self.info.channels * self.info.sampwidth
+        self._file = open(wav_file, 'rb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def read(self, start, num_frames):
+        '''
+        Read num_frames frames from start, which must lie within the file
+        Returns a (frames, channels) array
+        '''
+        self._file.seek(self.info.data_offset + start * self._frame_size)
+        raw = self._file.read(num_frames * self._frame_size)
+        return decode_samples(raw[:len(raw) - len(raw) % self._frame_size], self.info.channels,
+                              self.info.sampwidth, self.info.is_float)
+
+    def read_padded(self, start, num_frames):
+        '''
+        Read num_frames frames from start, with silence for any frames outside the file
+        Returns a (frames, channels) array, as returned by read if every frame is inside the file, so it is only copied once
+        '''
+        if start >= 0 and start + num_frames <= self.info.num_frames:
+            return self.read(start, num_frames)
+        data = np.full((num_frames, self.info.channels), silent_value(self.dtype), self.dtype)
+        lo = max(start, 0)
+        hi = min(start + num_frames, self.info.num_frames)
+        if hi > lo:
+            data[lo - start:hi - start] = self.read(lo, hi - lo)
+        return data
+
+    def blocks(self, start=0, end=None, block_frames=BLOCK_FRAMES):
+        '''
+        Generate (frames, channels) arrays covering frames start to end, at most block_frames at a time
+        The range is limited to the frames in the file
+        '''
+        pos = max(start, 0)
+        end = self.info.num_frames if end is None else min(end, self.info.num_frames)
+        while pos < end:
+            count = min(block_frames, end - pos)
+            yield self.read(pos, count)
+            pos += count
+
+# Writes sample blocks to a wav file as they are produced
+# A JUNK chunk is reserved after the RIFF header, so that files over 4GB can be turned into RF64 when closed
+class WavWriter:
+    def __init__(self, wav_file, rate, channels, sampwidth, is_float):
+        self.rate = rate
+        self.channels = channels
+        self.sampwidth = sampwidth
+        self.is_float = is_float
+        self.num_frames = 0
+        self._file = open(wav_file, 'wb')
+        self._write_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, data):
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = data.reshape(-1, 1)
+        self._file.write(encode_samples(data, self.sampwidth, self.is_float))
+        self.num_frames += len(data)
+
+    def write_silence(self, num_frames, block_frames=BLOCK_FRAMES):
+        '''
+        Write num_frames silent frames, using a single block of zeros no matter how many are needed
+        '''
+        dtype = sample_dtype(self.sampwidth, self.is_float)
+        silence = encode_samples(np.full((min(num_frames, block_frames), self.channels), silent_value(dtype), dtype),
+                                 self.sampwidth, self.is_float)
+        frame_size = self.channels * self.sampwidth
+        while num_frames > 0:
+            count = min(num_frames, block_frames)
+            self._file.write(silence[:count * frame_size])
+            self.num_frames += count
+            num_frames -= count
+
+    def close(self):
+        if self._file.closed:
+            return
+        data_size = self.num_frames * self.channels * self.sampwidth
+        if data_size & 1:
+            self._file.write(b'\0')
+        riff_size = self._file.tell() - 8
+
+        if riff_size > MAX_RIFF_SIZE:
+            self._file.seek(0)
+            self._file.write(struct.pack('<4sI4s', b'RF64', MAX_RIFF_SIZE, b'WAVE'))
+            self._file.write(struct.pack('<4sIQQQI', b'ds64', 28, riff_size, data_size, self.num_frames, 0))
+            self._file.seek(self._data_size_pos)
+            self._file.write(struct.pack('<I', MAX_RIFF_SIZE))
+        else:
+            self._file.seek(4)
+            self._file.write(struct.pack('<I', riff_size))
+            self._file.seek(self._data_size_pos)
+            self._file.write(struct.pack('<I', data_size))
+        self._file.close()
+
+    def _write_header(self):
+        format_tag = WAVE_FORMAT_IEEE_FLOAT if self.is_float else WAVE_FORMAT_PCM
+        block_align = self.channels * self.sampwidth
+        self._file.write(struct.pack('<4sI4s', b'RIFF', 0, b'WAVE'))
+        self._file.write(struct.pack('<4sI', b'JUNK', 28) + b'\0' * 28)
+        self._file.write(struct.pack('<4sIHHIIHH', b'fmt ', 16, format_tag, self.channels, self.rate,
+                                     self.rate * block_align, block_align, self.sampwidth * 8))
+        self._file.write(struct.pack('<4s', b'data'))
+        self._data_size_pos = self._file.tell()
+        self._file.write(struct.pack('<I', 0))
+
+# Read blocks from input_file, pass each through block_processor and write them to output_file,
+# keeping the same sample format
+# Only frames start to end are written, with silence for any outside the input file
+# If channels is given, only those channels are kept, numbered from 0
+def stream_wav_file(input_file, output_file, block_processor, start=0, end=None, channels=None):
+    with WavReader(input_file) as reader:
+        info = reader.info
+        num_channels = info.channels if channels is None else len(channels)
+        with WavWriter(output_file, info.rate, num_channels, info.sampwidth, info.is_float) as writer:
+            end = info.num_frames if end is None else end
+            # Silence is written directly, rather than read as blocks of zeros
+            if start < 0:
+                writer.write_silence(min(-start, end - start))
+            for block in reader.blocks(start, end):
+                writer.write(block_processor(block if channels is None else block[:, channels]))
+            if end > max(info.num_frames, start):
+                writer.write_silence(end - max(info.num_frames, start))
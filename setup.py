@@ -12,7 +12,7 @@ setuptools.setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/alexscarlatos/filmio",
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=['benchmarks']),
     package_data={'': ['cross_correlate.praat', 'filmio.command']},
     include_package_data=True,
     classifiers=[
@@ -24,7 +24,7 @@ setuptools.setup(
     install_requires=[
         'wavio',
         'scipy',
-        'numpy',
+        'numpy>=1.20', # For sliding_window_view
         'pylint',
         'praat-parselmouth',
         'cachetools'
@@ -0,0 +1,35 @@
+import struct
+import numpy as np
+import pytest
+from filmio.wav_io import WavWriter, WAVE_FORMAT_PCM
+
+# Write a (frames, channels) or mono sample array to a wav file in the test's directory
+# Returns write(name, data, rate, sampwidth=2, is_float=False), which returns the file's path
+@pytest.fixture
+def write_wav(tmp_path):
+    def write(name, data, rate, sampwidth=2, is_float=False):
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = data.reshape(-1, 1)
+        wav_file = tmp_path / name
+        with WavWriter(str(wav_file), rate, data.shape[1], sampwidth, is_float) as writer:
+            writer.write(data)
+        return str(wav_file)
+    return write
+
+# Write a silent 16 bit Broadcast Wave file into the test's directory, with a bext chunk holding its date, time and time reference
+# Returns write(name, num_frames, rate, time_reference, date, time, channels=1), which returns the file's path
+@pytest.fixture
+def write_bwf(tmp_path):
+    def write(name, num_frames, rate, time_reference, date, time, channels=1):
+        fmt = struct.pack('<HHIIHH', WAVE_FORMAT_PCM, channels, rate, rate * channels * 2, channels * 2, 16)
+        bext = (b'\0' * (256 + 32 + 32) + date.encode('ascii').ljust(10, b'\0') + time.encode('ascii').ljust(8, b'\0')
+                + struct.pack('<II', time_reference & 0xFFFFFFFF, time_reference >> 32))
+        bext += b'\0' * (602 - len(bext))
+        samples = np.zeros((num_frames, channels), '<i2').tobytes()
+        chunks = b''.join(struct.pack('<4sI', chunk_id, len(body)) + body
+                          for chunk_id, body in [(b'fmt ', fmt), (b'bext', bext), (b'data', samples)])
+        wav_file = tmp_path / name
+        wav_file.write_bytes(struct.pack('<4sI4s', b'RIFF', 4 + len(chunks), b'WAVE') + chunks)
+        return str(wav_file)
+    return write
@@ -0,0 +1,94 @@
+from filmio.assignment import (Clip, schedule, outliers, assign_matches, predicted_starts, place_rejected,
+                               OVERLAP_TOLERANCE, OFFSET_TOLERANCE, DEFAULT_MIN_SCORE)
+from filmio.audio_util import MatchTuple
+
+def clip(camera, start, score, audio_file='a.wav', clock=None, length=10):
+    return Clip(camera, clock, [(audio_file, MatchTuple(start, start + length, score))])
+
+def test_schedule_keeps_heaviest_set():
+    # One long interval against two shorter ones that together outweigh it
+    intervals = [(0, 10, 0.8, 0), (0, 5, 0.5, 1), (5, 10, 0.5, 2)]
+    assert schedule(intervals) == {1, 2}
+
+def test_schedule_allows_overlap_within_tolerance():
+    intervals = [(0, 10, 0.5, 0), (10 - OVERLAP_TOLERANCE / 2, 20, 0.5, 1), (15, 25, 0.1, 2)]
+    assert schedule(intervals) == {0, 1}
+
+def test_schedule_empty():
+    assert schedule([]) == set()
+
+def test_outliers_need_consensus():
+    assert outliers([(0.0, 0), (50.0, 1)]) == set()
+    assert outliers([(0.0, 0), (0.5, 1), (-0.5, 2), (50.0, 3)]) == {3}
+
+def test_best_match_kept_when_consistent():
+    clips = [clip('cam', 0, 0.9), clip('cam', 20, 0.8), clip('other', 5, 0.7)]
+    assigned = assign_matches(clips)
+    assert [(audio_file, reason) for audio_file, _, reason in assigned] == [('a.wav', None)] * 3
+
+def test_overlapping_video_falls_back():
+    clips = [clip('cam', 0, 0.9),
+             Clip('cam', None, [('a.wav', MatchTuple(5, 15, 0.6)), ('b.wav', MatchTuple(5, 15, 0.4))])]
+    assigned = assign_matches(clips)
+    assert assigned[0][0] == 'a.wav'
+    assert assigned[1][:2] == ('b.wav', MatchTuple(5, 15, 0.4))
+    assert assigned[1][2] is None
+
+def test_rejected_once_nothing_left():
+    clips = [clip('cam', 0, 0.9), clip('cam', 5, 0.6), clip('cam', 40, DEFAULT_MIN_SCORE / 2)]
+    assigned = assign_matches(clips)
+    assert assigned[1][:2] == (None, None)
+    assert 'overlaps' in assigned[1][2]
+    assert assigned[2][:2] == (None, None)
+    assert 'no match scored' in assigned[2][2]
+
+def test_clock_outlier_rejected():
+    clips = [clip('cam', start, 0.9, clock=('time_of_day', 1000 + start)) for start in (0, 20, 40)]
+    clips.append(clip('cam', 60, 0.9, clock=('time_of_day', 1000 + 60 + 3 * OFFSET_TOLERANCE)))
+    assigned = assign_matches(clips)
+    assert [reason is None for _, _, reason in assigned] == [True, True, True, False]
+    assert 'disagrees' in assigned[3][2]
+
+def test_predicted_starts_from_neighbours():
+    clips = [clip('cam', start, 0.9, clock=('time_of_day', 1000 + start)) for start in (0, 20, 40)]
+    clips.append(clip('cam', 61, 0.01, clock=('time_of_day', 1060)))
+    clips.append(clip('other', 61, 0.01, clock=('time_of_day', 1060)))
+    clips.append(clip('cam', 80, 0.01, clock=('wall_clock', 1080)))
+    assigned = assign_matches(clips)
+    # Only rejected clips with a clock shared by assigned videos from their camera are predicted
+    assert predicted_starts(clips, assigned) == {3: [('a.wav', 60)]}
+
+def test_place_rejected_near_prediction():
+    clips = [clip('cam', start, 0.9, clock=('time_of_day', 1000 + start)) for start in (0, 20, 40)]
+    clips.append(clip('cam', 5, 0.01, clock=('time_of_day', 1060)))
+    assigned = assign_matches(clips)
+    assert assigned[3][2] is not None
+
+    calls = []
+    def rematch(i, audio_file, start_time):
+        calls.append((i, audio_file, start_time))
+        return MatchTuple(start_time + 0.2, start_time + 10.2, DEFAULT_MIN_SCORE * 0.6)
+    placed_assigned, placed = place_rejected(clips, assigned, rematch)
+    assert calls == [(3, 'a.wav', 60)]
+    assert placed == {3}
+    assert placed_assigned[3] == ('a.wav', MatchTuple(60.2, 70.2, DEFAULT_MIN_SCORE * 0.6), None)
+    assert placed_assigned[:3] == assigned[:3]
+
+def test_place_rejected_needs_score_and_room():
+    clips = [clip('cam', start, 0.9, clock=('time_of_day', 1000 + start)) for start in (0, 20, 40)]
+    clips.append(clip('cam', 5, 0.01, clock=('time_of_day', 1060)))
+    assigned = assign_matches(clips)
+
+    too_weak = lambda i, audio_file, start_time: MatchTuple(start_time, start_time + 10, DEFAULT_MIN_SCORE * 0.4)
+    assert place_rejected(clips, assigned, too_weak)[1] == set()
+    too_far = lambda i, audio_file, start_time: MatchTuple(start_time + 2 * OFFSET_TOLERANCE, start_time + 20, 0.9)
+    assert place_rejected(clips, assigned, too_far)[1] == set()
+    unmatched = lambda i, audio_file, start_time: None
+    assert place_rejected(clips, assigned, unmatched) == (assigned, set())
+
+def test_place_rejected_keeps_out_of_neighbours():
+    clips = [clip('cam', start, 0.9, clock=('time_of_day', 1000 + start)) for start in (0, 20, 40)]
+    clips.append(clip('cam', 70, 0.01, clock=('time_of_day', 1045)))
+    assigned = assign_matches(clips)
+    matched = lambda i, audio_file, start_time: MatchTuple(start_time, start_time + 10, 0.9)
+    assert place_rejected(clips, assigned, matched)[1] == set()
@@ -0,0 +1,209 @@
+import os
+import numpy as np
+import pytest
+from filmio import audio_util
+from filmio.audio_util import (MatchTuple, get_wav_metadata, analyze_audio, get_max_gain, louder, trim, trim_data, resampled_blocks,
+                               correct_drift, read_mono, read_channels, resample_mono, sample_reader,
+                               present_channels, fingerprint_file, match_fingerprinted)
+from filmio.wav_io import decode_wav_bytes
+from filmio.wav_io import read_wav_info, WavReader
+
+RATE = 8000
+
+def ramp(frames, channels=2):
+    return (np.arange(frames * channels) % 20000).reshape(frames, channels).astype(np.int16)
+
+def test_trim_data_slices(write_wav):
+    samples = ramp(RATE * 2)
+    wav = trim_data(write_wav('in.wav', samples, RATE), 0.5, 1.5)
+    assert wav.rate == RATE and wav.sampwidth == 2
+    assert np.array_equal(wav.data, samples[RATE // 2:RATE * 3 // 2])
+
+# Times outside the file are padded with silence
+def test_trim_data_pads(write_wav):
+    samples = ramp(RATE)
+    wav = trim_data(write_wav('in.wav', samples, RATE), -0.25, 1.25)
+    assert len(wav.data) == RATE * 3 // 2
+    assert not wav.data[:RATE // 4].any() and not wav.data[-RATE // 4:].any()
+    assert np.array_equal(wav.data[RATE // 4:RATE * 5 // 4], samples)
+
+def test_trim_data_gain_and_channels(write_wav):
+    samples = ramp(RATE, 3)
+    wav = trim_data(write_wav('in.wav', samples, RATE), 0, 1, gain=0.5, channels=[2, 0])
+    assert wav.data.dtype == np.int16
+    assert np.array_equal(wav.data, np.rint(samples[:, [2, 0]] * 0.5).astype(np.int16))
+
+def test_trim_data_bad_input(write_wav, tmp_path, capsys):
+    assert trim_data(write_wav('in.wav', ramp(RATE), RATE), 1, 0) is None
+    not_wav = tmp_path / 'not.wav'
+    not_wav.write_bytes(b'not a wav file')
+    assert trim_data(str(not_wav), 0, 1) is None
+    assert "ERR: Couldn't trim" in capsys.readouterr().out
+
+def read_all(wav_file):
+    with WavReader(wav_file) as reader:
+        return reader.read_padded(0, reader.info.num_frames)
+
+# Streaming trim writes the same samples trim_data returns
+@pytest.mark.parametrize('start_time, end_time, gain, channels', [(0.5, 1.5, 1.0, None), (-0.25, 1.25, 0.5, [1])])
+def test_trim_matches_trim_data(write_wav, tmp_path, start_time, end_time, gain, channels):
+    audio_file = write_wav('in.wav', ramp(RATE), RATE)
+    output_file = str(tmp_path / 'out.wav')
+    assert trim(audio_file, output_file, start_time, end_time, gain=gain, channels=channels)
+    info = read_wav_info(output_file)
+    assert (info.rate, info.sampwidth) == (RATE, 2)
+    assert np.array_equal(read_all(output_file), trim_data(audio_file, start_time, end_time, gain=gain, channels=channels).data)
+
+@pytest.mark.parametrize('rate_ratio', [1.0, 1.001])
+def test_trim_removes_partial_output(write_wav, tmp_path, monkeypatch, capsys, rate_ratio):
+    def fail(*args):
+        raise OSError('disk full')
+    monkeypatch.setattr(audio_util, 'scale_samples', fail)
+    output_file = str(tmp_path / 'out.wav')
+    assert trim(write_wav('in.wav', ramp(RATE), RATE), output_file, 0, 1, rate_ratio, gain=0.5) is False
+    assert 'disk full' in capsys.readouterr().out
+    assert not os.path.exists(output_file)
+
+def test_get_wav_metadata(write_bwf):
+    metadata = get_wav_metadata(write_bwf('bwf.wav', 24000, 48000, 48000 * 3600, '2024-05-01', '01:00:00', channels=2))
+    assert metadata.length == 0.5
+    assert (metadata.rate, metadata.channels, metadata.sampwidth, metadata.is_float) == (48000, 2, 2, False)
+    assert (metadata.time_reference, metadata.origination) == (48000 * 3600, '2024-05-01 01:00:00')
+
+# Metadata is remembered per file, until the file changes
+def test_get_wav_metadata_rereads_changed_file(write_bwf):
+    assert get_wav_metadata(write_bwf('bwf.wav', 8000, 8000, 0, '', '')).length == 1
+    assert get_wav_metadata(write_bwf('bwf.wav', 16000, 8000, 0, '', '')).length == 2
+
+def test_get_wav_metadata_unreadable(tmp_path, capsys):
+    not_wav = tmp_path / 'not.wav'
+    not_wav.write_bytes(b'not a wav file')
+    assert get_wav_metadata(str(not_wav)) is None
+    assert "ERR: Couldn't read header" in capsys.readouterr().out
+
+# A rate ratio too close to 1 to resample by is trimmed the same as no drift at all
+def test_trim_near_unity_ratio(write_wav, tmp_path):
+    audio_file = write_wav('in.wav', ramp(RATE), RATE)
+    expected = trim_data(audio_file, 0.25, 0.75).data
+    assert np.array_equal(trim_data(audio_file, 0.25, 0.75, 1 + 1e-11).data, expected)
+    output_file = str(tmp_path / 'out.wav')
+    assert trim(audio_file, output_file, 0.25, 0.75, 1 + 1e-11)
+    assert np.array_equal(read_all(output_file), expected)
+
+# A sine resampled by the rate ratio keeps its level, with its period stretched by the ratio
+def test_resampled_blocks(write_wav):
+    rate_ratio = 1 + 1e-3
+    sine = np.sin(2 * np.pi * 50 * np.arange(RATE * 4) / RATE) * 10000
+    with WavReader(write_wav('in.wav', sine.astype(np.int16), RATE)) as reader:
+        resampled = np.concatenate(list(resampled_blocks(reader, RATE, RATE * 2, rate_ratio)))
+    assert resampled.shape == (RATE * 2, 1)
+    expected = np.sin(2 * np.pi * 50 * (RATE + np.arange(RATE * 2) * rate_ratio) / RATE) * 10000
+    assert np.abs(resampled[:, 0] - expected).max() < 50
+
+def test_correct_drift_snaps_near_unity(write_wav, monkeypatch):
+    audio_file = write_wav('in.wav', ramp(RATE), RATE)
+    match_tuple = MatchTuple(0.5, 1.0, 0.9)
+    monkeypatch.setattr(audio_util, 'estimate_drift', lambda *args: (0.25, 1 + 1e-9))
+    assert correct_drift(audio_file, np.zeros(RATE // 2), RATE, match_tuple) == MatchTuple(0.25, 0.75, 0.9, 1.0)
+    monkeypatch.setattr(audio_util, 'estimate_drift', lambda *args: (0.25, 1 + 1e-4))
+    assert correct_drift(audio_file, np.zeros(RATE // 2), RATE, match_tuple).rate_ratio == 1 + 1e-4
+
+@pytest.mark.parametrize('sampwidth, dtype, center', [(1, np.uint8, 128), (2, np.int16, 0)])
+def test_analyze_audio(write_wav, sampwidth, dtype, center):
+    scale = 2 ** (8 * sampwidth - 1)
+    samples = np.sin(2 * np.pi * 997 * np.arange(RATE * 2) / RATE) * 0.5
+    samples[100] = -0.75 # A negative peak counts as much as a positive one
+    stats = analyze_audio(write_wav('in.wav', np.rint(samples * scale + center).astype(dtype), RATE, sampwidth))
+    assert stats.peak == pytest.approx(0.75, abs=1 / scale)
+    assert stats.rms == pytest.approx(0.5 / np.sqrt(2), abs=0.01)
+    assert stats.loudness == pytest.approx(-9.0, abs=0.2)
+
+def test_get_max_gain(write_wav, capsys):
+    audio_file = write_wav('in.wav', np.array([0, 8192, -16384, 0], np.int16), RATE)
+    assert get_max_gain(audio_file, verbose=False) == 2
+    assert get_max_gain(write_wav('silent.wav', np.zeros(RATE, np.int16), RATE), verbose=False) is None
+    assert 'is silent' in capsys.readouterr().out
+
+# Gain is applied as the matched audio is trimmed, keeping 8 bit samples centered and clipping at full scale
+@pytest.mark.parametrize('rate_ratio', [1.0, 1.001])
+def test_trim_gain(write_wav, tmp_path, rate_ratio):
+    unsigned = write_wav('u8.wav', np.array([128, 138, 118, 228, 28] * RATE, np.uint8), RATE, 1)
+    output_file = str(tmp_path / 'out.wav')
+    assert trim(unsigned, output_file, 0, 0.5, rate_ratio, gain=2)
+    trimmed = read_all(output_file)[:, 0]
+    assert trimmed.dtype == np.uint8
+    assert trimmed.min() == 0 and trimmed.max() == 255
+    if rate_ratio == 1:
+        np.testing.assert_array_equal(trimmed[:5], [128, 148, 108, 255, 0])
+    np.testing.assert_array_equal(trim_data(unsigned, 0, 0.5, rate_ratio, gain=2).data[:, 0], trimmed)
+
+def test_louder(write_wav, tmp_path):
+    samples = np.array([0, 1000, -1000, 20000], np.int16)
+    output_file = str(tmp_path / 'louder.wav')
+    assert louder(write_wav('in.wav', samples, RATE), output_file, 1.5)
+    np.testing.assert_array_equal(read_all(output_file)[:, 0], [0, 1500, -1500, 30000])
+
+# An integer gain is clipped at full scale like any other, rather than wrapping around
+def test_trim_integer_gain_clips(write_wav, tmp_path):
+    output_file = str(tmp_path / 'out.wav')
+    assert trim(write_wav('in.wav', np.array([20000, -20000, 100], np.int16), RATE), output_file, 0, 3 / RATE, gain=2)
+    np.testing.assert_array_equal(read_all(output_file)[:, 0], [32767, -32768, 200])
+
+# Reading a file at the analysis rate downmixes it the same way as audio held in memory
+@pytest.mark.parametrize('rate', [RATE, RATE // 2])
+def test_read_mono_matches_resample_mono(write_wav, rate):
+    samples = (np.random.default_rng(0).standard_normal((RATE * 3, 2)) * 3000).astype(np.int16)
+    audio_file = write_wav('in.wav', samples, RATE)
+    mono = read_mono(audio_file, rate)
+    assert mono.dtype == np.float32 and len(mono) == RATE * 3 * rate // RATE
+    np.testing.assert_allclose(mono, resample_mono(samples, RATE, rate), atol=1e-2)
+    np.testing.assert_allclose(read_mono(audio_file, rate, channel=1), resample_mono(samples[:, 1], RATE, rate), atol=1e-2)
+    np.testing.assert_allclose(read_channels(audio_file, rate).mean(axis=0), mono, atol=1e-2)
+
+# Wav data written by ffmpeg to a pipe has no sizes filled in, so it runs to the end of the data
+def test_decode_wav_bytes_from_pipe(write_wav):
+    samples = np.arange(-50, 50, dtype=np.int16).reshape(-1, 2)
+    with open(write_wav('in.wav', samples, RATE), 'rb') as f:
+        raw = bytearray(f.read())
+    data_offset = raw.index(b'data')
+    raw[4:8] = raw[data_offset + 4:data_offset + 8] = b'\xff\xff\xff\xff'
+    info, data = decode_wav_bytes(bytes(raw))
+    assert (info.rate, info.channels, info.num_frames) == (RATE, 2, 50)
+    np.testing.assert_array_equal(data, samples)
+
+def test_present_channels():
+    assert present_channels(None, 2) is None
+    assert present_channels([3, 0, 1], 2) == [0, 1]
+    with pytest.raises(ValueError):
+        present_channels([2, 3], 2)
+
+# Trimming channels a file doesn't have keeps the ones it has, or fails if it has none of them
+def test_trim_missing_channels(write_wav, tmp_path, capsys):
+    samples = ramp(RATE, 2)
+    audio_file = write_wav('in.wav', samples, RATE)
+    np.testing.assert_array_equal(trim_data(audio_file, 0, 1, channels=[1, 4]).data, samples[:, [1]])
+    assert trim(audio_file, str(tmp_path / 'out.wav'), 0, 1, channels=[4]) is False
+    assert 'Only has 2 channels' in capsys.readouterr().out
+
+# One channel, or every channel as (channels, frames), read from any range of a file
+@pytest.mark.parametrize('channel', [0, 1, None])
+def test_sample_reader(write_wav, channel):
+    samples = ramp(100, 2)
+    with WavReader(write_wav('in.wav', samples, RATE)) as reader:
+        read_ext = sample_reader(reader, channel=channel)
+        expected = np.zeros((110, 2), np.float32)
+        expected[5:105] = samples
+        expected = expected[:, channel] if channel is not None else expected.T
+        np.testing.assert_array_equal(read_ext(-5, 110), expected)
+
+# Landmarks find the clip to within a frame, and correlating around there finds its exact offset
+def test_match_fingerprinted(write_wav):
+    samples = (np.random.default_rng(0).standard_normal((RATE * 30, 2)) * 3000).astype(np.int16)
+    audio_file = write_wav('in.wav', samples, RATE)
+    fingerprints = fingerprint_file(audio_file, RATE, all_channels=True)
+    landmarks = {}
+    match_tuple = match_fingerprinted(fingerprints, audio_file, samples[12345:12345 + RATE * 8, 1], RATE, landmarks)
+    assert match_tuple.start_time * RATE == pytest.approx(12345, abs=0.01)
+    assert match_tuple.score == pytest.approx(1, abs=1e-3)
+    assert match_tuple.channel == 1
+    assert 'landmarks' in landmarks
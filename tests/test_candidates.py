@@ -0,0 +1,52 @@
+from datetime import datetime
+import pytest
+from filmio.candidates import Timestamps, CandidateIndex, parse_timecode, parse_frame_rate, wav_timestamps
+
+RATE = 8000
+
+def test_parse_timecode():
+    assert parse_timecode('01:02:03:12', fps=24) == 3723.5
+    assert parse_timecode('01:02:03;12', fps=24) == 3723.5 # Drop frame
+    assert parse_timecode('01:02:03:12') == 3723
+    assert parse_timecode('not a timecode') is None
+    assert parse_timecode(None) is None
+
+def test_parse_frame_rate():
+    assert parse_frame_rate('30000/1001') == pytest.approx(29.97, abs=0.01)
+    assert parse_frame_rate('25/0') is None
+    assert parse_frame_rate('') is None
+
+def test_wav_timestamps(write_bwf):
+    audio_file = write_bwf('take.wav', 10 * RATE, RATE, 3600 * RATE, '2024-05-01', '01:00:00')
+    timestamps = wav_timestamps(audio_file)
+    assert timestamps.time_of_day == 3600
+    # Origination is the recorder's local time
+    assert timestamps.wall_clock == datetime(2024, 5, 1, 1, 0, 0).timestamp()
+    assert timestamps.duration == 10
+
+# Three recorders an hour apart by time reference, and one without timing
+@pytest.fixture
+def index(write_bwf):
+    audio_files = [write_bwf(f'rec{hour}.wav', 600 * RATE, RATE, hour * 3600 * RATE, '', '') for hour in (1, 2, 3)]
+    untimed = write_bwf('untimed.wav', RATE, RATE, 0, '', '')
+    return CandidateIndex(audio_files + [untimed], tolerance=30), audio_files, untimed
+
+def test_candidates_within_tolerance(index):
+    candidate_index, audio_files, untimed = index
+    assert candidate_index.candidates(Timestamps(2 * 3600 + 100, None, 60)) == [audio_files[1], untimed]
+    # Starting just after the end of a recording, within the tolerance
+    assert candidate_index.candidates(Timestamps(2 * 3600 + 620, None, 60)) == [audio_files[1], untimed]
+    # Spanning the gap between two recordings
+    assert candidate_index.candidates(Timestamps(3600 + 590, None, 3600)) == audio_files[:2] + [untimed]
+
+def test_candidates_without_timestamps(index):
+    candidate_index, _, _ = index
+    assert candidate_index.candidates(Timestamps(None, None, 60)) is None
+    assert candidate_index.candidates(Timestamps(3600, None, None)) is None
+    # Only time of day is known for the audio files, so a wall clock can't be compared
+    assert candidate_index.candidates(Timestamps(None, 1.7e9, 60)) is None
+
+# When no audio file was recording around the video, its clock may be off, so every audio file is tried
+def test_candidates_nothing_in_window(index):
+    candidate_index, _, _ = index
+    assert candidate_index.candidates(Timestamps(12 * 3600, None, 60)) is None
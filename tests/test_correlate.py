@@ -0,0 +1,141 @@
+import numpy as np
+import pytest
+from filmio.correlate import (to_mono, prepare_reference, prepare_coarse_reference, correlate_reference, correlate_batch, match_reference,
+                              coarse_match, refine_match, match_windows, estimate_drift, peak_shift)
+from filmio.wav_io import padded_slice
+
+RATE = 2000
+
+# Noise with a slowly changing level, so that its energy envelope can be matched too
+def noise(seconds, seed=0, rate=RATE):
+    rng = np.random.default_rng(seed)
+    level = np.repeat(rng.uniform(0.1, 1, int(seconds * 20) + 1), rate // 20)[:int(seconds * rate)]
+    return (rng.standard_normal(int(seconds * rate)) * level).astype(np.float32)
+
+# Return read_ext for match_windows and estimate_drift, reading from samples held in memory
+def memory_reader(samples):
+    return lambda start, count: padded_slice(samples, start, count)
+
+def test_correlate_reference_finds_offset():
+    ext = noise(30)
+    reference = prepare_reference(ext, RATE, window=5)
+    lag, score, channel = correlate_reference(reference, ext[12345:12345 + 5 * RATE])
+    assert lag == pytest.approx(12345, abs=0.01)
+    assert score == pytest.approx(1, abs=1e-4)
+    assert channel == 0
+
+# A video starting before the external audio is found at a negative lag
+def test_correlate_reference_negative_lag():
+    ext = noise(30)
+    video = np.concatenate((noise(1, seed=1), ext[:4 * RATE]))
+    lag, score, _ = correlate_reference(prepare_reference(ext, RATE, window=5), video)
+    assert lag == pytest.approx(-RATE, abs=0.01)
+    assert score > 0.9
+
+def test_correlate_reference_unrelated_scores_low():
+    reference = prepare_reference(noise(30), RATE, window=5)
+    _, score, _ = correlate_reference(reference, noise(5, seed=7))
+    assert score < 0.1
+
+def test_correlate_reference_empty():
+    assert correlate_reference(prepare_reference(noise(5), RATE, window=1), np.zeros(0, np.float32)) is None
+
+def test_match_reference_in_seconds():
+    ext = noise(20)
+    offset, score, _ = match_reference(prepare_reference(ext, RATE, window=5), ext[3 * RATE:8 * RATE])
+    assert offset == pytest.approx(3, abs=0.01 / RATE)
+    assert score == pytest.approx(1, abs=1e-4)
+
+def test_coarse_then_refine():
+    ext = noise(120)
+    video = ext[50 * RATE + 321:60 * RATE]
+    coarse_reference = prepare_coarse_reference(ext, RATE, window=10)
+    approx_offset, _, _ = coarse_match(coarse_reference, video)
+    assert approx_offset == pytest.approx(50 + 321 / RATE, abs=0.1)
+    offset, score, _ = refine_match(coarse_reference, video, approx_offset, window=10)
+    assert offset * RATE == pytest.approx(50 * RATE + 321, abs=0.01)
+    assert score == pytest.approx(1, abs=1e-4)
+
+# Refining only searches within the margin, so a wrong approximate offset finds nothing that matches well
+def test_refine_stays_within_margin():
+    ext = noise(60)
+    video = ext[30 * RATE:40 * RATE]
+    offset, score, _ = refine_match(prepare_coarse_reference(ext, RATE, window=10), video, 10.0, window=10, margin=0.5)
+    assert abs(offset - 10) <= 0.5
+    assert score < 0.1
+
+def test_match_windows():
+    ext = noise(60)
+    video = ext[10 * RATE:30 * RATE] + np.random.default_rng(5).standard_normal(20 * RATE).astype(np.float32) * 0.2
+    offset, score, channel = match_windows(memory_reader(ext), len(ext), video, RATE, 5, 2)
+    assert offset == pytest.approx(10, abs=1 / RATE)
+    assert score > 0.5
+    assert channel == 0
+
+# Windows that land in unrelated audio are outvoted by the ones that agree
+def test_match_windows_outvotes_unrelated():
+    ext = noise(60)
+    video = np.concatenate((noise(6, seed=9), ext[20 * RATE:34 * RATE]))
+    offset, _, _ = match_windows(memory_reader(ext), len(ext), video, RATE, 5, 2)
+    assert offset == pytest.approx(14, abs=1 / RATE)
+
+# The external audio runs slightly fast, so the end of the video is found later in it than the start predicts
+def test_estimate_drift():
+    rate_ratio = 1 + 5e-5
+    offset = 3.0
+    ext = noise(100)
+    times = offset * RATE + np.arange(80 * RATE) * rate_ratio
+    video = np.interp(times, np.arange(len(ext)), ext).astype(np.float32)
+
+    start, estimated_ratio = estimate_drift(memory_reader(ext), video, RATE, offset)
+    assert start == pytest.approx(offset, abs=0.5 / RATE)
+    assert estimated_ratio == pytest.approx(rate_ratio, abs=1e-5)
+
+def test_estimate_drift_short_clip():
+    ext = noise(30)
+    assert estimate_drift(memory_reader(ext), ext[:20 * RATE], RATE, 0.0) is None
+
+def test_correlate_batch_matches_reference():
+    ext = np.stack((noise(30), noise(30, seed=1)))
+    reference = prepare_reference(ext, RATE, window=5)
+    rng = np.random.default_rng(3)
+    windows = [ext[i % 2, start:start + length] for i, (start, length) in enumerate([(0, 5 * RATE), (7000, 3 * RATE), (40000, 5 * RATE)])]
+    # This one runs past the end of the external audio, so only part of it overlaps
+    windows.append(np.concatenate((ext[1, 56000:], noise(3, seed=5))))
+    windows = [window + rng.standard_normal(len(window)).astype(np.float32) * 0.1 for window in windows]
+    windows.append(noise(5, seed=4)) # Unrelated audio still gives a result, with a low score
+
+    lags, scores, channels = correlate_batch(reference, windows)
+    for window, lag, score, channel in zip(windows, lags, scores, channels):
+        expected_lag, expected_score, expected_channel = correlate_reference(reference, window)
+        assert lag == pytest.approx(expected_lag, abs=1e-3)
+        assert score == pytest.approx(expected_score, abs=1e-4)
+        assert channel == expected_channel
+
+def test_correlate_batch_empty():
+    lags, scores, channels = correlate_batch(prepare_reference(noise(5), RATE, window=1), [])
+    assert len(lags) == len(scores) == len(channels) == 0
+
+def test_to_mono_averages_channels():
+    data = np.array([[1, 3], [2, 6]], dtype=np.int16)
+    np.testing.assert_array_equal(to_mono(data), [2, 4])
+    assert to_mono(data).dtype == np.float32
+
+def test_peak_shift():
+    assert peak_shift(1, 2, 1) == 0
+    assert peak_shift(0, 1, 1) == pytest.approx(0.5) # Peak halfway to the next sample
+    assert peak_shift(2, 1, 0) == 0 # Not a peak
+    np.testing.assert_allclose(peak_shift([1, 1], [2, 2], [1, 1.5]), [0, 0.25 / 1.5])
+
+# Peaks are interpolated, so an offset between two samples is found to a fraction of a sample
+def test_match_reference_subsample():
+    ext = noise(30)
+    fine = np.interp(np.arange(5 * RATE) + 3000.5, np.arange(len(ext)), ext).astype(np.float32)
+    offset, _, _ = match_reference(prepare_reference(ext, RATE, window=5), fine)
+    assert offset * RATE == pytest.approx(3000.5, abs=0.2)
+
+def test_correlate_reference_picks_best_channel():
+    ext = np.stack((noise(20, seed=2), noise(20)))
+    lag, _, channel = correlate_reference(prepare_reference(ext, RATE, window=5), ext[1, 4000:4000 + 5 * RATE])
+    assert lag == pytest.approx(4000, abs=0.01)
+    assert channel == 1
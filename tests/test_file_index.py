@@ -0,0 +1,100 @@
+import os
+import sqlite3
+import pytest
+from filmio.file_index import FileIndex, glob_filter, file_type, RACY_WINDOW_NS
+
+TYPES = {'audio': ['.wav'], 'video': ['.mov', '.mp4']}
+
+# Set the modification time of each directory under root, and root itself, to well before now,
+# so that scans don't list them again for having changed within the racy window
+def settle(root):
+    old_ns = os.stat(root).st_mtime_ns - 10 * RACY_WINDOW_NS
+    for dir_path, _, _ in os.walk(root):
+        os.utime(dir_path, ns=(old_ns, old_ns), follow_symlinks=False)
+
+@pytest.fixture
+def shoot(tmp_path, write_bwf):
+    root = tmp_path / 'shoot'
+    (root / 'cam' / 'day1').mkdir(parents=True)
+    (root / '.hidden').mkdir()
+    (root / 'cam' / 'day1' / 'a.mov').write_bytes(b'')
+    (root / 'cam' / 'b.MP4').write_bytes(b'')
+    (root / 'cam' / 'notes.txt').write_bytes(b'')
+    (root / '.hidden' / 'c.mov').write_bytes(b'')
+    os.replace(write_bwf('rec.wav', 8000, 8000, 0, '', ''), root / 'rec.wav')
+    return root
+
+def names(found, root):
+    return [os.path.relpath(indexed.path, root) for indexed in found]
+
+def test_file_type():
+    assert file_type('clip.MOV', TYPES) == 'video'
+    assert file_type('take.wav', TYPES) == 'audio'
+    assert file_type('notes.txt', TYPES) is None
+
+def test_glob_filter():
+    assert glob_filter('cam/a.mov')
+    assert glob_filter('cam/a.mov', include=['*.mov'])
+    assert not glob_filter('cam/a.mov', include=['*.wav'])
+    assert not glob_filter('cam/a.mov', exclude=['cam/*'])
+    assert glob_filter('cam/a.mov', include=['cam/*'], exclude=['*.wav'])
+
+def test_scan(shoot, tmp_path):
+    index = FileIndex(str(tmp_path / 'index.sqlite'))
+    assert names(index.scan(str(shoot), TYPES), shoot) == ['rec.wav']
+    found = index.scan(str(shoot), TYPES, recursive=True)
+    assert names(found, shoot) == ['cam/b.MP4', 'cam/day1/a.mov', 'rec.wav']
+    assert [indexed.type for indexed in found] == ['video', 'video', 'audio']
+    assert found[2].duration == 1.0
+
+def test_scan_skips_dirs(shoot, tmp_path):
+    index = FileIndex(str(tmp_path / 'index.sqlite'))
+    assert names(index.scan(str(shoot), TYPES, recursive=True, skip_dirs=[str(shoot / 'cam' / 'day1')]), shoot) == ['cam/b.MP4', 'rec.wav']
+    assert names(index.scan(str(shoot), TYPES, recursive=True, exclude=['day1']), shoot) == ['cam/b.MP4', 'rec.wav']
+
+def test_unchanged_dirs_reused(shoot, tmp_path):
+    settle(shoot)
+    index = FileIndex(str(tmp_path / 'index.sqlite'))
+    first = index.scan(str(shoot), TYPES, recursive=True)
+    assert (index.listed, index.reused) == (3, 0)
+
+    index = FileIndex(str(tmp_path / 'index.sqlite'))
+    assert index.scan(str(shoot), TYPES, recursive=True) == first
+    assert (index.listed, index.reused) == (0, 3)
+
+def test_changed_dir_listed_again(shoot, tmp_path):
+    settle(shoot)
+    FileIndex(str(tmp_path / 'index.sqlite')).scan(str(shoot), TYPES, recursive=True)
+    (shoot / 'cam' / 'c.mov').write_bytes(b'')
+
+    index = FileIndex(str(tmp_path / 'index.sqlite'))
+    assert 'cam/c.mov' in names(index.scan(str(shoot), TYPES, recursive=True), shoot)
+    assert (index.listed, index.reused) == (1, 2)
+
+# Files of types that weren't scanned for before were left out of the index, so their directories are listed again
+def test_new_types_listed_again(shoot, tmp_path):
+    settle(shoot)
+    FileIndex(str(tmp_path / 'index.sqlite')).scan(str(shoot), {'audio': ['.wav']}, recursive=True)
+
+    index = FileIndex(str(tmp_path / 'index.sqlite'))
+    assert names(index.scan(str(shoot), TYPES, recursive=True), shoot) == ['cam/b.MP4', 'cam/day1/a.mov', 'rec.wav']
+    assert index.reused == 0
+
+def test_symlink_loop_searched_once(shoot, tmp_path):
+    os.symlink(shoot, shoot / 'cam' / 'loop')
+    os.symlink(shoot / 'cam' / 'day1', shoot / 'day1_link')
+    index = FileIndex(str(tmp_path / 'index.sqlite'))
+    found = index.scan(str(shoot), TYPES, recursive=True)
+    assert len(found) == 3
+    assert index.listed == 3
+
+def test_old_schema_replaced(shoot, tmp_path):
+    db_path = str(tmp_path / 'index.sqlite')
+    with sqlite3.connect(db_path) as conn:
+        conn.execute('CREATE TABLE dirs (path TEXT PRIMARY KEY, mtime_ns INTEGER)')
+        conn.execute('INSERT INTO dirs VALUES (?, ?)', (os.path.realpath(shoot), os.stat(shoot).st_mtime_ns))
+    conn.close()
+
+    index = FileIndex(db_path)
+    assert names(index.scan(str(shoot), TYPES), shoot) == ['rec.wav']
+    assert index.reused == 0
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from filmio import fingerprint
+from filmio.fingerprint import (build_fingerprints, clip_landmarks, locate_landmarks, array_reader, FINGERPRINT_HOP,
+                                MIN_VOTES)
+
+RATE = 8000
+
+def noise(seconds, seed=0):
+    return np.random.default_rng(seed).standard_normal(int(seconds * RATE)).astype(np.float32)
+
+@pytest.fixture(scope='module')
+def recording():
+    samples = noise(60)
+    return samples, build_fingerprints(array_reader(samples), len(samples), RATE)
+
+def test_fingerprints_sorted_by_hash(recording):
+    samples, fingerprints = recording
+    assert len(fingerprints.hashes) > 0
+    assert np.all(np.diff(fingerprints.hashes.astype(np.int64)) >= 0)
+    assert (fingerprints.num_samples, fingerprints.rate) == (len(samples), RATE)
+    assert not fingerprints.channels.any()
+
+# Clips starting between frames are located to within a frame, even with noise added
+@pytest.mark.parametrize('start', [20 * RATE, 33 * RATE + 100])
+def test_locate_landmarks(recording, start):
+    samples, fingerprints = recording
+    clip = samples[start:start + 8 * RATE] + noise(8, seed=1) * 0.3
+    lag, votes, channel = locate_landmarks(fingerprints, clip_landmarks(clip))
+    assert abs(lag - start) <= FINGERPRINT_HOP
+    assert votes >= MIN_VOTES
+    assert channel == 0
+
+def test_locate_unrelated(recording):
+    _, fingerprints = recording
+    assert locate_landmarks(fingerprints, clip_landmarks(noise(8, seed=2))) is None
+
+# Building the index a chunk at a time gives the same landmarks as building it at once
+def test_chunks_match_whole(recording, monkeypatch):
+    samples, fingerprints = recording
+    monkeypatch.setattr(fingerprint, 'CHUNK_FRAMES', 100)
+    chunked = build_fingerprints(array_reader(samples), len(samples), RATE)
+    np.testing.assert_array_equal(chunked.hashes, fingerprints.hashes)
+    np.testing.assert_array_equal(chunked.times, fingerprints.times)
+
+# Each channel is indexed separately, and a clip is located in the channel it came from
+def test_channels():
+    samples = np.stack((noise(30, seed=3), noise(30, seed=4)))
+    read = lambda start, count: np.stack([array_reader(channel)(start, count) for channel in samples])
+    fingerprints = build_fingerprints(read, samples.shape[1], RATE)
+    assert set(fingerprints.channels) == {0, 1}
+    lag, _, channel = locate_landmarks(fingerprints, clip_landmarks(samples[1, 10 * RATE:18 * RATE]))
+    assert abs(lag - 10 * RATE) <= FINGERPRINT_HOP
+    assert channel == 1
+
+def test_empty():
+    fingerprints = build_fingerprints(array_reader(np.zeros(0, np.float32)), 0, RATE)
+    assert len(fingerprints.hashes) == 0
+    assert locate_landmarks(fingerprints, clip_landmarks(noise(8))) is None
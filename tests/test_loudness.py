@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from filmio.loudness import LoudnessMeter, k_weighting
+
+def sine(seconds, rate, amplitude, freq=997, channels=1):
+    samples = amplitude * np.sin(2 * np.pi * freq * np.arange(int(seconds * rate)) / rate)
+    return np.tile(samples.reshape(-1, 1), (1, channels))
+
+def loudness(samples, rate):
+    meter = LoudnessMeter(rate, samples.shape[1])
+    meter.add(samples)
+    return meter.integrated()
+
+# At 48 kHz the filter is the one published in BS.1770
+def test_k_weighting_48k():
+    sos = k_weighting(48000)
+    np.testing.assert_allclose(sos[0], [1.53512485958697, -2.69169618940638, 1.19839281085285, 1, -1.69065929318241, 0.73248077421585],
+                               rtol=1e-9)
+    np.testing.assert_allclose(sos[1], [1, -2, 1, 1, -1.99004745483398, 0.99007225036621], rtol=1e-9)
+
+# A 1 kHz sine at -20 dB of full scale measures -23 LUFS at any rate
+@pytest.mark.parametrize('rate', [48000, 44100, 16000])
+def test_sine_loudness(rate):
+    assert loudness(sine(5, rate, 0.1), rate) == pytest.approx(-23.0, abs=0.1)
+
+# Every channel adds its loudness
+def test_channels_add():
+    assert loudness(sine(5, 48000, 0.1, channels=2), 48000) == pytest.approx(-23.0 + 10 * np.log10(2), abs=0.1)
+
+def test_blocks_of_any_length():
+    samples = sine(5, 48000, 0.1) * np.linspace(0.2, 1, 5 * 48000).reshape(-1, 1)
+    meter = LoudnessMeter(48000, 1)
+    for start in range(0, len(samples), 12345):
+        meter.add(samples[start:start + 12345])
+    assert meter.integrated() == pytest.approx(loudness(samples, 48000), abs=1e-6)
+
+# Quiet passages are gated out, so they barely lower the loudness, rather than by the 7 LU their share of the time would
+# Only the blocks overlapping both passages count towards it
+def test_gating_ignores_quiet_passages():
+    samples = np.concatenate((sine(5, 48000, 0.1), sine(20, 48000, 0.001)))
+    assert loudness(samples, 48000) == pytest.approx(-23.0, abs=0.2)
+
+def test_too_short_or_silent():
+    assert loudness(sine(0.3, 48000, 0.1), 48000) is None
+    assert loudness(np.zeros((48000, 1)), 48000) is None
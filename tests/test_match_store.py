@@ -0,0 +1,83 @@
+import os
+import pickle
+import sqlite3
+import pytest
+from filmio import match_store
+from filmio.audio_util import MatchTuple, AudioStats
+from filmio.match_store import MatchStore
+
+SETTINGS = ('fft', 8000, 0)
+
+@pytest.fixture
+def files(tmp_path):
+    video_file = tmp_path / 'clip.mov'
+    audio_file = tmp_path / 'rec.wav'
+    video_file.write_bytes(b'video')
+    audio_file.write_bytes(b'audio')
+    return str(video_file), str(audio_file)
+
+@pytest.fixture
+def store(tmp_path):
+    return MatchStore(str(tmp_path / 'matches.sqlite'))
+
+def test_put_get(store, files):
+    match_tuple = MatchTuple(1.5, 9.5, 0.75, 1.0001, 2)
+    assert store.get(*files, SETTINGS) is None
+    store.put(*files, SETTINGS, match_tuple)
+    stored = store.get(*files, SETTINGS)
+    assert stored == match_tuple and isinstance(stored.channel, int)
+    assert (store.hits, store.misses) == (1, 1)
+
+def test_other_settings_miss(store, files):
+    store.put(*files, SETTINGS, MatchTuple(1, 2, 0.5))
+    assert store.get(*files, SETTINGS[:-1] + (5,)) is None
+
+# A file that changed since it was matched is matched again
+def test_changed_file_misses(store, files):
+    store.put(*files, SETTINGS, MatchTuple(1, 2, 0.5))
+    with open(files[1], 'ab') as f:
+        f.write(b' more audio')
+    assert store.get(*files, SETTINGS) is None
+
+def test_kept_across_runs(tmp_path, files):
+    MatchStore(str(tmp_path / 'matches.sqlite')).put(*files, SETTINGS, MatchTuple(1, 2, 0.5))
+    assert MatchStore(str(tmp_path / 'matches.sqlite')).get(*files, SETTINGS) == MatchTuple(1, 2, 0.5)
+
+def test_missing_file_is_a_miss(store, files, capsys):
+    assert store.get(files[0], files[1] + '.gone', SETTINGS) is None
+    assert "ERR: Couldn't read stored match" in capsys.readouterr().out
+
+# Rows written with other MatchTuple fields can't be read back, so their table is emptied
+def test_old_schema_dropped(tmp_path, files):
+    db_path = str(tmp_path / 'matches.sqlite')
+    with sqlite3.connect(db_path) as conn:
+        conn.execute('CREATE TABLE matches (video TEXT, audio TEXT, settings TEXT, start_time REAL, PRIMARY KEY (video, audio, settings))')
+    store = MatchStore(db_path)
+    store.put(*files, SETTINGS, MatchTuple(1, 2, 0.5))
+    assert store.get(*files, SETTINGS) == MatchTuple(1, 2, 0.5)
+
+def test_pickled_store_reconnects(store, files):
+    store.put(*files, SETTINGS, MatchTuple(1, 2, 0.5))
+    assert pickle.loads(pickle.dumps(store)).get(*files, SETTINGS) == MatchTuple(1, 2, 0.5)
+
+# A connection inherited by a forked process is left to the parent, and a new one opened
+def test_new_connection_after_fork(store, files, monkeypatch):
+    parent_conn = store._connect()
+    child_pid = os.getpid() + 1
+    monkeypatch.setattr(match_store.os, 'getpid', lambda: child_pid)
+    store.put(*files, SETTINGS, MatchTuple(1, 2, 0.5))
+    assert store._connect() is not parent_conn
+    assert parent_conn in match_store._inherited_connections
+    assert store.get(*files, SETTINGS) == MatchTuple(1, 2, 0.5)
+
+# Stats are kept per audio file until it changes
+def test_stats(store, files):
+    audio_file = files[1]
+    assert store.get_stats(audio_file) is None
+    store.put_stats(audio_file, AudioStats(0.5, 0.1, -23.0))
+    assert store.get_stats(audio_file) == AudioStats(0.5, 0.1, -23.0)
+    store.put_stats(audio_file, AudioStats(0.5, 0.1, None)) # Too short or quiet to measure loudness
+    assert store.get_stats(audio_file).loudness is None
+    with open(audio_file, 'ab') as f:
+        f.write(b' more audio')
+    assert store.get_stats(audio_file) is None
@@ -0,0 +1,46 @@
+import threading
+import time
+from filmio.pipeline import run_pipeline
+
+def test_run_pipeline_chains_stages():
+    stages = [('double', lambda x: x * 2, 3), ('inc', lambda x: x + 1, 2)]
+    assert sorted(run_pipeline(range(20), stages, 2, None)) == [x * 2 + 1 for x in range(20)]
+
+def test_run_pipeline_drops_none_and_errors():
+    errors = []
+
+    def check(x):
+        if x == 3:
+            raise ValueError('bad')
+        return None if x % 2 else x
+
+    results = run_pipeline(range(6), [('check', check, 1)], 1, lambda name, item, e: errors.append((name, item, str(e))))
+    assert sorted(results) == [0, 2, 4]
+    assert errors == [('check', 3, 'bad')]
+
+# A stage never holds more than depth items waiting ahead of it
+def test_run_pipeline_bounds_queues():
+    produced = []
+    consumed = []
+    most_ahead = [0]
+    lock = threading.Lock()
+
+    def produce(x):
+        with lock:
+            produced.append(x)
+            most_ahead[0] = max(most_ahead[0], len(produced) - len(consumed))
+        return x
+
+    def consume(x):
+        time.sleep(0.005)
+        with lock:
+            consumed.append(x)
+        return x
+
+    run_pipeline(range(30), [('produce', produce, 1), ('consume', consume, 1)], 2, None)
+    assert len(consumed) == 30
+    # depth items queued, one being consumed and one finished by produce waiting to be queued
+    assert most_ahead[0] <= 2 + 2
+
+def test_run_pipeline_empty():
+    assert run_pipeline([], [('a', lambda x: x, 2), ('b', lambda x: x, 2)], 1, None) == []
@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import pytest
+from filmio import spectrum_cache
+from filmio.spectrum_cache import SpectrumCache
+from filmio.correlate import Reference, CoarseReference
+
+RATE = 8000
+
+@pytest.fixture
+def recorder(write_wav):
+    samples = np.random.default_rng(0).standard_normal(5 * 16000) * 3000
+    return write_wav('rec.wav', samples, 16000)
+
+def test_reference_resampled_to_cache_rate(recorder):
+    cache = SpectrumCache(window=1, rate=RATE)
+    reference = cache.get(recorder)
+    assert isinstance(reference, Reference)
+    assert reference.rate == RATE
+    assert reference.samples.shape == (5 * RATE,)
+    assert isinstance(cache.get(recorder, coarse=True), CoarseReference)
+
+def test_each_file_prepared_once(recorder):
+    cache = SpectrumCache(window=1, rate=RATE)
+    first = cache.get(recorder)
+    assert cache.get(recorder) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Full and coarse references are cached separately
+    cache.get(recorder, coarse=True)
+    assert cache.misses == 2
+
+def test_rewritten_file_prepared_again(recorder, write_wav):
+    cache = SpectrumCache(window=1, rate=RATE)
+    cache.get(recorder)
+    write_wav('rec.wav', np.zeros(16000), 16000)
+    assert cache.get(recorder).samples.shape == (RATE,)
+    assert cache.misses == 2
+
+def test_all_channels_kept(write_wav):
+    stereo = write_wav('stereo.wav', np.random.default_rng(1).standard_normal((RATE, 2)) * 3000, RATE)
+    assert SpectrumCache(window=1, rate=RATE, all_channels=True).get(stereo).samples.shape == (2, RATE)
+    assert SpectrumCache(window=1, rate=RATE).get(stereo).samples.shape == (RATE,)
+
+def test_larger_than_budget_not_kept(recorder):
+    cache = SpectrumCache(max_bytes=1000, window=1, rate=RATE)
+    assert cache.get(recorder) is not None
+    cache.get(recorder)
+    assert (cache.hits, cache.misses) == (0, 2)
+
+def test_saved_across_runs(recorder, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'spectra')
+    first = SpectrumCache(cache_dir=cache_dir, window=1, rate=RATE)
+    reference = first.get(recorder)
+    coarse = first.get(recorder, coarse=True)
+    assert len(os.listdir(cache_dir)) == 2
+
+    def unread(*args, **kwargs):
+        raise AssertionError("Saved spectra should be loaded, not prepared again")
+    monkeypatch.setattr(spectrum_cache, 'read_mono', unread)
+    second = SpectrumCache(cache_dir=cache_dir, window=1, rate=RATE)
+    loaded = second.get(recorder)
+    np.testing.assert_array_equal(loaded.spectrum, reference.spectrum)
+    assert (loaded.n_fft, loaded.window_len, loaded.rate) == (reference.n_fft, reference.window_len, reference.rate)
+    np.testing.assert_array_equal(second.get(recorder, coarse=True).envelope.spectrum, coarse.envelope.spectrum)
+
+def test_unreadable_file(tmp_path):
+    junk = tmp_path / 'junk.wav'
+    junk.write_bytes(b'not a wav file')
+    assert SpectrumCache(window=1, rate=RATE).get(str(junk)) is None
@@ -0,0 +1,106 @@
+import struct
+import numpy as np
+import pytest
+from filmio import wav_io
+from filmio.wav_io import WavReader, read_wav_info, padded_slice, stream_wav_file
+
+@pytest.mark.parametrize('sampwidth, is_float, dtype', [(1, False, np.uint8), (2, False, np.int16), (3, False, np.int32),
+                                                        (4, False, np.int32), (4, True, np.float32)])
+def test_round_trip(write_wav, sampwidth, is_float, dtype):
+    rng = np.random.default_rng(0)
+    if is_float:
+        data = rng.uniform(-1, 1, (1001, 2)).astype(dtype)
+    else:
+        info = np.iinfo(dtype) if sampwidth != 3 else wav_io._INT24_INFO
+        data = rng.integers(info.min, info.max, (1001, 2), endpoint=True).astype(dtype)
+    wav_file = write_wav('round_trip.wav', data, 48000, sampwidth, is_float)
+
+    info = read_wav_info(wav_file)
+    assert (info.rate, info.channels, info.sampwidth, info.is_float, info.num_frames) == (48000, 2, sampwidth, is_float, 1001)
+    with WavReader(wav_file) as reader:
+        np.testing.assert_array_equal(reader.read(0, 1001), data)
+
+# Files too large for a RIFF header are written as RF64, with their sizes in a ds64 chunk
+def test_rf64_round_trip(write_wav, monkeypatch):
+    monkeypatch.setattr(wav_io, 'MAX_RIFF_SIZE', 1000)
+    data = np.arange(2000, dtype=np.int16).reshape(-1, 2)
+    wav_file = write_wav('rf64.wav', data, 8000)
+
+    with open(wav_file, 'rb') as f:
+        assert f.read(4) == b'RF64'
+    info = read_wav_info(wav_file)
+    assert info.num_frames == 1000
+    with WavReader(wav_file) as reader:
+        np.testing.assert_array_equal(reader.read(0, 1000), data)
+
+def test_rf64_sentinel_size(tmp_path):
+    data = np.arange(20, dtype=np.int16).reshape(-1, 1)
+    samples = data.astype('<i2').tobytes()
+    fmt = struct.pack('<HHIIHH', wav_io.WAVE_FORMAT_PCM, 1, 8000, 16000, 2, 16)
+    raw = (struct.pack('<4sI4s', b'RF64', 0xFFFFFFFF, b'WAVE')
+           + struct.pack('<4sIQQQI', b'ds64', 28, 0, len(samples), len(data), 0)
+           + struct.pack('<4sI', b'fmt ', len(fmt)) + fmt
+           + struct.pack('<4sI', b'data', 0xFFFFFFFF) + samples)
+    wav_file = tmp_path / 'sentinel.wav'
+    wav_file.write_bytes(raw)
+    assert read_wav_info(str(wav_file)).num_frames == len(data)
+
+# Streaming a range out of a file keeps its format and pads the parts outside it with silence
+def test_stream_wav_file_range(write_wav, tmp_path):
+    data = np.arange(1, 21, dtype=np.int16).reshape(-1, 2)
+    input_file = write_wav('in.wav', data, 8000)
+    output_file = str(tmp_path / 'out.wav')
+    stream_wav_file(input_file, output_file, lambda block: block * 2, -2, 12, channels=[1])
+
+    info = read_wav_info(output_file)
+    assert (info.channels, info.sampwidth, info.num_frames) == (1, 2, 14)
+    expected = np.zeros((14, 1), np.int16)
+    expected[2:12] = data[:, [1]] * 2
+    with WavReader(output_file) as reader:
+        np.testing.assert_array_equal(reader.read(0, 14), expected)
+
+def test_bwf_timing(write_bwf):
+    time_reference = 48000 * (10 * 3600 + 5)
+    info = read_wav_info(write_bwf('bwf.wav', 100, 48000, time_reference, '2024-05-01', '10:00:05', channels=2))
+    assert info.time_reference == time_reference
+    assert info.origination == '2024-05-01 10:00:05'
+    assert info.num_frames == 100
+
+def test_bwf_other_separators(write_bwf):
+    info = read_wav_info(write_bwf('bwf.wav', 10, 8000, 2 ** 33, '2024:05:01', '10.00.05'))
+    assert info.time_reference == 2 ** 33
+    assert info.origination == '2024-05-01 10:00:05'
+
+def test_bwf_without_date(write_bwf):
+    info = read_wav_info(write_bwf('bwf.wav', 10, 8000, 1234, '', ''))
+    assert (info.time_reference, info.origination) == (1234, None)
+
+def test_not_wav(tmp_path):
+    wav_file = tmp_path / 'junk.wav'
+    wav_file.write_bytes(b'RIFF\0\0\0\0AVI LIST')
+    with pytest.raises(wav_io.WavFormatError):
+        read_wav_info(str(wav_file))
+
+def test_padded_slice_inside_is_view():
+    data = np.arange(10).reshape(-1, 1)
+    trimmed = padded_slice(data, 2, 5)
+    assert np.shares_memory(trimmed, data)
+    np.testing.assert_array_equal(trimmed[:, 0], [2, 3, 4, 5, 6])
+
+def test_padded_slice_pads_with_silence():
+    data = np.arange(1, 5, dtype=np.int16)
+    np.testing.assert_array_equal(padded_slice(data, -2, 8), [0, 0, 1, 2, 3, 4, 0, 0])
+    np.testing.assert_array_equal(padded_slice(data, 6, 3), [0, 0, 0])
+    assert len(padded_slice(data, 0, -1)) == 0
+
+    unsigned = np.full(3, 200, np.uint8)
+    np.testing.assert_array_equal(padded_slice(unsigned, -1, 5), [128, 200, 200, 200, 128])
+
+def test_read_padded(write_wav):
+    data = np.arange(1, 11, dtype=np.int16).reshape(-1, 1)
+    with WavReader(write_wav('short.wav', data, 8000)) as reader:
+        np.testing.assert_array_equal(reader.read_padded(-3, 16), padded_slice(data, -3, 16))
+        np.testing.assert_array_equal(reader.read_padded(2, 5), data[2:7])
+        np.testing.assert_array_equal(reader.read_padded(20, 4), np.zeros((4, 1)))
+    with WavReader(write_wav('unsigned.wav', np.full(4, 200, np.uint8), 8000, 1)) as reader:
+        np.testing.assert_array_equal(reader.read_padded(-1, 6)[:, 0], [128, 200, 200, 200, 200, 128])